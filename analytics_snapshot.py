@@ -0,0 +1,170 @@
+"""
+Общий снимок данных для всех публикаторов.
+
+Публикаторы читают пересекающиеся срезы bayut_properties (до 40, 40-60 и 0-40 кв.м.).
+Вместо отдельного запроса в каждом скрипте объединение нужных колонок выгружается
+один раз за цикл загрузки данных и сохраняется на локальный диск в колоночном
+формате Arrow (Feather). Снимок считается актуальным, пока не изменился
+максимальный updated_at в bayut_properties, то есть до следующей загрузки.
+Район и город (neighbourhood, city) берутся из одноименных колонок bayut_properties,
+если они заполнены при загрузке данных (см. bulk_loader.py); из location разбираются
+только строки, где их нет.
+"""
+
+import os
+import json
+import tempfile
+import logging
+from datetime import datetime
+import pandas as pd
+from price_summary import fetch_price_changes
+from database import execute_prepared, read_prepared, missing_columns
+from location_parser import add_location_columns, extract_location_parts
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'snapshots')
+META_FILE = 'meta.json'
+
+# Максимальная площадь, которая нужна хотя бы одному публикатору
+MAX_AREA = 60
+
+LISTINGS_SQL = """
+SELECT id, title, price, rooms, baths, area, location, property_url, updated_at
+FROM bayut_properties
+WHERE area <= %(max_area)s
+"""
+
+# Тот же запрос для базы, где район и город уже разобраны при загрузке
+LOCATION_LISTINGS_SQL = """
+SELECT id, title, price, rooms, baths, area, location, property_url, updated_at, neighbourhood, city
+FROM bayut_properties
+WHERE area <= %(max_area)s
+"""
+
+LOCATION_COLUMNS = ['neighbourhood', 'city']
+
+WATERMARK_SQL = "SELECT MAX(updated_at) FROM bayut_properties"
+
+def get_data_watermark(conn):
+    """Возвращает отметку текущего состояния данных (максимальный updated_at) в виде строки"""
+    with conn.cursor() as cursor:
+        execute_prepared(cursor, 'snapshot_watermark', WATERMARK_SQL)
+        watermark = cursor.fetchone()[0]
+    return watermark.isoformat() if hasattr(watermark, 'isoformat') else str(watermark)
+
+def _read_meta(snapshot_dir):
+    meta_path = os.path.join(snapshot_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Не удалось прочитать метаданные снимка: {e}")
+        return None
+
+def _write_frame(df, path):
+    """Атомарно записывает DataFrame в Feather-файл"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        df.reset_index(drop=True).to_feather(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def fill_location_columns(df):
+    """Дополняет neighbourhood и city разбором location там, где они не заполнены при загрузке"""
+    if any(column not in df.columns for column in LOCATION_COLUMNS):
+        return add_location_columns(df)
+    gaps = df['neighbourhood'].isna() | df['city'].isna()
+    if not gaps.any():
+        return df
+    parts = extract_location_parts(df.loc[gaps, 'location'])
+    df = df.copy()
+    for column in LOCATION_COLUMNS:
+        df.loc[gaps, column] = df.loc[gaps, column].fillna(parts[column])
+    return df
+
+def read_listings(conn):
+    """Объявления до MAX_AREA кв.м.; готовые колонки района и города выбираются, если они есть в таблице"""
+    params = {'max_area': MAX_AREA}
+    if missing_columns(conn, 'bayut_properties', LOCATION_COLUMNS):
+        return add_location_columns(read_prepared(conn, 'snapshot_listings', LISTINGS_SQL, params))
+    return fill_location_columns(read_prepared(conn, 'snapshot_location_listings', LOCATION_LISTINGS_SQL, params))
+
+def write_snapshot(frames, snapshot_dir, watermark):
+    """Сохраняет выгруженные DataFrame и метаданные снимка с отметкой watermark"""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for name, df in frames.items():
+        _write_frame(df, os.path.join(snapshot_dir, f"{name}.feather"))
+
+    # Метаданные пишутся последними: снимок без них считается неполным
+    meta = {
+        'watermark': watermark,
+        'created_at': datetime.now().isoformat(),
+        'rows': {name: len(df) for name, df in frames.items()},
+    }
+    meta_path = os.path.join(snapshot_dir, META_FILE)
+    fd, tmp_path = tempfile.mkstemp(dir=snapshot_dir, prefix=os.path.basename(meta_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, meta_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    logger.info(f"Снимок сохранен в {snapshot_dir}: {meta['rows']}")
+
+def read_snapshot(snapshot_dir, watermark):
+    """Читает сохраненный снимок, если он сделан при той же отметке данных; иначе возвращает None"""
+    meta = _read_meta(snapshot_dir)
+    if not meta or meta.get('watermark') != watermark:
+        return None
+    try:
+        frames = {
+            name: pd.read_feather(os.path.join(snapshot_dir, f"{name}.feather"))
+            for name in meta.get('rows', {})
+        }
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать снимок, выполняем новую выгрузку: {e}")
+        return None
+    logger.info(f"Используется сохраненный снимок данных от {meta.get('created_at')}")
+    return frames
+
+def extract_snapshot(conn, snapshot_dir=SNAPSHOT_DIR, watermark=None):
+    """Выгружает данные для всех публикаторов одним проходом и сохраняет снимок на диск"""
+    if watermark is None:
+        watermark = get_data_watermark(conn)
+
+    logger.info("Выгрузка общего снимка данных из bayut_properties...")
+    frames = {
+        'listings': read_listings(conn),
+        'price_changes': add_location_columns(fetch_price_changes(conn, min_area=0, max_area=MAX_AREA)),
+    }
+    write_snapshot(frames, snapshot_dir, watermark)
+    return frames
+
+def load_snapshot(conn, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Возвращает словарь DataFrame ('listings', 'price_changes').
+    Если данные в базе не менялись с момента создания снимка, он читается с диска,
+    иначе выполняется новая выгрузка.
+    """
+    watermark = get_data_watermark(conn)
+    frames = read_snapshot(snapshot_dir, watermark)
+    if frames is not None:
+        return frames
+    return extract_snapshot(conn, snapshot_dir, watermark)
+
+def select_area_band(df, min_area=None, max_area=None):
+    """Отбирает строки с площадью в диапазоне (min_area, max_area]"""
+    mask = pd.Series(True, index=df.index)
+    if min_area is not None:
+        mask &= df['area'] > min_area
+    if max_area is not None:
+        mask &= df['area'] <= max_area
+    return df[mask]
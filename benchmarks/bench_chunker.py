@@ -0,0 +1,92 @@
+"""
+Микро-бенчмарк разбиения отчетов на сообщения Telegram.
+
+Сравнивает прежний алгоритм split_text_into_chunks (конкатенация строк через +=)
+с общим линейным разбиением из telegram_text на сохраненных отчетах из корня
+репозитория, а также на тех же отчетах, склеенных в N раз более длинный текст.
+
+Запуск: python benchmarks/bench_chunker.py [--repeat 5] [--scale 1 10 50]
+"""
+
+import os
+import re
+import sys
+import glob
+import argparse
+import timeit
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from telegram_text import split_text_into_chunks, utf16_length
+
+def legacy_split_text_into_chunks(text, max_length=3000):
+    """Прежняя реализация из telegram_publisher.py - для сравнения"""
+    chunks = []
+    current_chunk = ""
+    paragraphs = text.split('\n')
+    for paragraph in paragraphs:
+        if len(paragraph) > max_length:
+            sentences = re.split(r'(?<=[.!?])\s+', paragraph)
+            for sentence in sentences:
+                if len(sentence) > max_length:
+                    words = sentence.split(' ')
+                    for word in words:
+                        if len(current_chunk) + len(word) + 1 > max_length:
+                            chunks.append(current_chunk.strip())
+                            current_chunk = word + " "
+                        else:
+                            current_chunk += word + " "
+                elif len(current_chunk) + len(sentence) + 1 > max_length:
+                    chunks.append(current_chunk.strip())
+                    current_chunk = sentence + " "
+                else:
+                    current_chunk += sentence + " "
+        elif len(current_chunk) + len(paragraph) + 1 > max_length:
+            chunks.append(current_chunk.strip())
+            current_chunk = paragraph + "\n"
+        else:
+            current_chunk += paragraph + "\n"
+    if current_chunk.strip():
+        chunks.append(current_chunk.strip())
+    return chunks
+
+def load_stored_reports():
+    """Читает сохраненные отчеты и проблемные чанки из корня репозитория"""
+    reports = {}
+    paths = [os.path.join(ROOT_DIR, name) for name in ('last_report_fixed.txt', 'report_cp866.txt')]
+    paths += sorted(glob.glob(os.path.join(ROOT_DIR, 'error_chunk_*.txt')))
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, encoding='utf-8-sig') as f:
+                reports[os.path.basename(path)] = f.read()
+    return reports
+
+def bench(func, text, repeat):
+    return min(timeit.repeat(lambda: func(text), number=1, repeat=repeat))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='число повторов, берется лучшее время')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 50],
+                        help='во сколько раз удлинить склеенный отчет')
+    args = parser.parse_args()
+
+    reports = load_stored_reports()
+    if not reports:
+        print("Сохраненные отчеты не найдены")
+        return
+    combined = "\n\n".join(reports.values())
+
+    print(f"{'вход':<28}{'символов':>10}{'прежний, мс':>14}{'новый, мс':>12}{'чанков':>8}{'макс. UTF-16':>14}")
+    cases = [(name, text) for name, text in reports.items() if name.startswith('last_report') or name.startswith('report_')]
+    cases += [(f"все отчеты x{scale}", "\n\n".join([combined] * scale)) for scale in args.scale]
+    for name, text in cases:
+        legacy = bench(legacy_split_text_into_chunks, text, args.repeat) * 1000
+        current = bench(split_text_into_chunks, text, args.repeat) * 1000
+        chunks = split_text_into_chunks(text)
+        longest = max(map(utf16_length, chunks)) if chunks else 0
+        print(f"{name:<28}{len(text):>10}{legacy:>14.2f}{current:>12.2f}{len(chunks):>8}{longest:>14}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Бенчмарк конвейера публикаторов на синтетических данных.
+
+Генерирует bayut_properties (benchmarks/synthetic_bayut.py), загружает ее в SQLite
+или во временную схему PostgreSQL и для каждого публикатора отдельно замеряет этапы:
+
+    refresh   - обновление сводки цен (price_summary.refresh_price_summary), только
+                PostgreSQL: сводка заранее построена, замеряется инкрементальный проход
+    extract   - запрос выгрузки, которым строится общий снимок данных (те же тексты, что
+                у публикаторов: LISTINGS_SQL и PRICE_CHANGES_SQL по сводке цен; в SQLite
+                сводка строится заранее по данным генератора)
+    snapshot  - чтение общего снимка с диска (analytics_snapshot.load_snapshot) и отбор
+                диапазона площади - основной путь публикаторов между загрузками данных
+    top_n     - отбор top-N объявлений каждой локации
+    format    - отрисовка текста отчета по шаблонам report_format
+    sanitize  - очистка текста отчета (telegram_text.sanitize_text)
+    chunk     - разбиение на сообщения Telegram
+    send      - отправка через TelegramClient с outbox во временном файле
+                и подставной HTTP-сессией вместо api.telegram.org
+
+Каждый этап повторяется --repeat раз, выводится лучшее и медианное время.
+Данные генерируются с фиксированным seed, поэтому замеры разных запусков сравнимы:
+результаты сохраняются в JSON (--save) и сравниваются с сохраненными ранее
+(--compare). Если этап стал медленнее больше чем на --threshold, скрипт завершается
+с кодом 1 - так регрессия публикатора видна до утренней публикации.
+
+Запуск:
+    python benchmarks/bench_publishers.py --ids 50000 --history 5 --save baseline.json
+    python benchmarks/bench_publishers.py --ids 50000 --history 5 --compare baseline.json
+    python benchmarks/bench_publishers.py --backend postgres    # DB_* из окружения, схема bench_<pid>
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import asyncio
+import sqlite3
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import numpy as np
+import pandas as pd
+from synthetic_bayut import (
+    generate_properties, load_sqlite, load_postgres, drop_postgres, postgres_params,
+    sqlite_query, add_generator_arguments, generator_params, load_sqlite_summary,
+)
+from analytics_snapshot import (
+    LISTINGS_SQL, WATERMARK_SQL, MAX_AREA, extract_snapshot, load_snapshot, read_snapshot,
+    write_snapshot, select_area_band,
+)
+from location_parser import add_location_columns
+from price_summary import CREATE_SUMMARY_SQL, PRICE_CHANGES_SQL, refresh_price_summary
+from ranking import top_n_per_location
+from report_format import format_cheapest_rows, format_price_change_rows, render_location_blocks
+from telegram_text import sanitize_text, split_text_into_chunks
+from telegram_delivery import TelegramClient, TelegramDelivery
+from telegram_outbox import TelegramOutbox
+from medium_apartments_publisher import realistic_price_changes
+
+STAGES = ('refresh', 'extract', 'snapshot', 'top_n', 'format', 'sanitize', 'chunk', 'send')
+
+# Публикатор -> запрос выгрузки, его параметры, кадр общего снимка, ранжирование и шаблон
+PUBLISHERS = {
+    'cheapest': {
+        'query': LISTINGS_SQL, 'params': {'max_area': 40},
+        'frame': 'listings', 'band': {'max_area': 40}, 'summary': False,
+        'rank_by': 'price', 'ascending': True, 'render': format_cheapest_rows,
+        'header': "Три самых дешевых квартиры (площадь до 40 кв.м.) в каждой локации:\n",
+    },
+    'medium': {
+        'query': PRICE_CHANGES_SQL, 'params': {'min_area': 40, 'max_area': 60},
+        'frame': 'price_changes', 'band': {'min_area': 40, 'max_area': 60}, 'summary': True,
+        'rank_by': 'abs_pct_change', 'ascending': False, 'render': format_price_change_rows,
+        'header': "Топ-3 объявления с самыми резкими изменениями цен на квартиры 40-60 кв.м. по локациям:\n",
+    },
+    'price_changes': {
+        'query': PRICE_CHANGES_SQL, 'params': {'min_area': 0, 'max_area': 40},
+        'frame': 'price_changes', 'band': {'min_area': 0, 'max_area': 40}, 'summary': True,
+        'rank_by': 'abs_pct_change', 'ascending': False, 'render': format_price_change_rows,
+        'header': "Топ-3 объявления с самыми резкими изменениями цен на квартиры до 40 кв.м. по локациям:\n",
+    },
+}
+
+DATE_COLUMNS = ('updated_at', 'current_updated_at', 'prev_updated_at')
+
+BOT_TOKEN = 'bench'
+# Лимиты Telegram в бенчмарке не ограничивают отправку: замеряются накладные расходы outbox и клиента
+UNLIMITED_RATE = 1e9
+
+class MockResponse:
+    status = 200
+    headers = {}
+
+    async def text(self):
+        return ''
+
+class MockSession:
+    """Подставная HTTP-сессия: отвечает 200 на каждый запрос через latency секунд"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.closed = False
+        self.sent = 0
+
+    @asynccontextmanager
+    async def post(self, url, json=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        yield MockResponse()
+
+    async def close(self):
+        self.closed = True
+
+def mock_send(chunks, chat_ids, outbox_path, publisher, latency=0.0):
+    """Отправляет чанки через TelegramClient и подставную сессию. Возвращает число запросов"""
+    async def deliver():
+        client = TelegramClient(BOT_TOKEN, outbox=TelegramOutbox(outbox_path))
+        client.delivery = TelegramDelivery(BOT_TOKEN, global_rate=UNLIMITED_RATE,
+                                           chat_rate=UNLIMITED_RATE, group_per_minute=UNLIMITED_RATE)
+        session = client._session = MockSession(latency)
+        try:
+            if not await client.deliver(chat_ids, chunks, publisher=publisher):
+                raise RuntimeError(f"Подставная отправка {publisher} не завершилась")
+        finally:
+            await client.close()
+        return session.sent
+
+    return asyncio.run(deliver())
+
+def measure(func, repeat):
+    """Выполняет func repeat раз. Возвращает (результат последнего вызова, времена в секундах)"""
+    gc.collect()
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    return result, times
+
+def read_frame(backend, conn, query, params):
+    if backend == 'sqlite':
+        df = pd.read_sql_query(sqlite_query(query), conn, params=params)
+        # psycopg2 возвращает даты готовыми объектами, SQLite - строками
+        for column in DATE_COLUMNS:
+            if column in df.columns:
+                df[column] = pd.to_datetime(df[column])
+        return df
+    from database import read_prepared, statement_name
+
+    return read_prepared(conn, statement_name('bench', *params.values()), query, params)
+
+def prepare_snapshot(backend, conn, snapshot_dir):
+    """Строит общий снимок данных в snapshot_dir (не замеряется)"""
+    if backend == 'postgres':
+        extract_snapshot(conn, snapshot_dir)
+        return
+    # extract_snapshot выполняет запросы PostgreSQL, поэтому для SQLite кадры собираются тут
+    frames = {
+        'listings': add_location_columns(read_frame(backend, conn, LISTINGS_SQL, {'max_area': MAX_AREA})),
+        'price_changes': add_location_columns(
+            read_frame(backend, conn, PRICE_CHANGES_SQL, {'min_area': 0, 'max_area': MAX_AREA})),
+    }
+    write_snapshot(frames, snapshot_dir, sqlite_watermark(conn))
+
+def sqlite_watermark(conn):
+    return str(conn.execute(WATERMARK_SQL).fetchone()[0])
+
+def read_band(backend, conn, snapshot_dir, spec):
+    """Путь публикатора по умолчанию: снимок с диска (после сверки отметки данных) и диапазон площади"""
+    if backend == 'postgres':
+        frames = load_snapshot(conn, snapshot_dir)
+    else:
+        frames = read_snapshot(snapshot_dir, sqlite_watermark(conn))
+    return select_area_band(frames[spec['frame']], **spec['band']).copy()
+
+def select_top(df, spec, top_n):
+    if spec['rank_by'] == 'abs_pct_change':
+        # Тот же фильтр нереалистичных и незначительных изменений, что у публикаторов
+        df = next(realistic_price_changes([df.copy()]))
+    return top_n_per_location(df, n=top_n, rank_by=spec['rank_by'], ascending=spec['ascending'])
+
+def render_report(df, spec):
+    return "\n".join([spec['header']] + render_location_blocks(df, spec['render'](df)))
+
+def run_publisher(name, spec, backend, conn, args, outbox_path, snapshot_dir):
+    """Замеряет этапы одного публикатора. Возвращает {этап: {'min', 'median', 'rows'}}"""
+    results = {}
+
+    def record(stage, func, rows=None):
+        value, times = measure(func, args.repeat)
+        results[stage] = {
+            'min': min(times),
+            'median': statistics.median(times),
+            'rows': rows(value) if rows else None,
+        }
+        return value
+
+    if spec['summary'] and backend == 'postgres':
+        record('refresh', lambda: refresh_price_summary(conn))
+    record('extract', lambda: read_frame(backend, conn, spec['query'], spec['params']), len)
+    df = record('snapshot', lambda: read_band(backend, conn, snapshot_dir, spec), len)
+    top_df = record('top_n', lambda: select_top(df, spec, args.top_n), len)
+    report = record('format', lambda: render_report(top_df, spec), len)
+    text = record('sanitize', lambda: sanitize_text(report), len)
+    chunks = record('chunk', lambda: split_text_into_chunks(text, max_length=3000), len)
+    chat_ids = [f"-100{index:010d}" for index in range(args.chats)]
+    sequence = iter(range(args.repeat))
+    record('send', lambda: mock_send(chunks, chat_ids, outbox_path, f"bench_{name}_{next(sequence)}", args.latency / 1000))
+    results['send']['rows'] = len(chunks) * len(chat_ids)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(args):
+    params = dict(generator_params(args), backend=args.backend, top_n=args.top_n, chats=args.chats, latency_ms=args.latency)
+    started = time.perf_counter()
+    df = generate_properties(**generator_params(args))
+    print(f"Сгенерировано {len(df)} строк ({args.ids} объявлений, {args.locations} локаций) "
+          f"за {time.perf_counter() - started:.2f} с")
+
+    publishers = args.publishers or list(PUBLISHERS)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bench_publishers_') as workdir:
+        outbox_path = os.path.join(workdir, 'outbox.sqlite3')
+        snapshot_dir = os.path.join(workdir, 'snapshots')
+        started = time.perf_counter()
+        if args.backend == 'sqlite':
+            conn = load_sqlite(df, os.path.join(workdir, 'bayut.sqlite3'))
+            try:
+                load_sqlite_summary(conn, df)
+                prepare_snapshot('sqlite', conn, snapshot_dir)
+                print(f"Данные, сводка цен и снимок загружены в SQLite за {time.perf_counter() - started:.2f} с")
+                for name in publishers:
+                    results[name] = run_publisher(name, PUBLISHERS[name], 'sqlite', conn, args, outbox_path, snapshot_dir)
+            finally:
+                conn.close()
+        else:
+            from dotenv import load_dotenv
+            from database import db_connection
+
+            load_dotenv()
+            schema = f"bench_{os.getpid()}"
+            with db_connection(postgres_params(schema)) as conn:
+                try:
+                    load_postgres(conn, df, schema)
+                    # Таблица сводки создается в схеме бенчмарка явно: проверка схемы в
+                    # price_summary не различает схемы и может найти рабочую сводку
+                    with conn.cursor() as cursor:
+                        cursor.execute(CREATE_SUMMARY_SQL)
+                    conn.commit()
+                    prepare_snapshot('postgres', conn, snapshot_dir)
+                    print(f"Данные, сводка цен и снимок загружены в схему PostgreSQL {schema} "
+                          f"за {time.perf_counter() - started:.2f} с")
+                    for name in publishers:
+                        results[name] = run_publisher(name, PUBLISHERS[name], 'postgres', conn, args, outbox_path, snapshot_dir)
+                finally:
+                    conn.rollback()
+                    drop_postgres(conn, schema)
+
+    return {
+        'meta': {
+            'params': params,
+            'repeat': args.repeat,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'sqlite': sqlite3.sqlite_version,
+            'machine': platform.machine(),
+        },
+        'results': results,
+    }
+
+def compare(current, baseline, threshold, noise_ms):
+    """Печатает сравнение с сохраненными замерами. Возвращает список регрессий"""
+    if current['meta']['params'] != baseline['meta']['params']:
+        print("Внимание: параметры данных отличаются от сохраненного запуска, сравнение некорректно:")
+        print(f"  сейчас:    {current['meta']['params']}")
+        print(f"  сохранено: {baseline['meta']['params']}")
+    for key in ('python', 'pandas', 'numpy', 'sqlite', 'machine'):
+        if current['meta'].get(key) != baseline['meta'].get(key):
+            print(f"Внимание: {key} {baseline['meta'].get(key)} -> {current['meta'].get(key)}")
+
+    print(f"\nСравнение с запуском {baseline['meta'].get('created_at')} (коммит {baseline['meta'].get('commit')}):")
+    print(f"{'публикатор':<15}{'этап':<10}{'было, мс':>11}{'стало, мс':>11}{'изменение':>11}")
+    regressions = []
+    for name, stages in current['results'].items():
+        for stage in STAGES:
+            before = baseline['results'].get(name, {}).get(stage)
+            if before is None or stage not in stages:
+                continue
+            old, new = before['min'] * 1000, stages[stage]['min'] * 1000
+            change = (new - old) / old if old else 0.0
+            # Мелкие этапы сравниваются с учетом шума: медленнее на threshold и на noise_ms
+            regressed = change > threshold and new - old > noise_ms
+            if regressed:
+                regressions.append(f"{name}.{stage}")
+            print(f"{name:<15}{stage:<10}{old:>11.2f}{new:>11.2f}{change:>+10.0%}{'  !' if regressed else ''}")
+    return regressions
+
+def print_results(report):
+    print(f"\n{'публикатор':<15}{'этап':<10}{'лучшее, мс':>12}{'медиана, мс':>13}{'строк':>10}")
+    for name, stages in report['results'].items():
+        for stage in STAGES:
+            result = stages.get(stage)
+            if result is None:
+                continue
+            rows = '' if result['rows'] is None else result['rows']
+            print(f"{name:<15}{stage:<10}{result['min'] * 1000:>12.2f}{result['median'] * 1000:>13.2f}{rows:>10}")
+
+def main():
+    parser = add_generator_arguments(argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter))
+    parser.add_argument('--backend', choices=('sqlite', 'postgres'), default='sqlite',
+                        help='куда загружать данные (postgres - DB_* из окружения, временная схема)')
+    parser.add_argument('--publishers', nargs='+', choices=list(PUBLISHERS), help='замерять только эти публикаторы')
+    parser.add_argument('--top-n', type=int, default=3, help='объявлений на локацию')
+    parser.add_argument('--chats', type=int, default=1, help='число чатов для подставной отправки')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа подставного Telegram, мс')
+    parser.add_argument('--repeat', type=int, default=5, help='число повторов каждого этапа')
+    parser.add_argument('--save', metavar='ФАЙЛ', help='сохранить результаты в JSON')
+    parser.add_argument('--compare', metavar='ФАЙЛ', help='сравнить с сохраненными результатами')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимое замедление этапа (доля, по умолчанию 0.2)')
+    parser.add_argument('--noise-ms', type=float, default=1.0, help='замедление меньше этого числа мс не считается регрессией')
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_results(report)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.noise_ms)
+        if regressions:
+            print(f"\nРегрессии производительности: {', '.join(regressions)}")
+            return 1
+        print("\nРегрессий не обнаружено")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Микро-бенчмарк очистки текста отчетов перед отправкой в Telegram.
+
+Сравнивает прежнюю clean_html_and_sanitize (re.sub с компиляцией выражения на каждый
+вызов и три str.replace) с общей sanitize_text из telegram_text на сохраненных
+отчетах из корня репозитория и на тех же отчетах, склеенных в N раз более длинный
+текст. Для каждого входа проверяется, что результаты обеих реализаций совпадают.
+
+Запуск: python benchmarks/bench_sanitizer.py [--repeat 5] [--scale 1 10 50]
+"""
+
+import os
+import re
+import sys
+import html
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from telegram_text import sanitize_text
+from bench_chunker import load_stored_reports, bench
+
+def legacy_clean_html_and_sanitize(text):
+    """Прежняя реализация из telegram_publisher.py - для сравнения"""
+    text = html.unescape(text)
+    text = re.sub(r'<[^>]+>', '', text)
+    text = text.replace('&', '&amp;')
+    text = text.replace('<', '&lt;')
+    text = text.replace('>', '&gt;')
+    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F]', '', text)
+    return text
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='число повторов, берется лучшее время')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 50],
+                        help='во сколько раз удлинить склеенный отчет')
+    args = parser.parse_args()
+
+    reports = load_stored_reports()
+    if not reports:
+        print("Сохраненные отчеты не найдены")
+        return
+    combined = "\n\n".join(reports.values())
+
+    print(f"{'вход':<28}{'символов':>10}{'прежний, мс':>14}{'новый, мс':>12}{'совпадает':>11}")
+    cases = [(name, text) for name, text in reports.items() if name.startswith('last_report') or name.startswith('report_')]
+    cases += [(f"все отчеты x{scale}", "\n\n".join([combined] * scale)) for scale in args.scale]
+    for name, text in cases:
+        legacy = bench(legacy_clean_html_and_sanitize, text, args.repeat) * 1000
+        current = bench(sanitize_text, text, args.repeat) * 1000
+        same = "да" if legacy_clean_html_and_sanitize(text) == sanitize_text(text) else "НЕТ"
+        print(f"{name:<28}{len(text):>10}{legacy:>14.2f}{current:>12.2f}{same:>11}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Бенчмарк холодного старта публикаторов.
+
+Каждый сценарий запускается в новом интерпретаторе, берется лучшее время из
+нескольких повторов. Для сравнения замеряется импорт того набора модулей,
+который публикаторы загружали при импорте раньше (pandas, numpy, psycopg2,
+aiohttp и модули работы с данными). Заодно проверяется, что импорт публикаторов
+не создает файлов в logs/ и reports/.
+
+Запуск: python benchmarks/bench_startup.py [--repeat 5]
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PUBLISHER_MODULES = "telegram_publisher, medium_apartments_publisher, price_changes_publisher, find_cheapest_apartments"
+
+# Модули, которые раньше загружались при импорте любого публикатора
+EAGER_IMPORTS = ("import pandas, numpy, psycopg2, aiohttp, dotenv, analytics_snapshot, ranking, "
+                 "price_summary, database, report_format, db_stream")
+
+SCENARIOS = [
+    ("интерпретатор", [sys.executable, "-c", "pass"]),
+    ("прежний импорт публикатора", [sys.executable, "-c", f"{EAGER_IMPORTS}; import {PUBLISHER_MODULES}"]),
+    ("импорт публикаторов", [sys.executable, "-c", f"import {PUBLISHER_MODULES}"]),
+    ("publish.py --check-config", [sys.executable, "publish.py", "--check-config"]),
+    ("publish.py cheapest --dry-run", [sys.executable, "publish.py", "cheapest", "--dry-run"]),
+]
+
+def cold_start(command, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def list_files(directory):
+    path = os.path.join(ROOT_DIR, directory)
+    return set(os.listdir(path)) if os.path.isdir(path) else set()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='число повторов, берется лучшее время')
+    args = parser.parse_args()
+
+    before = {directory: list_files(directory) for directory in ('logs', 'reports')}
+    print(f"{'сценарий':<34}{'время, мс':>10}")
+    for name, command in SCENARIOS:
+        print(f"{name:<34}{cold_start(command, args.repeat) * 1000:>10.0f}")
+
+    created = {directory: sorted(list_files(directory) - files) for directory, files in before.items()}
+    for directory, files in created.items():
+        if files:
+            print(f"Импорт создал файлы в {directory}/: {', '.join(files)}")
+    if not any(created.values()):
+        print("Импорт публикаторов не создал файлов в logs/ и reports/")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Генератор синтетической таблицы bayut_properties для бенчмарков.
+
+Каждое объявление (id) представлено несколькими строками истории: цена от строки
+к строке меняется случайным блужданием, updated_at растет на сутки. Настраиваются
+число объявлений, глубина истории, число локаций (популярность локаций убывает
+по закону Ципфа) и распределение площади по диапазонам. При одинаковых параметрах
+и seed данные совпадают байт в байт, поэтому замеры разных запусков сравнимы.
+
+Данные загружаются в SQLite-файл или в отдельную схему PostgreSQL (параметры
+подключения - DB_* из окружения, как у публикаторов); рабочая таблица
+bayut_properties при этом не затрагивается.
+
+Запуск: python benchmarks/synthetic_bayut.py --ids 100000 --history 5 --sqlite bench.sqlite3
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import sqlite3
+import argparse
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+DEFAULT_AREA_BANDS = "15-40:0.45,40-60:0.35,60-150:0.2"
+
+START_DATE = '2025-01-01'
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s')
+
+# Доля заголовков с HTML-разметкой и спецсимволами, чтобы очистка текста работала не вхолостую
+MARKUP_SHARE = 0.05
+
+COLUMNS = ('id', 'title', 'price', 'rooms', 'baths', 'area', 'location', 'property_url', 'updated_at')
+
+CREATE_TABLE_SQL = """
+CREATE TABLE bayut_properties (
+    id BIGINT,
+    title TEXT,
+    price {money},
+    rooms INTEGER,
+    baths INTEGER,
+    area {money},
+    location TEXT,
+    property_url TEXT,
+    updated_at TIMESTAMP
+)
+"""
+
+SUMMARY_COLUMNS = ('id', 'title', 'price', 'rooms', 'area', 'location', 'property_url', 'updated_at',
+                   'prev_price', 'prev_updated_at')
+
+CREATE_SUMMARY_TABLE_SQL = """
+CREATE TABLE bayut_price_summary (
+    id BIGINT,
+    title TEXT,
+    price REAL,
+    rooms INTEGER,
+    area REAL,
+    location TEXT,
+    property_url TEXT,
+    updated_at TIMESTAMP,
+    prev_price REAL,
+    prev_updated_at TIMESTAMP
+)
+"""
+
+CREATE_INDEXES_SQL = (
+    "CREATE INDEX bayut_properties_id_updated_at_idx ON bayut_properties (id, updated_at)",
+    "CREATE INDEX bayut_properties_area_idx ON bayut_properties (area)",
+)
+
+def parse_area_bands(spec):
+    """Разбирает '15-40:0.45,40-60:0.35' в [(от, до, доля)]; доли нормируются"""
+    bands = []
+    for part in spec.split(','):
+        bounds, _, weight = part.partition(':')
+        low, high = (float(value) for value in bounds.split('-'))
+        if high <= low:
+            raise ValueError(f"Пустой диапазон площади: {part}")
+        bands.append((low, high, float(weight or 1)))
+    total = sum(weight for _, _, weight in bands)
+    return [(low, high, weight / total) for low, high, weight in bands]
+
+def location_json(index):
+    """Значение location в формате Bayut: уровни от страны до района"""
+    return json.dumps([
+        {"level": 0, "name": "UAE"},
+        {"level": 1, "name": "Dubai", "type": "city"},
+        {"level": 2, "name": f"District {index}", "type": "neighbourhood"},
+    ])
+
+def generate_properties(ids=10000, history=5, locations=200, area_bands=DEFAULT_AREA_BANDS, seed=42):
+    """
+    Возвращает DataFrame с колонками COLUMNS.
+    history - наибольшее число строк истории на объявление (у каждого id от 1 до history строк).
+    """
+    rng = np.random.default_rng(seed)
+    bands = parse_area_bands(area_bands) if isinstance(area_bands, str) else area_bands
+
+    # Атрибуты объявлений
+    property_ids = np.arange(1, ids + 1)
+    popularity = 1 / np.arange(1, locations + 1) ** 1.1
+    location_index = rng.choice(locations, size=ids, p=popularity / popularity.sum())
+    band = rng.choice(len(bands), size=ids, p=[weight for _, _, weight in bands])
+    lows = np.array([low for low, _, _ in bands])[band]
+    highs = np.array([high for _, high, _ in bands])[band]
+    area = np.round(rng.uniform(lows, highs), 2)
+    rooms = np.clip(area // 35, 0, 5).astype(int)
+    baths = np.maximum(rooms, 1)
+    price_per_sqm = rng.lognormal(np.log(15000), 0.35, size=locations)[location_index]
+    base_price = np.round(area * price_per_sqm, -3)
+    depth = rng.integers(1, history + 1, size=ids)
+
+    # Строки истории: цена меняется примерно в половине обновлений, изредка - резко
+    rows = np.repeat(np.arange(ids), depth)
+    step = np.arange(len(rows)) - np.repeat(np.cumsum(depth) - depth, depth)
+    moves = np.where(rng.random(len(rows)) < 0.5, rng.normal(0, 0.03, len(rows)), 0.0)
+    moves[rng.random(len(rows)) < 0.01] *= 12
+    moves[step == 0] = 0
+    # Накопленная сумма логарифмов считается по всем строкам сразу, поэтому из нее
+    # вычитается значение в первой строке каждого id
+    drift = np.cumsum(np.log1p(np.clip(moves, -0.9, None)))
+    drift -= np.repeat(drift[np.cumsum(depth) - depth], depth)
+    price = np.round(base_price[rows] * np.exp(drift), -2)
+
+    titles = np.array([f"{count} BR Apartment" if count else "Studio" for count in range(6)], dtype=object)[rooms]
+    markup = rng.random(ids) < MARKUP_SHARE
+    titles[markup] = titles[markup] + " &amp; Balcony <b>Sea View</b>"
+    locations_json = np.array([location_json(index) for index in range(locations)], dtype=object)
+
+    titles = titles + " in District " + location_index.astype(str).astype(object)
+    urls = "https://www.bayut.com/property/details-" + property_ids.astype(str).astype(object) + ".html"
+
+    return pd.DataFrame({
+        'id': property_ids[rows],
+        'title': titles[rows],
+        'price': price,
+        'rooms': rooms[rows],
+        'baths': baths[rows],
+        'area': area[rows],
+        'location': locations_json[location_index[rows]],
+        'property_url': urls[rows],
+        'updated_at': pd.Timestamp(START_DATE) + pd.to_timedelta(step, unit='D'),
+    })
+
+def sqlite_query(query):
+    """Переводит запрос с параметрами psycopg2 (%(name)s, %%) в синтаксис SQLite (:name, %)"""
+    return _PLACEHOLDER.sub(r':\1', query).replace('%%', '%')
+
+def load_sqlite(df, path):
+    """Создает bayut_properties в SQLite-файле path (существующий файл перезаписывается)"""
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute(CREATE_TABLE_SQL.format(money='REAL'))
+    rows = df.assign(updated_at=df['updated_at'].dt.strftime('%Y-%m-%d %H:%M:%S'))
+    conn.executemany(f"INSERT INTO bayut_properties VALUES ({', '.join('?' * len(COLUMNS))})",
+                     rows[list(COLUMNS)].itertuples(index=False, name=None))
+    for statement in CREATE_INDEXES_SQL:
+        conn.execute(statement)
+    conn.execute("ANALYZE")
+    conn.commit()
+    return conn
+
+def price_summary_frame(df):
+    """
+    Содержимое bayut_price_summary (см. price_summary.py) для сгенерированных данных:
+    последняя и предыдущая цена каждого объявления
+    """
+    rows = df[df['price'] > 0].sort_values(['id', 'updated_at'])
+    previous = rows.groupby('id')[['price', 'updated_at']].shift()
+    rows = rows.assign(prev_price=previous['price'], prev_updated_at=previous['updated_at'])
+    return rows.groupby('id').tail(1)[list(SUMMARY_COLUMNS)]
+
+def load_sqlite_summary(conn, df):
+    """
+    Создает в SQLite готовую сводку цен bayut_price_summary. Запрос обновления сводки
+    написан для PostgreSQL, поэтому в SQLite сводка строится заранее по данным генератора
+    """
+    summary = price_summary_frame(df)
+    for column in ('updated_at', 'prev_updated_at'):
+        summary[column] = summary[column].dt.strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute("DROP TABLE IF EXISTS bayut_price_summary")
+    conn.execute(CREATE_SUMMARY_TABLE_SQL)
+    conn.executemany(f"INSERT INTO bayut_price_summary VALUES ({', '.join('?' * len(SUMMARY_COLUMNS))})",
+                     summary.astype(object).where(summary.notna(), None).itertuples(index=False, name=None))
+    conn.execute("CREATE UNIQUE INDEX bayut_price_summary_id_idx ON bayut_price_summary (id)")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+def load_postgres(conn, df, schema):
+    """
+    Создает схему schema с таблицей bayut_properties и загружает данные одним COPY.
+    Соединение должно открываться с search_path=schema (см. postgres_params).
+    """
+    from psycopg2 import sql
+
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(schema)))
+        cursor.execute(sql.SQL("CREATE SCHEMA {}").format(sql.Identifier(schema)))
+        cursor.execute(CREATE_TABLE_SQL.format(money='NUMERIC'))
+        buffer = io.StringIO()
+        df[list(COLUMNS)].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY bayut_properties ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        for statement in CREATE_INDEXES_SQL:
+            cursor.execute(statement)
+        cursor.execute("ANALYZE bayut_properties")
+    conn.commit()
+
+def drop_postgres(conn, schema):
+    from psycopg2 import sql
+
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(schema)))
+    conn.commit()
+
+def postgres_params(schema):
+    """Параметры подключения публикаторов (DB_*) с search_path на схему бенчмарка"""
+    from database import get_db_params
+
+    return dict(get_db_params(), options=f"-c search_path={schema}")
+
+def add_generator_arguments(parser):
+    parser.add_argument('--ids', type=int, default=10000, help='число объявлений (id)')
+    parser.add_argument('--history', type=int, default=5, help='наибольшее число строк истории цены на объявление')
+    parser.add_argument('--locations', type=int, default=200, help='число локаций')
+    parser.add_argument('--area-bands', default=DEFAULT_AREA_BANDS,
+                        help=f'диапазоны площади и их доли (по умолчанию {DEFAULT_AREA_BANDS})')
+    parser.add_argument('--seed', type=int, default=42, help='зерно генератора')
+    return parser
+
+def generator_params(args):
+    return {'ids': args.ids, 'history': args.history, 'locations': args.locations,
+            'area_bands': args.area_bands, 'seed': args.seed}
+
+def main():
+    parser = add_generator_arguments(argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter))
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--sqlite', metavar='ФАЙЛ', help='загрузить данные в SQLite-файл')
+    target.add_argument('--postgres-schema', metavar='СХЕМА', help='загрузить данные в схему PostgreSQL (DB_* из окружения)')
+    args = parser.parse_args()
+
+    df = generate_properties(**generator_params(args))
+    print(f"Сгенерировано {len(df)} строк для {args.ids} объявлений в {args.locations} локациях")
+    if args.sqlite:
+        load_sqlite(df, args.sqlite).close()
+        print(f"Данные загружены в {args.sqlite}")
+    else:
+        from dotenv import load_dotenv
+        from database import db_connection
+
+        load_dotenv()
+        with db_connection(postgres_params(args.postgres_schema)) as conn:
+            load_postgres(conn, df, args.postgres_schema)
+        print(f"Данные загружены в схему {args.postgres_schema}")
+
+if __name__ == "__main__":
+    main()
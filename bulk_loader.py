@@ -0,0 +1,302 @@
+"""
+Пакетная загрузка объявлений из API в bayut_properties через COPY.
+
+Снимок ответа API сначала сохраняется на диск в CSV (каталог INGEST_STAGING_DIR),
+затем одним COPY ... FROM STDIN загружается во временную таблицу и сливается
+с bayut_properties несколькими запросами на весь снимок: новые объявления
+добавляются, изменившиеся обновляются (updated_at сдвигается только у них),
+а в bayut_price_history строка добавляется лишь тогда, когда цена действительно
+изменилась. Время загрузки не зависит от числа обращений к базе на строку,
+а неизменные объявления не порождают новых строк ни в истории, ни в сводке цен
+(price_summary.py). С INGEST_LOCATION_COLUMNS=1 (или флагом --location-columns)
+район и город из JSON колонки location разбираются один раз при загрузке
+(location_parser.py) и сохраняются в колонки neighbourhood и city, чтобы
+публикаторам не приходилось разбирать location при каждом отчете.
+Если загрузка не удалась, CSV снимка остается на диске
+и может быть загружен повторно: python bulk_loader.py ingest/staging/<файл>.csv
+"""
+
+import os
+import sys
+import csv
+import json
+import tempfile
+import logging
+from datetime import datetime
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from location_parser import parse_location
+
+logger = logging.getLogger(__name__)
+
+STAGING_DIR = os.getenv('INGEST_STAGING_DIR', os.path.join('ingest', 'staging'))
+
+KEY_COLUMN = 'id'
+# Время снимка проставляет загрузчик и только у добавленных или изменившихся объявлений
+TIMESTAMP_COLUMN = 'updated_at'
+NULL_MARKER = r'\N'
+
+LOCATION_COLUMNS = os.getenv('INGEST_LOCATION_COLUMNS', '0').lower() in ('1', 'true', 'yes')
+
+# Таблица создается по образцу bayut_properties, чтобы типы колонок совпадали
+CREATE_PRICE_HISTORY_SQL = """
+CREATE TABLE IF NOT EXISTS bayut_price_history AS
+SELECT id, price, updated_at AS observed_at
+FROM bayut_properties
+WITH NO DATA
+"""
+
+CREATE_PRICE_HISTORY_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS bayut_price_history_id_idx ON bayut_price_history (id, observed_at)"
+)
+
+CREATE_STAGING_SQL = """
+CREATE TEMP TABLE bayut_properties_staging
+(LIKE bayut_properties INCLUDING DEFAULTS)
+ON COMMIT DROP
+"""
+
+# Если объявление встречается в снимке несколько раз, остается последняя строка
+DEDUPLICATE_STAGING_SQL = """
+DELETE FROM bayut_properties_staging a
+USING bayut_properties_staging b
+WHERE a.id = b.id AND a.ctid < b.ctid
+"""
+
+APPEND_PRICE_HISTORY_SQL = """
+INSERT INTO bayut_price_history (id, price, observed_at)
+SELECT s.id, s.price, %(observed_at)s
+FROM bayut_properties_staging s
+LEFT JOIN bayut_properties p ON p.id = s.id
+WHERE s.price IS NOT NULL
+AND (p.id IS NULL OR p.price IS DISTINCT FROM s.price)
+"""
+
+UPDATE_CHANGED_SQL = """
+UPDATE bayut_properties p
+SET {assignments}, updated_at = %(observed_at)s
+FROM bayut_properties_staging s
+WHERE p.id = s.id
+AND ({target_columns}) IS DISTINCT FROM ({staged_columns})
+"""
+
+INSERT_NEW_SQL = """
+INSERT INTO bayut_properties ({columns}, updated_at)
+SELECT {staged_columns}, %(observed_at)s
+FROM bayut_properties_staging s
+WHERE NOT EXISTS (SELECT 1 FROM bayut_properties p WHERE p.id = s.id)
+"""
+
+ADD_LOCATION_COLUMNS_SQL = """
+ALTER TABLE bayut_properties
+ADD COLUMN IF NOT EXISTS neighbourhood text,
+ADD COLUMN IF NOT EXISTS city text
+"""
+
+# Заполнение колонок у строк, загруженных до их появления: по одному разбору на значение location
+BACKFILL_LOCATION_SQL = """
+UPDATE bayut_properties p
+SET neighbourhood = v.neighbourhood, city = v.city
+FROM (VALUES %s) AS v(location, neighbourhood, city)
+WHERE p.location = v.location
+AND p.neighbourhood IS NULL
+"""
+
+def get_table_columns(conn, table='bayut_properties'):
+    """Колонки таблицы в порядке их объявления"""
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("SELECT * FROM {} LIMIT 0").format(sql.Identifier(table)))
+        return [column.name for column in cursor.description]
+
+def _csv_value(value):
+    if value is None:
+        return NULL_MARKER
+    if isinstance(value, (dict, list)):
+        # Вложенные структуры (например, location) хранятся строкой JSON
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+def stage_records(records, columns, staging_dir=STAGING_DIR):
+    """
+    Сохраняет снимок API в CSV для COPY: заголовок и значения колонок columns.
+    Возвращает путь к файлу. Файл пишется атомарно, поэтому неполный снимок не будет загружен.
+    """
+    os.makedirs(staging_dir, exist_ok=True)
+    path = os.path.join(staging_dir, f"bayut_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.csv")
+    fd, tmp_path = tempfile.mkstemp(dir=staging_dir, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    rows = 0
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for record in records:
+                writer.writerow([_csv_value(record.get(column)) for column in columns])
+                rows += 1
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    logger.info(f"Снимок API сохранен в {path}: {rows} объявлений")
+    return path
+
+def load_staged_file(conn, path, observed_at=None):
+    """
+    Загружает CSV снимка через временную таблицу и сливает его с bayut_properties
+    в одной транзакции. Возвращает словарь с числом загруженных, добавленных,
+    обновленных объявлений и новых записей истории цен.
+    """
+    observed_at = observed_at or datetime.now()
+    with open(path, encoding='utf-8', newline='') as f:
+        columns = next(csv.reader(f))
+    if KEY_COLUMN not in columns:
+        raise ValueError(f"В снимке {path} нет колонки {KEY_COLUMN}")
+
+    data_columns = [column for column in columns if column != TIMESTAMP_COLUMN]
+    value_columns = [column for column in data_columns if column != KEY_COLUMN]
+    params = {'observed_at': observed_at}
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_PRICE_HISTORY_SQL)
+            cursor.execute(CREATE_PRICE_HISTORY_INDEX_SQL)
+            # Не даем двум загрузкам одновременно добавить одно и то же объявление; чтение не блокируется
+            cursor.execute("LOCK TABLE bayut_properties IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute(CREATE_STAGING_SQL)
+
+            copy_sql = sql.SQL("COPY bayut_properties_staging ({}) FROM STDIN WITH (FORMAT csv, HEADER true, NULL {})").format(
+                sql.SQL(', ').join(map(sql.Identifier, columns)), sql.Literal(NULL_MARKER)
+            )
+            with open(path, encoding='utf-8', newline='') as f:
+                cursor.copy_expert(copy_sql.as_string(conn), f)
+            staged = cursor.rowcount
+            cursor.execute(DEDUPLICATE_STAGING_SQL)
+
+            price_changes = 0
+            if 'price' in value_columns:
+                cursor.execute(APPEND_PRICE_HISTORY_SQL, params)
+                price_changes = cursor.rowcount
+
+            updated = 0
+            if value_columns:
+                cursor.execute(sql.SQL(UPDATE_CHANGED_SQL).format(
+                    assignments=sql.SQL(', ').join(
+                        sql.SQL("{} = s.{}").format(sql.Identifier(column), sql.Identifier(column))
+                        for column in value_columns
+                    ),
+                    target_columns=sql.SQL(', ').join(sql.SQL("p.{}").format(sql.Identifier(column)) for column in value_columns),
+                    staged_columns=sql.SQL(', ').join(sql.SQL("s.{}").format(sql.Identifier(column)) for column in value_columns),
+                ), params)
+                updated = cursor.rowcount
+
+            cursor.execute(sql.SQL(INSERT_NEW_SQL).format(
+                columns=sql.SQL(', ').join(map(sql.Identifier, data_columns)),
+                staged_columns=sql.SQL(', ').join(sql.SQL("s.{}").format(sql.Identifier(column)) for column in data_columns),
+            ), params)
+            inserted = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    stats = {'staged': staged, 'inserted': inserted, 'updated': updated, 'price_changes': price_changes}
+    logger.info(f"Снимок {path} загружен в bayut_properties: {stats}")
+    return stats
+
+def ensure_location_columns(conn):
+    """Добавляет в bayut_properties колонки neighbourhood и city, если их нет"""
+    with conn.cursor() as cursor:
+        cursor.execute(ADD_LOCATION_COLUMNS_SQL)
+    conn.commit()
+
+def with_location_columns(records):
+    """Дополняет записи API районом и городом, разобранными из location"""
+    for record in records:
+        location = record.get('location')
+        if isinstance(location, (dict, list)):
+            location = json.dumps(location, ensure_ascii=False)
+        neighbourhood, city = parse_location(location)
+        yield {**record, 'neighbourhood': neighbourhood, 'city': city}
+
+def backfill_location_columns(conn, batch_size=1000):
+    """
+    Заполняет neighbourhood и city у строк, где они пусты.
+    Разбирается каждое различное значение location, а не каждая строка.
+    Возвращает число обновленных строк.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT location FROM bayut_properties WHERE neighbourhood IS NULL AND location IS NOT NULL")
+        values = [(location, *parse_location(location)) for (location,) in cursor.fetchall()]
+        values = [value for value in values if value[1] is not None]
+        updated = 0
+        for start in range(0, len(values), batch_size):
+            execute_values(cursor, BACKFILL_LOCATION_SQL, values[start:start + batch_size])
+            updated += cursor.rowcount
+    conn.commit()
+    logger.info(f"Район и город заполнены у {updated} объявлений ({len(values)} различных значений location)")
+    return updated
+
+def ingest(conn, records, staging_dir=STAGING_DIR, observed_at=None, location_columns=None):
+    """
+    Сохраняет записи API на диск и загружает их в bayut_properties.
+    Поля записей, которых нет в таблице, отбрасываются. После успешной загрузки файл удаляется.
+    location_columns: заполнить neighbourhood и city при загрузке (по умолчанию INGEST_LOCATION_COLUMNS).
+    """
+    if location_columns is None:
+        location_columns = LOCATION_COLUMNS
+    if location_columns:
+        ensure_location_columns(conn)
+        records = with_location_columns(records)
+    records = list(records)
+    table_columns = get_table_columns(conn)
+    present = set()
+    for record in records:
+        present.update(record)
+    columns = [column for column in table_columns if column in present]
+    skipped = sorted(present - set(table_columns))
+    if skipped:
+        logger.warning(f"Поля, отсутствующие в bayut_properties, не загружаются: {', '.join(skipped)}")
+
+    path = stage_records(records, columns, staging_dir)
+    stats = load_staged_file(conn, path, observed_at)
+    os.remove(path)
+    return stats
+
+def read_api_snapshot(path):
+    """Читает снимок API: JSON-массив объявлений, объект с ключом hits или JSON Lines"""
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        data = json.load(f)
+    return data.get('hits', []) if isinstance(data, dict) else data
+
+def main():
+    from dotenv import load_dotenv
+    from database import db_connection
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    args = sys.argv[1:]
+    location_columns = '--location-columns' in args
+    paths = [arg for arg in args if arg != '--location-columns']
+    if not paths and not location_columns:
+        print("Использование: python bulk_loader.py [--location-columns] <снимок.json|снимок.jsonl|ingest/staging/файл.csv> ...")
+        print("  --location-columns без файлов заполняет neighbourhood и city у уже загруженных объявлений")
+        sys.exit(2)
+
+    # Параметры подключения те же, что у публикаторов (database.get_db_params)
+    with db_connection() as conn:
+        for path in paths:
+            if path.endswith('.csv'):
+                # Повторная загрузка снимка, оставшегося после неудачного запуска
+                load_staged_file(conn, path)
+                os.remove(path)
+            else:
+                ingest(conn, read_api_snapshot(path), location_columns=location_columns or None)
+        if location_columns and not paths:
+            ensure_location_columns(conn)
+            backfill_location_columns(conn)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Общий слой доступа к PostgreSQL для публикаторов.
+
+- Пул соединений: в процессе планировщика (см. job_runner.py) публикаторы берут
+  готовые соединения вместо нового psycopg2.connect на каждый запуск, поэтому
+  задержка публикации до удаленного сервера сводится ко времени самих запросов.
+- Серверные подготовленные выражения (PREPARE/EXECUTE) для постоянных запросов
+  публикаторов: разбор и планирование выполняются один раз на соединение.
+- Кэш проверки схемы вместо запроса к information_schema при каждом запуске.
+  Результат проверки сохраняется на диск (SCHEMA_CACHE_PATH) с ключом "сервер:порт/база"
+  и отметкой состояния каталога для таблиц публикаторов. Отметка читается одним легким
+  запросом к pg_class/pg_attribute, а медленный запрос к information_schema выполняется,
+  только если схема действительно изменилась.
+"""
+
+import os
+import re
+import json
+import time
+import tempfile
+import logging
+import threading
+from contextlib import contextmanager
+import pandas as pd
+import psycopg2
+from psycopg2 import pool, extensions
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_MIN_CONNECTIONS = int(os.getenv('DB_POOL_MIN_CONNECTIONS', '1'))
+DB_POOL_MAX_CONNECTIONS = int(os.getenv('DB_POOL_MAX_CONNECTIONS', '5'))
+# Соединение, простаивавшее дольше, могло быть закрыто сервером или NAT - открываем новое
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', '300'))
+
+# Подготовленные выражения живут в сессии и несовместимы с pgbouncer в режиме transaction pooling
+USE_PREPARED_STATEMENTS = os.getenv('DB_PREPARED_STATEMENTS', '1').lower() not in ('0', 'false', 'no')
+
+SCHEMA_CACHE_PATH = os.getenv('SCHEMA_CACHE_PATH', os.path.join('cache', 'schema_cache.json'))
+# В пределах этого срока процесс не обращается к каталогу вовсе, даже за отметкой
+SCHEMA_CACHE_TTL = float(os.getenv('DB_SCHEMA_CACHE_TTL', '60'))
+
+# Отношения, о которых публикаторам нужно знать: наличие и набор колонок
+PROBED_RELATIONS = ('bayut_properties', 'bayut_api_view', 'bayut_price_summary', 'bayut_price_history')
+
+SCHEMA_PROBE_SQL = """
+SELECT t.table_name, t.table_type, c.column_name
+FROM information_schema.tables t
+JOIN information_schema.columns c ON c.table_schema = t.table_schema AND c.table_name = t.table_name
+WHERE t.table_schema NOT IN ('pg_catalog', 'information_schema')
+AND t.table_name = ANY(%(relations)s)
+"""
+
+# Отметка состояния каталога: меняется при создании, удалении и изменении колонок
+# отношений из PROBED_RELATIONS (DDL обновляет строки pg_class и pg_attribute и их xmin),
+# но не при ANALYZE и VACUUM, которые обновляют pg_class на месте
+CATALOG_MARKER_SQL = """
+SELECT md5(COALESCE(string_agg(
+    c.relname || ':' || c.oid::text || ':' || c.xmin::text || ':' || (
+        SELECT COALESCE(string_agg(a.attname || '@' || a.xmin::text, ',' ORDER BY a.attnum), '')
+        FROM pg_attribute a
+        WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    ),
+    ';' ORDER BY c.relname, c.oid
+), ''))
+FROM pg_class c
+WHERE c.relname = ANY(%(relations)s)
+AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+"""
+
+def get_db_params():
+    """
+    Параметры подключения из окружения; читаются при каждом вызове, то есть после load_dotenv.
+    Пароль в коде не хранится: без DB_PASSWORD используется пустой пароль, и libpq
+    берет его из PGPASSWORD или ~/.pgpass.
+    """
+    return {
+        'dbname': os.getenv('DB_NAME', 'postgres'),
+        'user': os.getenv('DB_USER', 'admin'),
+        'password': os.getenv('DB_PASSWORD', ''),
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': os.getenv('DB_PORT', '5432'),
+    }
+
+class PooledConnection(extensions.connection):
+    """Соединение пула: помнит подготовленные в своей сессии выражения и время последнего использования"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Имя выражения -> имена параметров в порядке $1, $2, ...
+        self.prepared = {}
+        self.last_used = time.monotonic()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _get_pool(params):
+    key = tuple(sorted(params.items()))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = pool.ThreadedConnectionPool(
+                DB_POOL_MIN_CONNECTIONS, DB_POOL_MAX_CONNECTIONS,
+                connection_factory=PooledConnection, client_encoding='UTF8', **params
+            )
+        return _pools[key]
+
+@contextmanager
+def db_connection(params=None):
+    """
+    Выдает соединение из пула и возвращает его обратно по выходу из блока.
+    Незавершенная транзакция откатывается, соединение с сетевой ошибкой закрывается.
+    """
+    connection_pool = _get_pool(params or get_db_params())
+    conn = connection_pool.getconn()
+    if conn.closed or time.monotonic() - conn.last_used > DB_POOL_MAX_IDLE:
+        connection_pool.putconn(conn, close=True)
+        conn = connection_pool.getconn()
+
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        conn.last_used = time.monotonic()
+        if not conn.closed and not broken:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        connection_pool.putconn(conn, close=broken or bool(conn.closed))
+
+def close_pools():
+    """Закрывает все соединения всех пулов"""
+    with _pools_lock:
+        for connection_pool in _pools.values():
+            connection_pool.closeall()
+        _pools.clear()
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s')
+
+def to_server_syntax(query):
+    """Переводит именованные параметры psycopg2 %(name)s в позиционные $1, $2, ..."""
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _PLACEHOLDER.sub(replace, query).replace('%%', '%'), names
+
+def statement_name(*parts):
+    """Имя подготовленного выражения из частей, допустимое как идентификатор SQL"""
+    return re.sub(r'\W', '_', '_'.join(str(part) for part in parts)).lower()
+
+def execute_prepared(cursor, name, query, params=None):
+    """
+    Выполняет query (с параметрами вида %(name)s) как подготовленное выражение name.
+    PREPARE отправляется один раз на соединение пула; для прочих соединений
+    или при DB_PREPARED_STATEMENTS=0 запрос выполняется обычным образом.
+    """
+    prepared = getattr(cursor.connection, 'prepared', None)
+    if not USE_PREPARED_STATEMENTS or prepared is None:
+        cursor.execute(query, params)
+        return
+
+    if name not in prepared:
+        text, names = to_server_syntax(query)
+        cursor.execute(f"PREPARE {name} AS {text}")
+        prepared[name] = names
+
+    names = prepared[name]
+    if names:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(names))})", [params[key] for key in names])
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+def read_prepared(conn, name, query, params=None):
+    """Выполняет подготовленное выражение и возвращает результат как DataFrame (как pd.read_sql_query)"""
+    with conn.cursor() as cursor:
+        execute_prepared(cursor, name, query, params)
+        columns = [column.name for column in cursor.description]
+        return pd.DataFrame.from_records(cursor.fetchall(), columns=columns, coerce_float=True)
+
+_schema_cache = {}
+_schema_lock = threading.Lock()
+
+def database_identity(conn):
+    """Идентификатор базы для кэша схемы: сервер, порт и имя базы (без обращения к серверу)"""
+    info = conn.info
+    return f"{info.host}:{info.port}/{info.dbname}"
+
+def _read_schema_cache(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Не удалось прочитать кэш схемы {path}: {e}")
+        return {}
+
+def _write_schema_cache(path, identity, marker, schema):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    cache = _read_schema_cache(path)
+    cache[identity] = {
+        'marker': marker,
+        'probed_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'schema': {
+            relation: {'type': info['type'], 'columns': sorted(info['columns'])}
+            for relation, info in schema.items()
+        },
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def _query_schema(conn):
+    schema = {}
+    with conn.cursor() as cursor:
+        cursor.execute(SCHEMA_PROBE_SQL, {'relations': list(PROBED_RELATIONS)})
+        for relation, relation_type, column in cursor.fetchall():
+            schema.setdefault(relation, {'type': relation_type, 'columns': set()})['columns'].add(column)
+    return schema
+
+def probe_schema(conn):
+    """
+    Возвращает {отношение: {'type': 'BASE TABLE' | 'VIEW', 'columns': set}} для PROBED_RELATIONS.
+    Сначала сверяется отметка каталога с сохраненной на диске; information_schema
+    запрашивается, только если отметка изменилась или кэша для этой базы еще нет.
+    """
+    identity = database_identity(conn)
+    with _schema_lock:
+        cached = _schema_cache.get(identity)
+        if cached and time.monotonic() - cached[0] < SCHEMA_CACHE_TTL:
+            return cached[1]
+
+    with conn.cursor() as cursor:
+        cursor.execute(CATALOG_MARKER_SQL, {'relations': list(PROBED_RELATIONS)})
+        marker = cursor.fetchone()[0]
+
+    stored = _read_schema_cache(SCHEMA_CACHE_PATH).get(identity)
+    if stored and stored.get('marker') == marker:
+        schema = {
+            relation: {'type': info['type'], 'columns': set(info['columns'])}
+            for relation, info in stored['schema'].items()
+        }
+    else:
+        logger.info(f"Схема базы {identity} изменилась или еще не проверялась, запрашиваем information_schema")
+        schema = _query_schema(conn)
+        try:
+            _write_schema_cache(SCHEMA_CACHE_PATH, identity, marker, schema)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кэш схемы {SCHEMA_CACHE_PATH}: {e}")
+
+    with _schema_lock:
+        _schema_cache[identity] = (time.monotonic(), schema)
+    return schema
+
+def relation_exists(conn, relation, relation_type=None):
+    """Есть ли таблица или представление relation (relation_type: 'BASE TABLE' или 'VIEW')"""
+    info = probe_schema(conn).get(relation)
+    return info is not None and (relation_type is None or info['type'] == relation_type)
+
+def missing_columns(conn, relation, columns):
+    """Колонки из columns, которых нет в relation"""
+    available = probe_schema(conn).get(relation, {}).get('columns', set())
+    return [column for column in columns if column not in available]
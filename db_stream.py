@@ -0,0 +1,34 @@
+"""
+Потоковое чтение результатов запросов из PostgreSQL.
+
+pd.read_sql_query загружает весь результат запроса в память клиента. Здесь строки
+читаются через именованный (серверный) курсор psycopg2 порциями по batch_size
+и отдаются пачками DataFrame, поэтому в памяти одновременно находится не больше
+одной пачки. Пачки удобно сворачивать в ranking.stream_top_n_per_location.
+"""
+
+import os
+import uuid
+import pandas as pd
+
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '5000'))
+
+def iter_query_batches(conn, query, params=None, batch_size=STREAM_BATCH_SIZE):
+    """
+    Выполняет запрос в серверном курсоре и возвращает генератор пачек DataFrame.
+    Запрос отправляется при получении первой пачки; именованный курсор живет
+    внутри текущей транзакции соединения, поэтому соединение не должно быть в autocommit.
+    """
+    cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+    cursor.itersize = batch_size
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            # coerce_float приводит numeric (Decimal) к float, как это делает pd.read_sql_query
+            yield pd.DataFrame.from_records(rows, columns=[column.name for column in cursor.description],
+                                            coerce_float=True)
+    finally:
+        cursor.close()
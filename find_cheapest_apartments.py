@@ -1,68 +1,85 @@
+"""
+Отбор самых дешевых квартир до 40 кв.м. в каждой локации.
+
+Импорт модуля не имеет побочных эффектов: файл лога создается и переменные
+окружения загружаются только при запуске скрипта (main), а pandas, psycopg2
+и модули работы с данными импортируются при первом вызове find_cheapest_apartments.
+"""
+
 import os
-import pandas as pd
 import logging
 from datetime import datetime
-import psycopg2
-from load_env import load_environment_variables
-from dotenv import load_dotenv
-
-# Настройка логирования
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-log_filename = f'{log_dir}/find_apartments_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+
 logger = logging.getLogger(__name__)
 
-# Загружаем переменные окружения
-load_environment_variables()
-load_dotenv()
-
-# Проверяем загрузку переменных окружения
-logger.info("Проверка переменных окружения:")
-logger.info(f"TELEGRAM_BOT_TOKEN: {'Найден' if os.getenv('TELEGRAM_BOT_TOKEN') else 'Не найден'}")
-logger.info(f"TELEGRAM_CHAT_ID: {'Найден' if os.getenv('TELEGRAM_CHAT_ID') else 'Не найден'}")
-
-# Параметры подключения к базе данных
-DB_PARAMS = {
-    'dbname': os.getenv('DB_NAME', 'postgres'),
-    'user': os.getenv('DB_USER', 'admin'),
-    'password': os.getenv('DB_PASSWORD', 'Enclude79'),
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'port': os.getenv('DB_PORT', '5432')
-}
-
-def find_cheapest_apartments():
-    """Находит самые дешевые квартиры до 40 кв.м. в каждой локации и возвращает текстовый анализ"""
+# Имя отчета в кэше отрисовки (render_cache.py)
+REPORT_NAME = os.path.splitext(os.path.basename(__file__))[0]
+
+LOG_DIR = "logs"
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Префикс файлов отчета и снимка его данных в reports/
+REPORT_PREFIX = "cheapest_apartments_with_urls"
+
+def extract_small_apartments(top_n=3, rank_by='price', sql_ranking=False, streaming=False):
+    """Выгружает из базы квартиры до 40 кв.м. (при sql_ranking и streaming - только top_n каждой локации)"""
+    from analytics_snapshot import load_snapshot, select_area_band, LISTINGS_SQL
+    from ranking import fetch_top_n_per_location, stream_top_n_per_location
+    from db_stream import iter_query_batches
+    from database import db_connection
+
+    # Подключаемся к базе данных
+    print("Подключение к базе данных...")
+    with db_connection() as conn:
+        print("Подключение к базе данных успешно")
+    
+        if sql_ranking:
+            # Ранжирование выполняется в базе: передаются только публикуемые строки
+            print(f"Получение {top_n} самых дешевых квартир каждой локации из базы данных...")
+            return fetch_top_n_per_location(conn, n=top_n, rank_by=rank_by, max_area=40)
+        if streaming:
+            # Квартиры читаются пачками, в памяти остаются только лидеры каждой локации
+            print(f"Потоковый отбор {top_n} самых дешевых квартир каждой локации...")
+            batches = iter_query_batches(conn, LISTINGS_SQL, {'max_area': 40})
+            return stream_top_n_per_location(batches, n=top_n, rank_by=rank_by)
+        # Получаем квартиры до 40 кв.м. из общего снимка данных
+        # (выгрузка из базы выполняется один раз за цикл загрузки для всех публикаторов)
+        print("Получение всех маленьких квартир из снимка данных...")
+        snapshot = load_snapshot(conn)
+        return select_area_band(snapshot['listings'], max_area=40)
+
+def find_cheapest_apartments(top_n=3, rank_by='price', sql_ranking=None, streaming=None, from_snapshot=None):
+    """
+    Находит самые дешевые квартиры до 40 кв.м. в каждой локации и возвращает текстовый анализ.
+    top_n - сколько квартир выводить в каждой локации, rank_by - колонка для ранжирования (по возрастанию).
+    sql_ranking - отбирать top_n прямо в PostgreSQL (по умолчанию берется из переменной SQL_RANKING).
+    streaming - читать квартиры из базы серверным курсором пачками и держать в памяти только
+    текущий top_n каждой локации (по умолчанию берется из переменной STREAM_RANKING).
+    from_snapshot - построить отчет по сохраненному снимку данных (путь к файлу или 'latest')
+    без подключения к базе (см. report_snapshot.py).
+    """
+    from ranking import top_n_per_location
+    from report_format import format_cheapest_rows
+    from render_cache import ReportCache, save_report
+    from report_snapshot import read_report_snapshot, save_report_snapshot
+    from telegram_text import sanitize_fields, SANITIZE_PER_FIELD
+
+    if sql_ranking is None:
+        sql_ranking = os.getenv('SQL_RANKING', '').lower() in ('1', 'true', 'yes')
+    if streaming is None:
+        streaming = os.getenv('STREAM_RANKING', '').lower() in ('1', 'true', 'yes')
+    
     try:
         # Создаем директорию для сохранения результатов анализа
         reports_dir = "reports"
         os.makedirs(reports_dir, exist_ok=True)
         
-        # Подключаемся к базе данных
-        print("Подключение к базе данных...")
-        conn = psycopg2.connect(**DB_PARAMS)
-        print("Подключение к базе данных успешно")
-        
-        # Выполняем запрос для получения всех квартир до 40 кв.м.
-        print("Выполнение запроса для получения всех маленьких квартир...")
-        query = """
-        SELECT id, title, price, rooms, baths, area, location, property_url
-        FROM bayut_properties
-        WHERE area <= 40
-        ORDER BY location, price
-        """
-        df = pd.read_sql_query(query, conn)
-        
-        # Закрываем соединение с базой
-        conn.close()
+        if from_snapshot:
+            df = read_report_snapshot(from_snapshot, REPORT_PREFIX, reports_dir)
+        else:
+            df = extract_small_apartments(top_n, rank_by, sql_ranking, streaming)
+            # Выгруженные данные сохраняются рядом с отчетом для повторной отрисовки
+            save_report_snapshot(df, REPORT_PREFIX, reports_dir)
         
         # Проверяем, есть ли данные
         if df.empty:
@@ -71,56 +88,22 @@ def find_cheapest_apartments():
         
         print(f"Получено {len(df)} квартир площадью до 40 кв.м.")
         
-        # Группируем по локации и берем 3 самых дешевых квартиры в каждой локации
-        result = []
-        result.append("Три самых дешевых квартиры (площадь до 40 кв.м.) в каждой локации:\n")
-        
-        # Получаем уникальные локации и сортируем их
-        locations = sorted(df['location'].unique())
-        
-        for location in locations:
-            if not location or pd.isna(location):
-                continue
-                
-            # Получаем 3 самые дешевые квартиры в данной локации
-            cheapest = df[df['location'] == location].sort_values('price').head(3)
-            
-            if len(cheapest) == 0:
-                continue
-                
-            result.append(f"Локация: {location}")
-            result.append("------------------------------")
-            
-            for i, (_, row) in enumerate(cheapest.iterrows(), 1):
-                price = float(row['price']) if not pd.isna(row['price']) else 0
-                formatted_price = f"{price:,.2f}"
-                
-                area = float(row['area']) if not pd.isna(row['area']) else 0
-                formatted_area = f"{area:.2f}"
-                
-                rooms = int(row['rooms']) if not pd.isna(row['rooms']) else 0
-                
-                result.append(f"{i}. {row['title']}")
-                result.append(f"   ID: {row['id']}")
-                result.append(f"   Цена: {formatted_price} AED")
-                result.append(f"   Площадь: {formatted_area} кв.м.")
-                result.append(f"   Спальни: {rooms}")
-                result.append(f"   Ссылка: {row['property_url']}")
-                result.append("")
-            
-            result.append("")
+        # Отбираем top_n самых дешевых квартир в каждой локации за один проход
+        top_df = top_n_per_location(df, n=top_n, rank_by=rank_by)
+        if SANITIZE_PER_FIELD:
+            # Очищаются только поля отобранных объявлений, а не весь текст отчета
+            top_df = sanitize_fields(top_df)
         
-        # Собираем результат в строку
-        analysis = "\n".join(result)
+        count_word = "Три" if top_n == 3 else str(top_n)
+        header = f"{count_word} самых дешевых квартиры (площадь до 40 кв.м.) в каждой локации:\n"
         
-        # Сохраняем результат в файл с датой и временем
-        current_datetime = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_file = os.path.join(reports_dir, f"cheapest_apartments_with_urls_{current_datetime}.txt")
+        # Разделы локаций, отобранные объявления которых не изменились с прошлого запуска,
+        # берутся из кэша отрисовки, остальные отрисовываются заново
+        cache = ReportCache(REPORT_NAME, render_key=f"sanitize_per_field={SANITIZE_PER_FIELD}")
+        analysis, fingerprint = cache.render(top_df, format_cheapest_rows, header)
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(analysis)
-        
-        print(f"Результаты сохранены в файл: {output_file}")
+        # Сохраняем результат в файл с датой и временем (если такого отчета еще нет на диске)
+        save_report(cache, analysis, fingerprint, reports_dir, REPORT_PREFIX)
         
         return analysis
         
@@ -128,10 +111,34 @@ def find_cheapest_apartments():
         print(f"Ошибка при поиске самых дешевых квартир: {e}")
         return None
 
-if __name__ == "__main__":
+def main(from_snapshot=None):
+    """Запуск анализа самых дешевых квартир как отдельного скрипта. Возвращает True, если отчет построен"""
+    from dotenv import load_dotenv
+    from load_env import load_environment_variables, configure_logging
+
+    configure_logging(os.path.join(LOG_DIR, f'find_apartments_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'), LOG_FORMAT)
+
+    # Загружаем переменные окружения
+    load_environment_variables()
+    load_dotenv()
+
+    # Проверяем загрузку переменных окружения
+    logger.info("Проверка переменных окружения:")
+    logger.info(f"TELEGRAM_BOT_TOKEN: {'Найден' if os.getenv('TELEGRAM_BOT_TOKEN') else 'Не найден'}")
+    logger.info(f"TELEGRAM_CHAT_ID: {'Найден' if os.getenv('TELEGRAM_CHAT_ID') else 'Не найден'}")
+
     # Запускаем анализ самых дешевых квартир
-    analysis = find_cheapest_apartments()
+    analysis = find_cheapest_apartments(from_snapshot=from_snapshot)
     if analysis:
         print(analysis)
     else:
-        print("Не удалось выполнить анализ") 
\ No newline at end of file
+        print("Не удалось выполнить анализ")
+    return bool(analysis)
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+    from report_snapshot import add_snapshot_argument
+
+    parser = add_snapshot_argument(argparse.ArgumentParser(description="Анализ самых дешевых квартир до 40 кв.м."))
+    sys.exit(0 if main(from_snapshot=parser.parse_args().from_snapshot) else 1)
@@ -0,0 +1,276 @@
+"""
+Советник по индексам для запросов публикаторов.
+
+Выполняет EXPLAIN (ANALYZE, BUFFERS) для запросов, которые публикаторы отправляют
+в bayut_properties и сводку цен, и сообщает о последовательных сканированиях
+и сортировках, ушедших на диск. Для каждой проблемы предлагает покрывающий или
+частичный индекс, а с флагом --apply создает недостающие индексы
+(CREATE INDEX CONCURRENTLY, без блокировки записи) и повторяет замеры.
+
+Запуск:
+    python index_advisor.py            # только отчет и рекомендации
+    python index_advisor.py --apply    # создать индексы и сравнить время до и после
+
+Каждый EXPLAIN ANALYZE выполняется в отдельной транзакции, которая затем
+откатывается, поэтому замер обновления сводки цен ничего не меняет в базе.
+
+Запросы, которые публикаторы выполняют подготовленными (database.read_prepared),
+разбираются в той же форме: PREPARE с параметрами $1, $2, ... и EXPLAIN EXECUTE
+с общим (generic) планом, на который PostgreSQL переходит после нескольких
+выполнений. В общем плане значение параметра неизвестно, поэтому частичные
+индексы с условием по площади (WHERE area <= 40) для таких запросов
+не предлагаются - условие area <= $1 не позволяет их использовать.
+"""
+
+import sys
+import json
+import argparse
+import psycopg2
+from psycopg2 import sql
+from database import db_connection, to_server_syntax
+from analytics_snapshot import LISTINGS_SQL, WATERMARK_SQL, MAX_AREA
+from ranking import TOP_N_PER_LOCATION_SQL
+from price_summary import REFRESH_SUMMARY_SQL, PRICE_CHANGES_SQL, FULL_HISTORY_PRICE_CHANGES_SQL, PRICE_SUMMARY_OVERLAP
+
+# При таком числе строк в bayut_properties рекомендуется секционирование по updated_at
+PARTITION_ADVICE_ROWS = 10_000_000
+
+class Candidate:
+    """Индекс-кандидат: имя, DDL и запросы, которым он помогает"""
+
+    def __init__(self, name, table, definition, queries, reason):
+        self.name = name
+        self.table = table
+        self.definition = definition
+        self.queries = queries
+        self.reason = reason
+
+    def ddl(self, concurrently=False):
+        return (f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS "
+                f"{self.name} ON {self.table} {self.definition}")
+
+CANDIDATES = [
+    Candidate(
+        "bayut_properties_id_updated_at_price_idx", "bayut_properties",
+        "(id, updated_at) INCLUDE (price) WHERE price > 0 AND updated_at IS NOT NULL",
+        ["refresh_price_summary", "full_history_price_changes"],
+        "PARTITION BY id ORDER BY updated_at читается из индекса без сортировки и обращений к таблице",
+    ),
+    Candidate(
+        "bayut_properties_location_price_idx", "bayut_properties",
+        "(location, price) INCLUDE (area)",
+        ["top_n_cheapest_sql"],
+        "порядок ранжирования ROW_NUMBER из индекса, условие по площади проверяется по INCLUDE без обращения к таблице",
+    ),
+    # Запрос демонстрационных данных выполняется с константами, а не подготовленным,
+    # поэтому частичный индекс по диапазону площади ему подходит
+    Candidate(
+        "bayut_properties_medium_updated_at_idx", "bayut_properties",
+        "(updated_at DESC) WHERE area > 40 AND area <= 60",
+        ["medium_demo_fallback"],
+        "частичный индекс по диапазону 40-60 кв.м. для выборки последних объявлений",
+    ),
+    Candidate(
+        "bayut_price_summary_area_idx", "bayut_price_summary",
+        "(area) INCLUDE (price, prev_price)",
+        ["price_changes_small", "price_changes_medium"],
+        "отбор диапазона площади в сводке цен без полного сканирования",
+    ),
+]
+
+def publisher_queries(conn):
+    """
+    Запросы публикаторов с типичными параметрами: [(имя, SQL, параметры, подготовленный ли)].
+    Подготовленными публикаторы выполняют запросы через database.read_prepared/execute_prepared.
+    """
+    top_n_sql = sql.SQL(TOP_N_PER_LOCATION_SQL).format(
+        rank_by=sql.Identifier('price'), direction=sql.SQL('ASC')
+    ).as_string(conn)
+    return [
+        ("watermark", WATERMARK_SQL, None, True),
+        ("snapshot_listings", LISTINGS_SQL, {'max_area': MAX_AREA}, True),
+        ("top_n_cheapest_sql", top_n_sql, {'max_area': 40, 'n': 3}, True),
+        ("refresh_price_summary", REFRESH_SUMMARY_SQL, {'overlap': PRICE_SUMMARY_OVERLAP}, False),
+        ("price_changes_small", PRICE_CHANGES_SQL, {'min_area': 0, 'max_area': 40}, True),
+        ("price_changes_medium", PRICE_CHANGES_SQL, {'min_area': 40, 'max_area': 60}, True),
+        ("full_history_price_changes", FULL_HISTORY_PRICE_CHANGES_SQL, {'min_area': 0, 'max_area': MAX_AREA}, False),
+        ("medium_demo_fallback", """
+            SELECT id, title, price, rooms, area, location, property_url, updated_at
+            FROM bayut_properties
+            WHERE price > 0 AND area > 40 AND area <= 60
+            ORDER BY updated_at DESC
+            LIMIT 1000
+        """, None, False),
+    ]
+
+def _walk(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _walk(child)
+
+# Имя подготовленного выражения для разбора; у публикаторов свои имена, пересечений нет
+EXPLAIN_STATEMENT = "index_advisor_explain"
+
+def explain(conn, query, params=None, prepared=False):
+    """
+    Выполняет EXPLAIN (ANALYZE, BUFFERS) и возвращает сводку плана:
+    время, буферы, последовательные сканирования и сортировки на диске.
+    prepared - разобрать общий план подготовленного выражения, как у публикаторов.
+    """
+    try:
+        with conn.cursor() as cursor:
+            if prepared:
+                text, names = to_server_syntax(query)
+                # Общий план сразу, а не после пяти выполнений (PostgreSQL 12+)
+                cursor.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+                cursor.execute(f"PREPARE {EXPLAIN_STATEMENT} AS {text}")
+                arguments = f" ({', '.join(['%s'] * len(names))})" if names else ""
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) EXECUTE {EXPLAIN_STATEMENT}{arguments}",
+                               [params[name] for name in names])
+            else:
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+            result = cursor.fetchone()[0]
+    finally:
+        # EXPLAIN ANALYZE действительно выполняет запрос: откатываем его последствия
+        conn.rollback()
+        if prepared:
+            # Подготовленные выражения живут в сессии и откатом не удаляются
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (EXPLAIN_STATEMENT,))
+                if cursor.fetchone():
+                    cursor.execute(f"DEALLOCATE {EXPLAIN_STATEMENT}")
+            conn.rollback()
+
+    if isinstance(result, str):
+        result = json.loads(result)
+    root = result[0]
+    plan = root['Plan']
+    nodes = list(_walk(plan))
+    return {
+        'time_ms': root.get('Execution Time', 0.0),
+        'shared_hit': plan.get('Shared Hit Blocks', 0),
+        'shared_read': plan.get('Shared Read Blocks', 0),
+        'seq_scans': [
+            (node.get('Relation Name'), node.get('Actual Rows', 0) * node.get('Actual Loops', 1), node.get('Filter'))
+            for node in nodes if node['Node Type'] == 'Seq Scan'
+        ],
+        'disk_sorts': [
+            (node.get('Sort Key'), node.get('Sort Space Used', 0))
+            for node in nodes if node['Node Type'] == 'Sort' and node.get('Sort Space Type') == 'Disk'
+        ],
+    }
+
+def measure(conn, queries):
+    """Замеряет все запросы; запросы, которые не удалось выполнить, попадают в отчет с ошибкой"""
+    results = {}
+    for name, query, params, prepared in queries:
+        try:
+            results[name] = explain(conn, query, params, prepared)
+        except psycopg2.Error as e:
+            results[name] = {'error': str(e).strip().splitlines()[0]}
+    return results
+
+def existing_indexes(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename IN ('bayut_properties', 'bayut_price_summary')"
+        )
+        names = {row[0] for row in cursor.fetchall()}
+    conn.rollback()
+    return names
+
+def existing_tables(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT relname FROM pg_class WHERE relname IN ('bayut_properties', 'bayut_price_summary') "
+                       "AND relkind IN ('r', 'p')")
+        names = {row[0] for row in cursor.fetchall()}
+    conn.rollback()
+    return names
+
+def recommend(results, indexes, tables):
+    """Кандидаты, которых еще нет и которые помогают запросам с проблемами в плане"""
+    proposals = []
+    for candidate in CANDIDATES:
+        if candidate.name in indexes or candidate.table not in tables:
+            continue
+        problems = [
+            name for name in candidate.queries
+            if any(relation == candidate.table for relation, _, _ in results.get(name, {}).get('seq_scans', []))
+            or results.get(name, {}).get('disk_sorts')
+        ]
+        if problems:
+            proposals.append((candidate, problems))
+    return proposals
+
+def print_report(results, title):
+    print(f"\n=== {title} ===")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name}: ошибка - {result['error']}")
+            continue
+        print(f"{name}: {result['time_ms']:.1f} мс, буферы: {result['shared_hit']} из кэша, {result['shared_read']} с диска")
+        for relation, rows, condition in result['seq_scans']:
+            print(f"  последовательное сканирование {relation}: {rows} строк" + (f", фильтр {condition}" if condition else ""))
+        for sort_key, space in result['disk_sorts']:
+            print(f"  сортировка {', '.join(sort_key or [])} ушла на диск: {space} kB (увеличьте work_mem или добавьте индекс)")
+
+def partition_advice(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = 'bayut_properties'")
+        row = cursor.fetchone()
+    conn.rollback()
+    if row and row[0] >= PARTITION_ADVICE_ROWS:
+        print(f"\nВ bayut_properties около {row[0]} строк: рассмотрите секционирование по диапазону updated_at "
+              "(PARTITION BY RANGE), чтобы выборки новых строк и история цен читали только свежие секции.")
+
+def main():
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Анализ планов запросов публикаторов и рекомендации по индексам")
+    parser.add_argument('--apply', action='store_true', help="создать рекомендованные индексы и повторить замеры")
+    args = parser.parse_args()
+
+    load_dotenv()
+    with db_connection() as conn:
+        queries = publisher_queries(conn)
+        before = measure(conn, queries)
+        print_report(before, "Текущие планы запросов")
+        partition_advice(conn)
+
+        proposals = recommend(before, existing_indexes(conn), existing_tables(conn))
+        if not proposals:
+            print("\nНедостающих индексов для запросов публикаторов не найдено.")
+            return
+
+        print("\nРекомендуемые индексы:")
+        for candidate, problems in proposals:
+            print(f"  {candidate.ddl()};")
+            print(f"    -- {candidate.reason}; запросы: {', '.join(problems)}")
+
+        if not args.apply:
+            print("\nДля создания индексов запустите: python index_advisor.py --apply")
+            return
+
+        # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                for candidate, _ in proposals:
+                    print(f"Создание {candidate.name}...")
+                    cursor.execute(candidate.ddl(concurrently=True))
+                for table in {candidate.table for candidate, _ in proposals}:
+                    cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+        finally:
+            # Соединение возвращается в общий пул
+            conn.autocommit = False
+
+        after = measure(conn, queries)
+        print_report(after, "Планы после создания индексов")
+        print("\nСравнение времени выполнения:")
+        for name in before:
+            if 'error' in before[name] or 'error' in after[name]:
+                continue
+            print(f"  {name}: {before[name]['time_ms']:.1f} мс -> {after[name]['time_ms']:.1f} мс")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Выполнение задач планировщика внутри его процесса.
+
+Вместо запуска нового интерпретатора на каждую задачу модуль публикатора
+импортируется один раз (вместе с pandas, numpy, psycopg2 и aiohttp), а его
+функция main() выполняется в общем event loop, который работает в отдельном
+потоке планировщика. Благодаря общему loop публикаторы используют одни и те же
+соединения с Telegram (см. telegram_delivery.get_telegram_client); закрываются
+они только при остановке планировщика (close).
+
+main() возвращает флаг успеха: False считается ошибкой задачи, None (скрипты
+без флага) - успехом.
+
+Таймаут в этом режиме не может прервать поток: по таймауту асинхронный main()
+отменяется на ближайшем await (публикация в Telegram после этого не отправляется,
+но уже запущенная в потоке выгрузка из базы доработает до конца), а синхронный
+main() продолжает выполняться в своем потоке. Пока такой поток не завершился,
+новый запуск того же скрипта отклоняется. Если нужен жесткий таймаут, задаче
+указывается "mode": "subprocess" - тогда процесс скрипта по таймауту завершается.
+"""
+
+import os
+import asyncio
+import inspect
+import logging
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class InProcessRunner:
+    """Запускает main() скриптов как задачи asyncio с таймаутом и перехватом ошибок"""
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._entry_points = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        # Скрипт -> future потока синхронного main(), который не уложился в таймаут
+        self._overdue = {}
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="job-runner", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def load_entry_point(self, script_name):
+        """Импортирует модуль скрипта (один раз) и возвращает его функцию main"""
+        module_name = os.path.splitext(os.path.basename(script_name))[0]
+        with self._lock:
+            if module_name not in self._entry_points:
+                module = importlib.import_module(module_name)
+                entry_point = getattr(module, 'main', None)
+                if not callable(entry_point):
+                    raise ImportError(f"В {script_name} нет функции main()")
+                self._entry_points[module_name] = entry_point
+            return self._entry_points[module_name]
+
+    async def _guarded(self, script_name, entry_point, timeout):
+        if inspect.iscoroutinefunction(entry_point):
+            coroutine = entry_point()
+        else:
+            # Синхронный main() не должен блокировать общий event loop
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(thread_name_prefix="job")
+            thread_future = self._executor.submit(entry_point)
+            coroutine = asyncio.wrap_future(thread_future)
+        try:
+            return await asyncio.wait_for(coroutine, timeout)
+        except asyncio.TimeoutError:
+            if not inspect.iscoroutinefunction(entry_point) and not thread_future.done():
+                # Поток прервать нельзя: запоминаем его, чтобы не запускать скрипт повторно поверх него
+                self._overdue[script_name] = thread_future
+            raise
+        except SystemExit as e:
+            # SystemExit, дошедший до event loop, остановил бы его вместе со всеми задачами
+            raise RuntimeError(f"скрипт завершился через sys.exit({e.code})") from None
+
+    def run(self, script_name, timeout):
+        """
+        Выполняет main() скрипта, ждет завершения и возвращает его результат (флаг успеха).
+        Исключения задачи (включая asyncio.TimeoutError) пробрасываются вызывающему.
+        """
+        overdue = self._overdue.get(script_name)
+        if overdue is not None:
+            if not overdue.done():
+                raise RuntimeError(f"предыдущий запуск {script_name} превысил таймаут и еще выполняется")
+            del self._overdue[script_name]
+        entry_point = self.load_entry_point(script_name)
+        future = asyncio.run_coroutine_threadsafe(self._guarded(script_name, entry_point, timeout), self._ensure_loop())
+        return future.result()
+
+    def close(self):
+        """Закрывает общие соединения (Telegram и пул базы данных) и останавливает event loop"""
+        if self._loop is None:
+            return
+        try:
+            from telegram_delivery import close_telegram_clients
+            asyncio.run_coroutine_threadsafe(close_telegram_clients(), self._loop).result(timeout=10)
+        except Exception as e:
+            logger.warning(f"Не удалось закрыть соединения с Telegram: {e}")
+        try:
+            from database import close_pools
+            close_pools()
+        except Exception as e:
+            logger.warning(f"Не удалось закрыть пул соединений с базой данных: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+        self._loop.close()
+        self._loop = None
+        if self._executor is not None:
+            # Потоки, не уложившиеся в таймаут, не ждем: они daemon-процесса не держат
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -1,13 +1,27 @@
 import os
 import logging
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def configure_logging(log_file=None, fmt=LOG_FORMAT, stream=None):
+    """
+    Настраивает логирование при запуске скрипта (а не при импорте модуля).
+    Если логирование уже настроено (например, планировщиком, который выполняет
+    скрипт в своем процессе), ничего не меняет. Возвращает путь к файлу лога или None.
+    """
+    if logging.getLogger().handlers:
+        return None
+    handlers = [logging.StreamHandler(stream)]
+    if log_file:
+        directory = os.path.dirname(log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handlers.insert(0, logging.FileHandler(log_file, encoding='utf-8'))
+    logging.basicConfig(level=logging.INFO, format=fmt, handlers=handlers)
+    return log_file
+
 def load_environment_variables():
     """Загружает переменные окружения из файла .env"""
     env_file = '.env'
@@ -41,4 +55,5 @@ def set_telegram_env_vars(bot_token=None, channel_id=None):
         logger.info("Установлен TELEGRAM_CHANNEL_ID")
         
 if __name__ == "__main__":
-    load_environment_variables() 
\ No newline at end of file
+    configure_logging()
+    load_environment_variables()
@@ -0,0 +1,119 @@
+"""
+Разбор колонки location: название района (neighbourhood) и города.
+
+В location хранится JSON (иногда в виде Python-литерала с одинарными кавычками)
+со списком уровней местоположения: [{"level": 0, "name": "UAE"}, {"level": 1,
+"name": "Dubai", "type": "city"}, {"level": 2, "name": "Dubai Marina",
+"type": "neighbourhood"}, ...]. Различных значений location на порядки меньше,
+чем объявлений, поэтому каждое уникальное значение разбирается один раз
+(pd.factorize + кэш), а результат раскладывается по строкам одним take.
+Для разбора используется orjson, если он установлен.
+"""
+
+import re
+import ast
+import json
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    _loads = orjson.loads
+    _JSON_ERRORS = (orjson.JSONDecodeError, TypeError)
+except ImportError:
+    _loads = json.loads
+    _JSON_ERRORS = (json.JSONDecodeError, TypeError)
+
+# Запасной разбор невалидного JSON регулярными выражениями, в порядке приоритета
+_FALLBACK_PATTERNS = [
+    re.compile(r'"type": "neighbourhood".*?"name": "([^"]+)"'),
+    re.compile(r'"level": 2.*?"name": "([^"]+)"'),
+    re.compile(r'"level": 1.*?"name": "([^"]+)"'),
+    re.compile(r'"name": "([^"]+)"'),
+]
+_CITY_PATTERN = re.compile(r'"level": 1.*?"name": "([^"]+)"')
+
+def _load_levels(location):
+    """Список уровней местоположения или None, если строку не удалось разобрать"""
+    try:
+        return _loads(location)
+    except _JSON_ERRORS:
+        pass
+    if "'" in location:
+        try:
+            return _loads(location.replace("'", '"'))
+        except _JSON_ERRORS:
+            pass
+        try:
+            # Python-литерал: сохраняет апострофы в названиях, которые ломает замена кавычек
+            return ast.literal_eval(location)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            pass
+    return None
+
+@lru_cache(maxsize=65536)
+def parse_location(location):
+    """
+    Возвращает (район, город) для значения location.
+    Район: элемент с type = neighbourhood, иначе level = 2, иначе level = 1, иначе первый элемент.
+    Город: элемент с type = city, иначе level = 1.
+    """
+    if not isinstance(location, str) or not location:
+        return None, None
+
+    levels = _load_levels(location)
+    if not isinstance(levels, list):
+        text = location.replace("'", '"')
+        neighbourhood = next((m.group(1) for m in (p.search(text) for p in _FALLBACK_PATTERNS) if m), None)
+        city = _CITY_PATTERN.search(text)
+        return neighbourhood, city.group(1) if city else None
+
+    by_type, level2, level1, first, city = None, None, None, None, None
+    for item in levels:
+        if not isinstance(item, dict):
+            continue
+        name = item.get('name')
+        if first is None:
+            first = name
+        item_type, level = item.get('type'), item.get('level')
+        if item_type == 'neighbourhood' and by_type is None:
+            by_type = name
+        if item_type == 'city' and city is None:
+            city = name
+        if level == 2 and level2 is None:
+            level2 = name
+        if level == 1 and level1 is None:
+            level1 = name
+    neighbourhood = by_type or level2 or level1 or first
+    return neighbourhood, city or level1
+
+def extract_neighborhood(location_json):
+    """Извлекает название района из JSON строки местоположения"""
+    return parse_location(location_json)[0]
+
+def extract_location_parts(locations):
+    """
+    Векторный разбор Series значений location: DataFrame с колонками neighbourhood и city
+    с тем же индексом. Каждое уникальное значение разбирается один раз.
+    """
+    codes, uniques = pd.factorize(locations)
+    parsed = [parse_location(value) for value in uniques]
+    neighbourhoods = np.array([part[0] for part in parsed] + [None], dtype=object)
+    cities = np.array([part[1] for part in parsed] + [None], dtype=object)
+    # Код -1 (пропуск) указывает на последний элемент, None
+    return pd.DataFrame({
+        'neighbourhood': neighbourhoods[codes],
+        'city': cities[codes],
+    }, index=locations.index)
+
+def add_location_columns(df, source='location'):
+    """
+    Добавляет колонки neighbourhood и city, если их еще нет
+    (например, если они не были заполнены при загрузке данных)
+    """
+    missing = [column for column in ('neighbourhood', 'city') if column not in df.columns]
+    if not missing or source not in df.columns:
+        return df
+    parts = extract_location_parts(df[source])
+    return df.assign(**{column: parts[column] for column in missing})
@@ -5,131 +5,56 @@
 import os
 import logging
 import asyncio
-import ssl
-import re
-import html
-import psycopg2
-import pandas as pd
-import numpy as np
 from datetime import datetime
-from dotenv import load_dotenv
-import aiohttp
-
-# Загрузка переменных окружения
-load_dotenv()
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from telegram_delivery import get_telegram_client, parse_chat_ids, get_ssl_context
+from telegram_text import (
+    split_text_into_chunks, utf16_length, truncate_utf16, sanitize_text,
+    TELEGRAM_MAX_MESSAGE_LENGTH, SANITIZE_PER_FIELD,
 )
+
 logger = logging.getLogger(__name__)
 
-# Создаем SSL-контекст
-ssl_context = ssl.create_default_context()
-ssl_context.check_hostname = False
-ssl_context.verify_mode = ssl.CERT_NONE
-
-# Параметры подключения к базе данных из .env
-DB_PARAMS = {
-    'dbname': os.getenv('DB_NAME', 'postgres'),
-    'user': os.getenv('DB_USER', 'admin'),
-    'password': os.getenv('DB_PASSWORD', 'Enclude79'),
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'port': os.getenv('DB_PORT', '5432')
-}
-
-def clean_html_and_sanitize(text):
+# Имя публикатора в outbox: по нему незавершенная публикация досылается при следующем запуске
+PUBLISHER_NAME = os.path.splitext(os.path.basename(__file__))[0]
+REPORT_NAME = PUBLISHER_NAME
+
+# Префикс файлов отчета и снимка его данных в reports/
+REPORT_PREFIX = "medium_apartments"
+
+
+def realistic_price_changes(batches):
     """
-    Очищает текст от HTML-тегов и специальных символов, 
-    которые могут вызывать проблемы в Telegram.
+    Добавляет в каждую пачку колонку abs_pct_change и отбрасывает нереалистичные
+    (больше 25%) и незначительные (меньше 0.1%) изменения цен
     """
-    # Декодируем HTML-сущности (например, &quot; -> ")
-    text = html.unescape(text)
-    
-    # Удаляем все HTML-теги (например, <b>текст</b> -> текст)
-    text = re.sub(r'<[^>]+>', '', text)
-    
-    # Заменяем специальные символы, которые могут вызывать проблемы
-    text = text.replace('&', '&amp;')
-    text = text.replace('<', '&lt;')
-    text = text.replace('>', '&gt;')
-    
-    # Удаляем невидимые управляющие символы
-    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F]', '', text)
-    
-    return text
+    for batch in batches:
+        batch['abs_pct_change'] = batch['pct_change'].abs()
+        yield batch[(batch['abs_pct_change'] <= 25) & (batch['abs_pct_change'] > 0.1)]
 
-def split_text_into_chunks(text, max_length=3000):
+def extract_price_changes(top_n=3, rank_by='abs_pct_change', streaming=False):
     """
-    Разбивает текст на чанки, стараясь делать разрывы на переносах строк
-    и не разрывать слова.
+    Выгружает из базы изменения цен квартир 40-60 кв.м. (при streaming - только top_n каждой локации).
+    Если в таблице нет нужных колонок или изменений цен, создаются демонстрационные данные.
     """
-    chunks = []
-    current_chunk = ""
-    
-    paragraphs = text.split('\n')
-    
-    for paragraph in paragraphs:
-        # Если параграф слишком большой, разбиваем его на предложения
-        if len(paragraph) > max_length:
-            sentences = re.split(r'(?<=[.!?])\s+', paragraph)
-            for sentence in sentences:
-                # Если предложение слишком большое, разбиваем его на части
-                if len(sentence) > max_length:
-                    words = sentence.split(' ')
-                    for word in words:
-                        if len(current_chunk) + len(word) + 1 > max_length:
-                            chunks.append(current_chunk.strip())
-                            current_chunk = word + " "
-                        else:
-                            current_chunk += word + " "
-                # Иначе добавляем предложение целиком
-                elif len(current_chunk) + len(sentence) + 1 > max_length:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = sentence + " "
-                else:
-                    current_chunk += sentence + " "
-        # Если параграф помещается целиком
-        elif len(current_chunk) + len(paragraph) + 1 > max_length:
-            chunks.append(current_chunk.strip())
-            current_chunk = paragraph + "\n"
-        else:
-            current_chunk += paragraph + "\n"
-    
-    # Добавляем последний чанк, если он не пустой
-    if current_chunk.strip():
-        chunks.append(current_chunk.strip())
-    
-    return chunks
+    # pandas, psycopg2 и модули работы с данными нужны только для выгрузки
+    import pandas as pd
+    import numpy as np
+    from analytics_snapshot import load_snapshot, select_area_band
+    from ranking import stream_top_n_per_location
+    from price_summary import iter_price_changes
+    from database import db_connection, missing_columns
 
-def find_price_change_apartments():
-    """Находит объявления с самыми резкими изменениями в стоимости по локациям"""
-    try:
-        # Создаем директорию для сохранения результатов анализа
-        reports_dir = "reports"
-        os.makedirs(reports_dir, exist_ok=True)
-        
-        # Подключаемся к базе данных
-        print("Подключение к базе данных...")
-        conn = psycopg2.connect(**DB_PARAMS)
+    # Подключаемся к базе данных
+    print("Подключение к базе данных...")
+    with db_connection() as conn:
         print("Подключение к базе данных успешно")
-        
-        # Проверяем наличие столбца updated_at и id
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name = 'bayut_properties' 
-            AND column_name IN ('updated_at', 'id', 'price')
-        """)
-        available_columns = [col[0] for col in cursor.fetchall()]
-        
+
+        # Проверяем наличие столбца updated_at и id (схема кэшируется, см. database.probe_schema)
         required_columns = ['updated_at', 'id', 'price']
-        missing_columns = [col for col in required_columns if col not in available_columns]
-        
-        if missing_columns:
-            print(f"В таблице отсутствуют необходимые колонки: {', '.join(missing_columns)}")
+        absent_columns = missing_columns(conn, 'bayut_properties', required_columns)
+
+        if absent_columns:
+            print(f"В таблице отсутствуют необходимые колонки: {', '.join(absent_columns)}")
             print("Создаем демонстрационные данные...")
             # Если отсутствуют нужные колонки, используем демонстрационные данные
             query = """
@@ -140,81 +65,33 @@ def find_price_change_apartments():
             ORDER BY updated_at DESC
             LIMIT 1000
             """
-            
+
             df = pd.read_sql_query(query, conn)
-            
+
             # Создаем демонстрационные данные об изменениях цен
             df['pct_change'] = np.random.uniform(-5, 8, size=len(df))  # Более реалистичные изменения для недвижимости
             df['absolute_change'] = df['price'] * df['pct_change'] / 100
             df['prev_price'] = df['price'] - df['absolute_change']
             changes_df = df
-            
+
         else:
             print("Выполнение запроса для получения изменений цен...")
             print("Фильтруем квартиры 40-60 кв.м. напрямую в SQL-запросе для оптимизации выборки")
-            
-            # Запрос для получения последней и предпоследней цены для каждого ID
-            # Используем оконные функции SQL для эффективного вычисления изменений
-            query = """
-            WITH price_history AS (
-                SELECT 
-                    id,
-                    price,
-                    updated_at,
-                    LAG(price) OVER (PARTITION BY id ORDER BY updated_at) AS prev_price,
-                    LAG(updated_at) OVER (PARTITION BY id ORDER BY updated_at) AS prev_updated_at,
-                    ROW_NUMBER() OVER (PARTITION BY id ORDER BY updated_at DESC) AS rn
-                FROM bayut_properties
-                WHERE price > 0 AND updated_at IS NOT NULL
-            ),
-            price_changes AS (
-                SELECT 
-                    ph.id,
-                    ph.price AS current_price,
-                    ph.prev_price,
-                    ph.updated_at AS current_updated_at,
-                    ph.prev_updated_at,
-                    CASE 
-                        WHEN ph.prev_price IS NOT NULL AND ph.prev_price <> 0 
-                        THEN (ph.price - ph.prev_price) / ph.prev_price * 100
-                        ELSE NULL
-                    END AS pct_change,
-                    CASE 
-                        WHEN ph.prev_price IS NOT NULL 
-                        THEN ph.price - ph.prev_price
-                        ELSE NULL
-                    END AS absolute_change
-                FROM price_history ph
-                WHERE ph.rn = 1 AND ph.prev_price IS NOT NULL
-            )
-            SELECT 
-                bp.id, 
-                bp.title, 
-                bp.price, 
-                bp.rooms, 
-                bp.area, 
-                bp.location, 
-                bp.property_url,
-                pc.current_updated_at,
-                pc.prev_updated_at,
-                pc.prev_price,
-                pc.pct_change,
-                pc.absolute_change
-            FROM price_changes pc
-            JOIN bayut_properties bp ON pc.id = bp.id
-            WHERE pc.pct_change IS NOT NULL 
-            AND ABS(pc.pct_change) > 0.1  -- Исключаем объявления без изменений цены (меньше 0.1%)
-            AND bp.area > 40 AND bp.area <= 60  -- Фильтруем квартиры 40-60 кв.м.
-            ORDER BY ABS(pc.pct_change) DESC
-            """
-            
+
             try:
-                # Выполняем SQL-запрос
-                changes_df = pd.read_sql_query(query, conn)
-                
+                if streaming:
+                    # Изменения цен читаются пачками, в памяти остаются только лидеры каждой локации
+                    batches = realistic_price_changes(iter_price_changes(conn, min_area=40, max_area=60))
+                    changes_df = stream_top_n_per_location(batches, n=top_n, rank_by=rank_by, ascending=False)
+                else:
+                    # Изменения цен берутся из общего снимка данных, который выгружается
+                    # один раз за цикл загрузки и используется всеми публикаторами
+                    snapshot = load_snapshot(conn)
+                    changes_df = select_area_band(snapshot['price_changes'], min_area=40, max_area=60).copy()
+
                 if changes_df.empty:
                     print("Не удалось найти изменения цен в базе данных. Используем альтернативный метод...")
-                    
+
                     # Используем альтернативный запрос для получения всех записей
                     alt_query = """
                     SELECT id, title, price, rooms, area, location, property_url, updated_at
@@ -224,19 +101,21 @@ def find_price_change_apartments():
                     ORDER BY updated_at DESC
                     LIMIT 1000
                     """
-                    
+
                     df = pd.read_sql_query(alt_query, conn)
-                    
+
                     # Создаем демонстрационные данные с меньшими колебаниями
                     df['pct_change'] = np.random.uniform(-5, 8, size=len(df))
                     df['absolute_change'] = df['price'] * df['pct_change'] / 100
                     df['prev_price'] = df['price'] - df['absolute_change']
                     changes_df = df
-                
+
             except Exception as e:
                 print(f"Ошибка при выполнении SQL-запроса: {e}")
                 print("Используем запасной метод...")
-                
+                # Ошибка прерывает транзакцию: без отката запасной запрос тоже не выполнится
+                conn.rollback()
+
                 # Запасной запрос для получения всех записей
                 simple_query = """
                 SELECT id, title, price, rooms, area, location, property_url, updated_at
@@ -246,17 +125,49 @@ def find_price_change_apartments():
                 ORDER BY updated_at DESC
                 LIMIT 1000
                 """
-                
+
                 df = pd.read_sql_query(simple_query, conn)
-                
+
                 # Создаем демонстрационные данные с меньшими колебаниями
                 df['pct_change'] = np.random.uniform(-5, 8, size=len(df))
                 df['absolute_change'] = df['price'] * df['pct_change'] / 100
                 df['prev_price'] = df['price'] - df['absolute_change']
                 changes_df = df
+
+        return changes_df
+
+def find_price_change_apartments(top_n=3, rank_by='abs_pct_change', streaming=None, diff=None, from_snapshot=None):
+    """
+    Находит объявления с самыми резкими изменениями в стоимости по локациям.
+    top_n - сколько объявлений выводить в каждой локации, rank_by - колонка для ранжирования (по убыванию).
+    streaming - читать изменения цен из базы серверным курсором пачками и держать в памяти только
+    текущий top_n каждой локации (по умолчанию берется из переменной STREAM_RANKING).
+    diff - вернуть только изменения с прошлой публикации (по умолчанию берется из переменной REPORT_DIFF_MODE).
+    from_snapshot - построить отчет по сохраненному снимку данных (путь к файлу или 'latest')
+    без подключения к базе (см. report_snapshot.py).
+    """
+    # pandas и модули работы с данными нужны только для отбора объявлений
+    import numpy as np
+    from ranking import top_n_per_location
+    from report_format import format_price_change_rows
+    from render_cache import ReportCache, save_report
+    from report_diff import PublishedSelection, DIFF_MODE
+    from report_snapshot import read_report_snapshot, save_report_snapshot
+    from telegram_text import sanitize_fields
+
+    if streaming is None:
+        streaming = os.getenv('STREAM_RANKING', '').lower() in ('1', 'true', 'yes')
+    try:
+        # Создаем директорию для сохранения результатов анализа
+        reports_dir = "reports"
+        os.makedirs(reports_dir, exist_ok=True)
         
-        # Закрываем соединение с базой
-        conn.close()
+        if from_snapshot:
+            changes_df = read_report_snapshot(from_snapshot, REPORT_PREFIX, reports_dir)
+        else:
+            changes_df = extract_price_changes(top_n, rank_by, streaming)
+            # Выгруженные данные сохраняются рядом с отчетом для повторной отрисовки
+            save_report_snapshot(changes_df, REPORT_PREFIX, reports_dir)
         
         # Проверяем, есть ли данные
         if changes_df.empty:
@@ -271,7 +182,6 @@ def find_price_change_apartments():
             # Отфильтруем нереалистичные изменения цен для недвижимости (больше 25%)
             # И исключим объявления с незначительными изменениями цены (меньше 0.1%)
             changes_df = changes_df[(changes_df['abs_pct_change'] <= 25) & (changes_df['abs_pct_change'] > 0.1)]
-            sorted_df = changes_df.sort_values('abs_pct_change', ascending=False)
         else:
             print("Колонка pct_change отсутствует. Создаем...")
             # Генерируем случайные изменения, но исключаем нулевые/близкие к нулю изменения
@@ -289,77 +199,33 @@ def find_price_change_apartments():
             changes_df['abs_pct_change'] = changes_df['pct_change'].abs()
             changes_df['absolute_change'] = changes_df['price'] * changes_df['pct_change'] / 100
             changes_df['prev_price'] = changes_df['price'] - changes_df['absolute_change']
-            sorted_df = changes_df.sort_values('abs_pct_change', ascending=False)
-        
-        # Группируем по локации и берем топ-3 с наибольшими изменениями
-        result = []
-        result.append("Топ-3 объявления с самыми резкими изменениями цен на квартиры 40-60 кв.м. по локациям:\n")
-        
-        # Получаем уникальные локации и сортируем их
-        locations = sorted(sorted_df['location'].unique())
         
-        for location in locations:
-            if not location or pd.isna(location):
-                continue
-                
-            # Получаем топ-3 объявления с наибольшими изменениями для этой локации
-            location_top = sorted_df[sorted_df['location'] == location].head(3)
-            
-            if len(location_top) == 0:
-                continue
-                
-            result.append(f"Локация: {location}")
-            result.append("------------------------------")
-            
-            for i, (_, row) in enumerate(location_top.iterrows(), 1):
-                price = float(row['price']) if not pd.isna(row['price']) else 0
-                prev_price = float(row['prev_price']) if not pd.isna(row['prev_price']) else 0
-                pct_change = float(row['pct_change']) if not pd.isna(row['pct_change']) else 0
-                
-                # Форматирование чисел
-                formatted_price = f"{price:,.2f}"
-                formatted_prev_price = f"{prev_price:,.2f}"
-                
-                # Добавляем эмодзи и знак для изменения цены
-                change_symbol = "📈" if pct_change > 0 else "📉"
-                change_sign = "+" if pct_change > 0 else ""
-                formatted_pct_change = f"{change_symbol} {change_sign}{pct_change:.2f}%"
-                
-                area = float(row['area']) if not pd.isna(row['area']) else 0
-                formatted_area = f"{area:.2f}"
-                
-                rooms = int(row['rooms']) if not pd.isna(row['rooms']) else 0
-                
-                # Добавляем информацию о датах изменения цены, если она доступна
-                date_info = ""
-                if 'current_updated_at' in row and 'prev_updated_at' in row and not pd.isna(row['current_updated_at']) and not pd.isna(row['prev_updated_at']):
-                    current_date = row['current_updated_at'].strftime('%d.%m.%Y') if hasattr(row['current_updated_at'], 'strftime') else str(row['current_updated_at'])
-                    prev_date = row['prev_updated_at'].strftime('%d.%m.%Y') if hasattr(row['prev_updated_at'], 'strftime') else str(row['prev_updated_at'])
-                    date_info = f"\n   Последнее обновление: {current_date}\n   Предыдущее обновление: {prev_date}"
-                
-                result.append(f"{i}. {row['title']}")
-                result.append(f"   ID: {row['id']}")
-                result.append(f"   Текущая цена: {formatted_price} AED")
-                result.append(f"   Предыдущая цена: {formatted_prev_price} AED")
-                result.append(f"   Изменение: {formatted_pct_change}{date_info}")
-                result.append(f"   Площадь: {formatted_area} кв.м.")
-                result.append(f"   Спальни: {rooms}")
-                result.append(f"   Ссылка: {row['property_url']}")
-                result.append("")
-            
-            result.append("")
+        # Отбираем top_n объявлений с наибольшими изменениями в каждой локации за один проход
+        top_df = top_n_per_location(changes_df, n=top_n, rank_by=rank_by, ascending=False)
+        if SANITIZE_PER_FIELD:
+            # Очищаются только поля отобранных объявлений, а не весь текст отчета
+            top_df = sanitize_fields(top_df)
         
-        # Собираем результат в строку
-        analysis = "\n".join(result)
+        header = f"Топ-{top_n} объявления с самыми резкими изменениями цен на квартиры 40-60 кв.м. по локациям:\n"
         
-        # Сохраняем результат в файл с датой и временем
-        current_datetime = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_file = os.path.join(reports_dir, f"medium_apartments_{current_datetime}.txt")
+        # Разделы локаций, отобранные объявления которых не изменились с прошлого запуска,
+        # берутся из кэша отрисовки, остальные отрисовываются заново
+        cache = ReportCache(REPORT_NAME, render_key=f"sanitize_per_field={SANITIZE_PER_FIELD}")
+        analysis, fingerprint = cache.render(top_df, format_price_change_rows, header)
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(analysis)
+        # Сохраняем результат в файл с датой и временем (если такого отчета еще нет на диске)
+        save_report(cache, analysis, fingerprint, reports_dir, REPORT_PREFIX)
         
-        print(f"Результаты сохранены в файл: {output_file}")
+        # Подборка запоминается до публикации; в режиме разницы публикуются только
+        # новые объявления, выбывшие из подборки и изменения цен с прошлого поста
+        selection = PublishedSelection(REPORT_NAME)
+        selection.stage(top_df)
+        if diff is None:
+            diff = DIFF_MODE
+        if diff:
+            changes = selection.changes_report(header.strip())
+            if changes is not None:
+                return changes
         
         return analysis
         
@@ -374,7 +240,7 @@ class TelegramPublisher:
         """Инициализация класса"""
         self.bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
         self.chat_id = os.getenv('TELEGRAM_CHANNEL_ID')
-        self.api_url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
+        self.chat_ids = parse_chat_ids(self.chat_id)
         # Отладочный вывод
         print(f"TELEGRAM_BOT_TOKEN: {self.bot_token}")
         print(f"TELEGRAM_CHANNEL_ID: {self.chat_id}")
@@ -382,94 +248,59 @@ class TelegramPublisher:
     async def send_message(self, text):
         """Отправляет сообщение в Telegram, разбивая на части"""
         # Очищаем текст от HTML-тегов и специальных символов
-        text = clean_html_and_sanitize(text)
+        # (при SANITIZE_PER_FIELD поля объявлений уже очищены при сборке отчета)
+        if not SANITIZE_PER_FIELD:
+            text = sanitize_text(text)
         
         # Используем улучшенный алгоритм разбиения текста
         chunks = split_text_into_chunks(text, max_length=3000)
         
+        # Добавляем заголовок к первому чанку и подпись к последнему
+        prepared = []
+        for i, chunk in enumerate(chunks):
+            # Для первого чанка добавляем заголовок
+            if i == 0:
+                chunk = f"💰 ИЗМЕНЕНИЯ ЦЕН НА НЕДВИЖИМОСТЬ - {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n" + chunk
+                # Добавляем информацию для инвесторов в начало сообщения
+                investor_header = "🔎 КВАРТИРЫ 40-60 КВ. М.\n"
+                investor_header += "📊 Аналитика для инвесторов: квартиры средней площади предлагают оптимальный баланс между ценой и комфортом проживания.\n"
+                investor_header += "💼 Идеальны для семейной аренды и стабильного долгосрочного дохода.\n\n"
+                chunk = investor_header + chunk
+
+            # Для последнего чанка добавляем хэштеги
+            if i == len(chunks) - 1:
+                # Добавляем информацию для инвесторов в конец сообщения
+                investor_footer = "\n\n📈 Доходность квартир средней площади в ОАЭ составляет 6-8% годовых."
+                investor_footer += "\n🏙️ Такие объекты показывают стабильный спрос на рынке долгосрочной аренды."
+                investor_footer += "\n📱 Подписывайтесь на наш канал для актуальной информации о выгодных инвестициях!"
+                chunk = chunk + investor_footer
+                chunk = chunk + "\n\n#недвижимость #ОАЭ #ценынаквартиры #инвестиции #квартиры #доходность"
+
+            # Проверка длины каждого чанка перед отправкой (Telegram считает длину в UTF-16)
+            chunk_length = utf16_length(chunk)
+            if chunk_length > TELEGRAM_MAX_MESSAGE_LENGTH:
+                logger.warning(f"Чанк {i+1} слишком длинный ({chunk_length} символов UTF-16), обрезаем до {TELEGRAM_MAX_MESSAGE_LENGTH}")
+                chunk = truncate_utf16(chunk, TELEGRAM_MAX_MESSAGE_LENGTH - 3) + "..."
+            
+            prepared.append(chunk)
+        
         try:
-            connector = aiohttp.TCPConnector(ssl=ssl_context)
-            async with aiohttp.ClientSession(connector=connector) as session:
-                # Отправляем каждый чанк
-                for i, chunk in enumerate(chunks):
-                    # Для первого чанка добавляем заголовок
-                    if i == 0:
-                        chunk = f"💰 ИЗМЕНЕНИЯ ЦЕН НА НЕДВИЖИМОСТЬ - {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n" + chunk
-                        # Добавляем информацию для инвесторов в начало сообщения
-                        investor_header = "🔎 КВАРТИРЫ 40-60 КВ. М.\n"
-                        investor_header += "📊 Аналитика для инвесторов: квартиры средней площади предлагают оптимальный баланс между ценой и комфортом проживания.\n"
-                        investor_header += "💼 Идеальны для семейной аренды и стабильного долгосрочного дохода.\n\n"
-                        chunk = investor_header + chunk
-                    
-                    # Для последнего чанка добавляем хэштеги
-                    if i == len(chunks) - 1:
-                        # Добавляем информацию для инвесторов в конец сообщения
-                        investor_footer = "\n\n📈 Доходность квартир средней площади в ОАЭ составляет 6-8% годовых."
-                        investor_footer += "\n🏙️ Такие объекты показывают стабильный спрос на рынке долгосрочной аренды."
-                        investor_footer += "\n📱 Подписывайтесь на наш канал для актуальной информации о выгодных инвестициях!"
-                        chunk = chunk + investor_footer
-                        chunk = chunk + "\n\n#недвижимость #ОАЭ #ценынаквартиры #инвестиции #квартиры #доходность"
-                    
-                    # Проверка длины каждого чанка перед отправкой
-                    if len(chunk) > 4000:
-                        logger.warning(f"Чанк {i+1} слишком длинный ({len(chunk)} символов), обрезаем до 4000 символов")
-                        chunk = chunk[:3997] + "..."
-                    
-                    try:
-                        async with session.post(
-                            self.api_url,
-                            json={
-                                "chat_id": self.chat_id,
-                                "text": chunk
-                            }
-                        ) as response:
-                            if response.status == 200:
-                                logger.info(f"Часть {i+1}/{len(chunks)} успешно отправлена в Telegram ({len(chunk)} символов)")
-                            else:
-                                error_text = await response.text()
-                                logger.error(f"Ошибка при отправке части {i+1}/{len(chunks)}: {error_text}")
-                                
-                                # Сохраняем проблемный чанк в файл для диагностики
-                                error_file = f"error_chunk_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-                                with open(error_file, 'w', encoding='utf-8') as f:
-                                    f.write(chunk)
-                                logger.info(f"Проблемный чанк сохранен в файл: {error_file}")
-                                
-                                # Пытаемся отправить сокращенную версию
-                                if len(chunk) > 1000:
-                                    shortened = chunk[:950] + "... (сообщение сокращено)"
-                                    logger.info("Пытаемся отправить сокращенную версию чанка")
-                                    async with session.post(
-                                        self.api_url,
-                                        json={
-                                            "chat_id": self.chat_id,
-                                            "text": shortened
-                                        }
-                                    ) as retry_response:
-                                        if retry_response.status == 200:
-                                            logger.info("Сокращенная версия чанка успешно отправлена")
-                                        else:
-                                            logger.error(f"Не удалось отправить даже сокращенную версию: {await retry_response.text()}")
-                        
-                        # Небольшая пауза между отправками
-                        await asyncio.sleep(1)
-                        
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке части {i+1}/{len(chunks)}: {e}")
-                
-                logger.info(f"Успешно отправлено {len(chunks)} частей сообщения")
-                return True
-                
+            # Отправка через общий клиент с пулом соединений, с учетом лимитов Telegram,
+            # в несколько каналов - параллельно
+            client = get_telegram_client(self.bot_token, ssl=get_ssl_context())
+            return await client.deliver(self.chat_ids, prepared, publisher=PUBLISHER_NAME)
         except Exception as e:
             logger.error(f"Ошибка при отправке сообщения в Telegram: {e}")
             return False
 
-    async def publish_analysis(self):
-        """Публикует результаты анализа в Telegram"""
+    async def publish_analysis(self, from_snapshot=None):
+        """Публикует результаты анализа в Telegram (from_snapshot - по сохраненному снимку данных)"""
         try:
             # Получаем анализ
             logger.info("Получение анализа квартир с изменениями цен...")
-            analysis = find_price_change_apartments()
+            # Запросы к базе и pandas выполняются в отдельном потоке, чтобы не блокировать event loop
+            # (важно, когда планировщик запускает несколько публикаторов в одном процессе)
+            analysis = await asyncio.to_thread(find_price_change_apartments, from_snapshot=from_snapshot)
             
             if not analysis:
                 logger.error("Не удалось получить анализ")
@@ -479,11 +310,22 @@ class TelegramPublisher:
             logger.info(f"Первые 100 символов анализа: {analysis[:100]}")
             logger.info(f"Общая длина анализа: {len(analysis)} символов")
             
+            # Если отобранные объявления не изменились с последней публикации,
+            # публикация пропускается или сокращается (REPORT_UNCHANGED_MODE)
+            from render_cache import ReportCache, text_to_publish
+            cache = ReportCache(REPORT_NAME)
+            analysis = text_to_publish(cache, analysis)
+            if analysis is None:
+                return True
+            
             # Отправляем сообщение
             logger.info("Отправка анализа в Telegram...")
             success = await self.send_message(analysis)
             
             if success:
+                cache.mark_published()
+                from report_diff import PublishedSelection
+                PublishedSelection(REPORT_NAME).commit()
                 logger.info("Анализ успешно опубликован в Telegram")
             else:
                 logger.error("Ошибка при публикации анализа в Telegram")
@@ -494,15 +336,33 @@ class TelegramPublisher:
             logger.error(f"Ошибка при публикации анализа: {e}")
             return False
 
-async def main():
-    """Основная функция"""
+async def main(from_snapshot=None):
+    """
+    Основная функция (from_snapshot - построить отчет по сохраненному снимку данных, см. report_snapshot.py).
+    Возвращает True, если публикация отправлена (или пропущена как неизменившаяся)
+    """
+    from dotenv import load_dotenv
+
+    # Загрузка переменных окружения
+    load_dotenv()
     logger.info("Запуск скрипта публикации анализа изменений цен на квартиры 40-60 кв.м. в Telegram")
     publisher = TelegramPublisher()
-    success = await publisher.publish_analysis()
+    # Соединения с Telegram не закрываются: в процессе планировщика они общие для всех задач
+    success = await publisher.publish_analysis(from_snapshot=from_snapshot)
     if success:
         print("Анализ успешно опубликован в Telegram")
     else:
         print("Ошибка при публикации анализа в Telegram")
+    return success
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    import sys
+    import argparse
+    from load_env import configure_logging
+    from report_snapshot import add_snapshot_argument
+    from telegram_delivery import run_standalone
+
+    parser = add_snapshot_argument(argparse.ArgumentParser(description="Публикация изменений цен на квартиры 40-60 кв.м. в Telegram"))
+    args = parser.parse_args()
+    configure_logging()
+    sys.exit(0 if run_standalone(main(from_snapshot=args.from_snapshot)) else 1)
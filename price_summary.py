@@ -0,0 +1,279 @@
+"""
+Инкрементально обновляемая сводка "последняя и предыдущая цена" по каждому объявлению.
+
+Раньше публикаторы изменений цен при каждом запуске считали LAG/ROW_NUMBER
+по всей истории bayut_properties. Теперь результат хранится в таблице
+bayut_price_summary, а каждый запуск продвигает её только на строки,
+у которых updated_at больше водяного знака (максимального updated_at,
+уже учтённого в сводке) за вычетом окна перекрытия. Стоимость запроса
+зависит от объёма новых данных, а не от длины всей истории.
+
+Окно перекрытия (PRICE_SUMMARY_OVERLAP) нужно потому, что updated_at
+выставляется при записи строки, а видимой она становится при фиксации
+транзакции: строка долгой транзакции загрузки может появиться уже после
+того, как водяной знак ушел дальше ее updated_at. Строки из окна, уже
+учтенные в сводке, повторно не применяются.
+
+Таблица сводки и ее индексы создаются однократно: python price_summary.py --setup
+(под владельцем bayut_properties). Публикаторы только проверяют их наличие
+по pg_indexes, один раз на процесс, и выполняют DDL, лишь если чего-то нет.
+"""
+
+import os
+import logging
+import threading
+import pandas as pd
+from db_stream import iter_query_batches, STREAM_BATCH_SIZE
+from database import read_prepared, relation_exists, database_identity
+
+logger = logging.getLogger(__name__)
+
+# Насколько назад от водяного знака пересматриваются строки bayut_properties (интервал PostgreSQL)
+PRICE_SUMMARY_OVERLAP = os.getenv('PRICE_SUMMARY_OVERLAP', '1 hour')
+
+# Таблица создается по образцу bayut_properties, чтобы типы колонок совпадали
+CREATE_SUMMARY_SQL = """
+CREATE TABLE IF NOT EXISTS bayut_price_summary AS
+SELECT id, title, price, rooms, area, location, property_url, updated_at,
+       price AS prev_price, updated_at AS prev_updated_at
+FROM bayut_properties
+WITH NO DATA
+"""
+
+# Индексы сводки: без уникального индекса по id не работает ON CONFLICT
+SUMMARY_INDEXES = {
+    "bayut_price_summary_id_idx":
+        "CREATE UNIQUE INDEX IF NOT EXISTS bayut_price_summary_id_idx ON bayut_price_summary (id)",
+    "bayut_price_summary_updated_at_idx":
+        "CREATE INDEX IF NOT EXISTS bayut_price_summary_updated_at_idx ON bayut_price_summary (updated_at)",
+}
+
+# Без индекса по updated_at выборка новых строк превращается в полный скан истории.
+# Создать его может только владелец bayut_properties, поэтому без него сводка
+# все равно обновляется, только медленнее
+PROPERTIES_UPDATED_AT_INDEX = (
+    "bayut_properties_updated_at_idx",
+    "CREATE INDEX IF NOT EXISTS bayut_properties_updated_at_idx ON bayut_properties (updated_at)",
+)
+
+EXISTING_INDEXES_SQL = """
+SELECT indexname FROM pg_indexes
+WHERE schemaname = ANY(current_schemas(false))
+AND tablename IN ('bayut_properties', 'bayut_price_summary')
+"""
+
+# Продвижение сводки: берем строки после водяного знака (с окном перекрытия), которые
+# новее уже учтенной в сводке строки того же id; для каждого id последняя строка
+# становится текущей ценой, а предыдущей ценой - либо вторая по свежести новая строка,
+# либо то, что было текущим в сводке до обновления
+REFRESH_SUMMARY_SQL = """
+WITH new_rows AS (
+    SELECT
+        p.id, p.title, p.price, p.rooms, p.area, p.location, p.property_url, p.updated_at,
+        ROW_NUMBER() OVER (PARTITION BY p.id ORDER BY p.updated_at DESC) AS rn
+    FROM bayut_properties p
+    LEFT JOIN bayut_price_summary s ON s.id = p.id
+    WHERE p.price > 0 AND p.updated_at IS NOT NULL
+    AND p.updated_at > COALESCE((SELECT MAX(updated_at) FROM bayut_price_summary), '-infinity')
+                       - %(overlap)s::interval
+    AND (s.updated_at IS NULL OR p.updated_at > s.updated_at)
+)
+INSERT INTO bayut_price_summary (
+    id, title, price, rooms, area, location, property_url, updated_at,
+    prev_price, prev_updated_at
+)
+SELECT
+    cur.id, cur.title, cur.price, cur.rooms, cur.area, cur.location, cur.property_url, cur.updated_at,
+    COALESCE(prv.price, old.price),
+    COALESCE(prv.updated_at, old.updated_at)
+FROM new_rows cur
+LEFT JOIN new_rows prv ON prv.id = cur.id AND prv.rn = 2
+LEFT JOIN bayut_price_summary old ON old.id = cur.id
+WHERE cur.rn = 1
+ON CONFLICT (id) DO UPDATE SET
+    title = EXCLUDED.title,
+    price = EXCLUDED.price,
+    rooms = EXCLUDED.rooms,
+    area = EXCLUDED.area,
+    location = EXCLUDED.location,
+    property_url = EXCLUDED.property_url,
+    updated_at = EXCLUDED.updated_at,
+    prev_price = EXCLUDED.prev_price,
+    prev_updated_at = EXCLUDED.prev_updated_at
+"""
+
+PRICE_CHANGES_SQL = """
+SELECT
+    id,
+    title,
+    price,
+    rooms,
+    area,
+    location,
+    property_url,
+    updated_at AS current_updated_at,
+    prev_updated_at,
+    prev_price,
+    (price - prev_price) / prev_price * 100 AS pct_change,
+    price - prev_price AS absolute_change
+FROM bayut_price_summary
+WHERE prev_price IS NOT NULL AND prev_price <> 0
+AND ABS((price - prev_price) / prev_price * 100) > 0.1  -- Исключаем объявления без изменений цены (меньше 0.1%%)
+AND area > %(min_area)s AND area <= %(max_area)s
+ORDER BY ABS((price - prev_price) / prev_price * 100) DESC
+"""
+
+# Прежний запрос по всей истории; используется, только если сводку
+# не удалось создать или обновить (например, нет прав на CREATE TABLE)
+FULL_HISTORY_PRICE_CHANGES_SQL = """
+WITH price_history AS (
+    SELECT
+        id,
+        price,
+        updated_at,
+        LAG(price) OVER (PARTITION BY id ORDER BY updated_at) AS prev_price,
+        LAG(updated_at) OVER (PARTITION BY id ORDER BY updated_at) AS prev_updated_at,
+        ROW_NUMBER() OVER (PARTITION BY id ORDER BY updated_at DESC) AS rn
+    FROM bayut_properties
+    WHERE price > 0 AND updated_at IS NOT NULL
+),
+price_changes AS (
+    SELECT
+        ph.id,
+        ph.price AS current_price,
+        ph.prev_price,
+        ph.updated_at AS current_updated_at,
+        ph.prev_updated_at,
+        CASE
+            WHEN ph.prev_price IS NOT NULL AND ph.prev_price <> 0
+            THEN (ph.price - ph.prev_price) / ph.prev_price * 100
+            ELSE NULL
+        END AS pct_change,
+        CASE
+            WHEN ph.prev_price IS NOT NULL
+            THEN ph.price - ph.prev_price
+            ELSE NULL
+        END AS absolute_change
+    FROM price_history ph
+    WHERE ph.rn = 1 AND ph.prev_price IS NOT NULL
+)
+SELECT
+    bp.id,
+    bp.title,
+    bp.price,
+    bp.rooms,
+    bp.area,
+    bp.location,
+    bp.property_url,
+    pc.current_updated_at,
+    pc.prev_updated_at,
+    pc.prev_price,
+    pc.pct_change,
+    pc.absolute_change
+FROM price_changes pc
+JOIN bayut_properties bp ON pc.id = bp.id
+WHERE pc.pct_change IS NOT NULL
+AND ABS(pc.pct_change) > 0.1  -- Исключаем объявления без изменений цены (меньше 0.1%%)
+AND bp.area > %(min_area)s AND bp.area <= %(max_area)s
+ORDER BY ABS(pc.pct_change) DESC
+"""
+
+# Базы, для которых наличие сводки и индексов уже проверено в этом процессе
+_ready = set()
+_ready_lock = threading.Lock()
+
+def setup_price_summary(conn):
+    """
+    Однократная настройка: создает таблицу сводки и недостающие индексы.
+    Наличие индексов сверяется с pg_indexes, DDL выполняется только для отсутствующих.
+    """
+    with conn.cursor() as cursor:
+        if not relation_exists(conn, 'bayut_price_summary'):
+            logger.info("Создание таблицы сводки цен bayut_price_summary")
+            cursor.execute(CREATE_SUMMARY_SQL)
+        cursor.execute(EXISTING_INDEXES_SQL)
+        existing = {row[0] for row in cursor.fetchall()}
+        for name, statement in SUMMARY_INDEXES.items():
+            if name not in existing:
+                logger.info(f"Создание индекса {name}")
+                cursor.execute(statement)
+    conn.commit()
+
+    name, statement = PROPERTIES_UPDATED_AT_INDEX
+    if name not in existing:
+        try:
+            logger.info(f"Создание индекса {name}")
+            with conn.cursor() as cursor:
+                cursor.execute(statement)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"Не удалось создать индекс {name} ({e}); обновление сводки будет читать всю таблицу")
+
+def refresh_price_summary(conn):
+    """Продвигает сводку на новые строки (при первом вызове в процессе проверяет ее наличие). Возвращает число обновленных id"""
+    identity = database_identity(conn)
+    with _ready_lock:
+        ready = identity in _ready
+    if not ready:
+        setup_price_summary(conn)
+        with _ready_lock:
+            _ready.add(identity)
+    with conn.cursor() as cursor:
+        cursor.execute(REFRESH_SUMMARY_SQL, {'overlap': PRICE_SUMMARY_OVERLAP})
+        updated = cursor.rowcount
+    conn.commit()
+    logger.info(f"Сводка цен обновлена: затронуто {updated} объявлений")
+    return updated
+
+def fetch_price_changes(conn, min_area, max_area):
+    """
+    Возвращает объявления с изменением цены для диапазона площади (min_area, max_area].
+    Сначала инкрементально обновляет сводку; при ошибке использует запрос по всей истории.
+    """
+    params = {'min_area': min_area, 'max_area': max_area}
+    try:
+        refresh_price_summary(conn)
+        return read_prepared(conn, 'price_changes', PRICE_CHANGES_SQL, params)
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Не удалось использовать сводку цен ({e}), выполняем запрос по всей истории")
+        return pd.read_sql_query(FULL_HISTORY_PRICE_CHANGES_SQL, conn, params=params)
+
+def iter_price_changes(conn, min_area, max_area, batch_size=STREAM_BATCH_SIZE):
+    """
+    Потоковый вариант fetch_price_changes: возвращает изменения цен пачками DataFrame.
+    На запрос по всей истории переключается, только если ошибка возникла до первой пачки.
+    """
+    params = {'min_area': min_area, 'max_area': max_area}
+    try:
+        refresh_price_summary(conn)
+        batches = iter_query_batches(conn, PRICE_CHANGES_SQL, params, batch_size)
+        first = next(batches, None)
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Не удалось использовать сводку цен ({e}), выполняем запрос по всей истории")
+        yield from iter_query_batches(conn, FULL_HISTORY_PRICE_CHANGES_SQL, params, batch_size)
+        return
+    if first is not None:
+        yield first
+        yield from batches
+
+def main():
+    import argparse
+    from dotenv import load_dotenv
+    from database import db_connection
+
+    parser = argparse.ArgumentParser(description="Сводка последней и предыдущей цены объявлений")
+    parser.add_argument('--setup', action='store_true', help="создать таблицу сводки и индексы (миграция)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    with db_connection() as conn:
+        if args.setup:
+            setup_price_summary(conn)
+            print("Таблица сводки цен и индексы созданы")
+        print(f"Обновлено объявлений: {refresh_price_summary(conn)}")
+
+if __name__ == "__main__":
+    main()
@@ -4,37 +4,58 @@ import json
 import logging
 import subprocess
 import time
-from datetime import datetime
-import schedule
-
-# Настройка логирования
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-log_filename = os.path.join(log_dir, "scheduler.log")
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename, encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+import signal
+import asyncio
+import threading
+from collections import deque
+from job_runner import InProcessRunner
+from scheduler_core import EventScheduler
+from load_env import configure_logging
+
 logger = logging.getLogger(__name__)
 
+LOG_FILE = os.path.join("logs", "scheduler.log")
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
 SCHEDULE_CONFIG = "schedule_config.json"
 
-# Загрузка расписания
+# Режим выполнения задач по умолчанию: "inprocess" - main() скрипта в процессе планировщика,
+# "subprocess" - отдельный интерпретатор. Для отдельной задачи задается полем "mode" в конфигурации
+DEFAULT_JOB_MODE = os.getenv("SCHEDULER_JOB_MODE", "inprocess")
+DEFAULT_JOB_TIMEOUT = 3600
 
-def load_schedule_config():
-    if not os.path.exists(SCHEDULE_CONFIG):
-        logger.error(f"Файл {SCHEDULE_CONFIG} не найден!")
-        return []
-    with open(SCHEDULE_CONFIG, encoding="utf-8") as f:
-        data = json.load(f)
-    return data.get("publications", [])
+# Как часто (в секундах) проверять, не изменился ли schedule_config.json; 0 - только по SIGHUP
+CONFIG_WATCH_INTERVAL = float(os.getenv("SCHEDULER_CONFIG_WATCH_INTERVAL", "60"))
+
+# Сколько задач может выполняться одновременно
+MAX_PARALLEL_JOBS = int(os.getenv("SCHEDULER_MAX_WORKERS", "4"))
+
+# Вывод скриптов, запущенных отдельным процессом, пишется в лог построчно;
+# для контекста ошибки хранятся только последние OUTPUT_TAIL_LINES строк
+OUTPUT_TAIL_LINES = int(os.getenv("SCHEDULER_OUTPUT_TAIL_LINES", "200"))
+OUTPUT_TAIL_LINE_LENGTH = 1000
 
-def run_script(script_name, sql_config=None):
+# Значения этих переменных окружения заменяются в логе на ***
+SECRET_ENV_VARS = ("TELEGRAM_BOT_TOKEN", "DB_PASSWORD", "OPENROUTER_API_KEY")
+
+job_runner = InProcessRunner()
+
+def _mask_secrets(line, secrets):
+    for secret in secrets:
+        line = line.replace(secret, "***")
+    return line
+
+def _pump_output(stream, script_name, label, level, tail, secrets):
+    """Построчно переносит вывод дочернего процесса в лог, последние строки сохраняет в tail"""
+    with stream:
+        for line in stream:
+            line = _mask_secrets(line.rstrip("\n"), secrets)
+            logger.log(level, f"[{script_name}] {label}: {line}")
+            tail.append(f"{label}: {line[:OUTPUT_TAIL_LINE_LENGTH]}")
+
+def run_script(script_name, sql_config=None, timeout=DEFAULT_JOB_TIMEOUT):
     logger.info(f"Запуск скрипта: {script_name}")
+    tail = deque(maxlen=OUTPUT_TAIL_LINES)
     try:
         env_vars = os.environ.copy()
         if sql_config:
@@ -44,88 +65,123 @@ def run_script(script_name, sql_config=None):
             env_vars["DB_NAME"] = sql_config.get("DB_NAME", env_vars.get("DB_NAME", ""))
             env_vars["DB_USER"] = sql_config.get("DB_USER", env_vars.get("DB_USER", ""))
             env_vars["DB_PASSWORD"] = sql_config.get("DB_PASSWORD", env_vars.get("DB_PASSWORD", ""))
+        # Без буферизации вывод скрипта попадает в лог сразу, а не по завершении
+        env_vars["PYTHONUNBUFFERED"] = "1"
+        secrets = [env_vars[name] for name in SECRET_ENV_VARS if env_vars.get(name)]
+
+        process = subprocess.Popen([sys.executable, script_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   text=True, encoding='utf-8', errors='replace', env=env_vars)
+        readers = [
+            threading.Thread(target=_pump_output, name=f"{script_name}-{label.lower()}", daemon=True,
+                             args=(stream, script_name, label, level, tail, secrets))
+            for stream, label, level in ((process.stdout, "STDOUT", logging.INFO),
+                                         (process.stderr, "STDERR", logging.WARNING))
+        ]
+        for reader in readers:
+            reader.start()
 
-        result = subprocess.run([sys.executable, script_name],
-                                capture_output=True, text=True, timeout=3600, env=env_vars, encoding='utf-8')
-
-        logger.info(f"Скрипт {script_name} завершён с кодом {result.returncode}")
-        if result.stdout:
-            logger.info(f"STDOUT {script_name}:\n{result.stdout}")
-        if result.stderr:
-            if result.returncode != 0:
-                logger.error(f"STDERR {script_name}:\n{result.stderr}")
-            else:
-                logger.warning(f"STDERR {script_name}:\n{result.stderr}")
+        try:
+            returncode = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            for reader in readers:
+                reader.join(timeout=5)
+
+        logger.info(f"Скрипт {script_name} завершён с кодом {returncode}")
+        if returncode == 0:
+            return True
     except subprocess.TimeoutExpired:
-        logger.error(f"Скрипт {script_name} превысил таймаут выполнения (3600 секунд).")
+        logger.error(f"Скрипт {script_name} превысил таймаут выполнения ({timeout} секунд).")
     except Exception as e:
         logger.error(f"Ошибка при запуске {script_name}: {e}")
+    if tail:
+        logger.error(f"Последние строки вывода {script_name}:\n" + "\n".join(tail))
+    return False
+
+def run_in_process(script_name, timeout=DEFAULT_JOB_TIMEOUT):
+    logger.info(f"Запуск скрипта в процессе планировщика: {script_name}")
+    started = time.monotonic()
+    try:
+        result = job_runner.run(script_name, timeout)
+        if result is False:
+            logger.error(f"Скрипт {script_name} завершился с ошибкой за {time.monotonic() - started:.1f} с")
+            return False
+        logger.info(f"Скрипт {script_name} завершён за {time.monotonic() - started:.1f} с")
+        return True
+    except asyncio.TimeoutError:
+        # Поток скрипта при этом не прерывается, см. job_runner
+        logger.error(f"Скрипт {script_name} превысил таймаут выполнения ({timeout} секунд).")
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении {script_name}: {e}", exc_info=True)
+    return False
+
+def run_job(script_name, sql_config=None, mode=None, timeout=DEFAULT_JOB_TIMEOUT):
+    """Запускает скрипт в выбранном режиме. Возвращает True при успешном завершении"""
+    mode = (mode or DEFAULT_JOB_MODE).lower()
+    if mode == "inprocess" and sql_config:
+        # sql_config передается скрипту через переменные окружения, а окружение процесса
+        # планировщика общее для всех одновременно выполняемых задач, поэтому свой
+        # sql_config можно применить только в отдельном процессе
+        logger.info(f"Для {script_name} задан sql_config, запуск в отдельном процессе")
+        mode = "subprocess"
+    if mode == "inprocess":
+        try:
+            job_runner.load_entry_point(script_name)
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить {script_name} в процесс планировщика ({e}), запуск в отдельном процессе")
+            mode = "subprocess"
+
+    if mode == "inprocess":
+        return run_in_process(script_name, timeout)
+    return run_script(script_name, sql_config, timeout)
 
-def schedule_jobs():
-    publications = load_schedule_config()
-    for pub in publications:
-        script = pub["script_name"]
-        days = pub.get("days", [])
-        time_str = pub["time"]
-        sql_config = pub.get("sql_config")
-
-        job_func = (lambda s, sc: lambda: run_script(s, sc))(script, sql_config)
-        
-        scheduled_info = []
-
-        for day_entry in days:
-            day_normalized = str(day_entry).lower()
-
-            if day_normalized == "понедельник":
-                schedule.every().monday.at(time_str).do(job_func)
-                scheduled_info.append(f"Пн в {time_str}")
-            elif day_normalized == "вторник":
-                schedule.every().tuesday.at(time_str).do(job_func)
-                scheduled_info.append(f"Вт в {time_str}")
-            elif day_normalized == "среда":
-                schedule.every().wednesday.at(time_str).do(job_func)
-                scheduled_info.append(f"Ср в {time_str}")
-            elif day_normalized == "четверг":
-                schedule.every().thursday.at(time_str).do(job_func)
-                scheduled_info.append(f"Чт в {time_str}")
-            elif day_normalized == "пятница":
-                schedule.every().friday.at(time_str).do(job_func)
-                scheduled_info.append(f"Пт в {time_str}")
-            elif day_normalized == "суббота":
-                schedule.every().saturday.at(time_str).do(job_func)
-                scheduled_info.append(f"Сб в {time_str}")
-            elif day_normalized == "воскресенье":
-                schedule.every().sunday.at(time_str).do(job_func)
-                scheduled_info.append(f"Вс в {time_str}")
-            elif day_normalized == "ежедневно":
-                 schedule.every().day.at(time_str).do(job_func)
-                 scheduled_info.append(f"Ежедневно в {time_str}")
-            else:
-                logger.warning(f"Неизвестный день недели или формат: '{day_entry}' для скрипта {script}")
-        
-        if scheduled_info:
-            log_message = f"Добавлено расписание для '{script}': {', '.join(scheduled_info)}."
-            if sql_config:
-                log_message += f" Используется SQL конфиг: {json.dumps(sql_config, ensure_ascii=False)}"
-            else:
-                log_message += " Используется SQL конфигурация по умолчанию (из .env или системных переменных)."
-            logger.info(log_message)
-        elif not days :
-             logger.warning(f"Для скрипта '{script}' не указаны дни для запуска.")
+def run_scheduled(job):
+    options = job.options
+    return run_job(job.script_name, options.get("sql_config"), options.get("mode"),
+            options.get("timeout", DEFAULT_JOB_TIMEOUT))
+
+def describe_jobs(jobs):
+    for job in jobs:
+        script = job.script_name
+        sql_config = job.options.get("sql_config")
+        if (job.options.get("mode") or DEFAULT_JOB_MODE).lower() == "inprocess" and not sql_config:
+            # Импортируем публикатор заранее, чтобы первый запуск не тратил время на загрузку модулей
+            try:
+                job_runner.load_entry_point(script)
+            except Exception as e:
+                logger.warning(f"Скрипт '{script}' не удалось загрузить заранее ({e}), он будет запущен в отдельном процессе")
+
+        log_message = f"Добавлено расписание для '{script}': {job.describe()}."
+        if sql_config:
+            log_message += f" Используется SQL конфиг: {json.dumps(sql_config, ensure_ascii=False)}"
+        else:
+            log_message += " Используется SQL конфигурация по умолчанию (из .env или системных переменных)."
+        logger.info(log_message)
 
 def main():
+    configure_logging(LOG_FILE, LOG_FORMAT, sys.stdout)
     logger.info("Запуск планировщика публикаций...")
-    schedule_jobs()
+    if not os.path.exists(SCHEDULE_CONFIG):
+        logger.error(f"Файл {SCHEDULE_CONFIG} не найден!")
+    scheduler = EventScheduler(SCHEDULE_CONFIG, run_scheduled,
+                               watch_interval=CONFIG_WATCH_INTERVAL, on_reload=describe_jobs,
+                               max_workers=MAX_PARALLEL_JOBS)
+    # SIGHUP - перечитать расписание, SIGTERM (stop_scheduler.sh) - завершиться после текущих задач
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: scheduler.request_reload())
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
     logger.info("Планировщик запущен. Ожидание задач...")
     try:
-        while True:
-            schedule.run_pending()
-            time.sleep(10)
+        scheduler.run_forever()
     except KeyboardInterrupt:
         logger.info("Планировщик остановлен пользователем.")
     except Exception as e:
         logger.critical(f"Критическая ошибка в основном цикле планировщика: {e}", exc_info=True)
     finally:
+        job_runner.close()
         logger.info("Завершение работы планировщика.")
 
 if __name__ == "__main__":
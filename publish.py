@@ -0,0 +1,190 @@
+"""
+Единая точка запуска публикаторов.
+
+    python publish.py --list                  # доступные публикаторы
+    python publish.py --check-config          # проверить schedule_config.json и скрипты из него
+    python publish.py cheapest --dry-run      # проверить публикатор и окружение, ничего не отправляя
+    python publish.py cheapest                # выполнить публикацию
+    python publish.py cheapest --from-snapshot  # по последнему снимку данных, без запросов к базе
+
+Вместо имени публикатора можно указать имя скрипта (telegram_publisher.py).
+Модуль публикатора импортируется только перед реальным запуском, а проверки
+(--dry-run, --check-config) читают исходный код скриптов через ast и не загружают
+pandas, psycopg2 и aiohttp, поэтому выполняются за доли секунды.
+"""
+
+import os
+import ast
+import sys
+import argparse
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_CONFIG = "schedule_config.json"
+
+# Скрипты публикаторов лежат рядом с publish.py, откуда бы он ни был запущен
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Короткое имя -> скрипт публикатора
+PUBLISHERS = {
+    'cheapest': 'telegram_publisher.py',
+    'medium': 'medium_apartments_publisher.py',
+    'price-changes': 'price_changes_publisher.py',
+    'report': 'find_cheapest_apartments.py',
+}
+
+# Переменные окружения, без которых публикация не может быть отправлена
+REQUIRED_ENV_VARS = ('TELEGRAM_BOT_TOKEN', 'TELEGRAM_CHANNEL_ID')
+DB_ENV_VARS = ('DB_HOST', 'DB_PORT', 'DB_NAME', 'DB_USER', 'DB_PASSWORD')
+
+# Скрипты, которые только формируют отчет и ничего не отправляют в Telegram
+REPORT_ONLY_SCRIPTS = ('find_cheapest_apartments.py',)
+
+def resolve_script(name):
+    """Имя скрипта по короткому имени публикатора, имени модуля или файла"""
+    if name in PUBLISHERS:
+        return PUBLISHERS[name]
+    return name if name.endswith('.py') else f"{name}.py"
+
+def script_path(script_name):
+    """Путь к скрипту: относительные имена отсчитываются от каталога publish.py, а не от текущего"""
+    return script_name if os.path.isabs(script_name) else os.path.join(SCRIPTS_DIR, script_name)
+
+def entry_point_kind(script_name):
+    """
+    Находит в исходном коде скрипта функцию main, не импортируя его.
+    Возвращает 'async', 'sync' или None, если функции нет.
+    """
+    path = script_path(script_name)
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    for node in tree.body:
+        if isinstance(node, ast.AsyncFunctionDef) and node.name == 'main':
+            return 'async'
+        if isinstance(node, ast.FunctionDef) and node.name == 'main':
+            return 'sync'
+    return None
+
+def check_script(script_name, need_entry_point=True):
+    """Список проблем скрипта: нет файла, синтаксическая ошибка, нет main()"""
+    if not os.path.exists(script_path(script_name)):
+        return [f"файл {script_name} не найден"]
+    try:
+        kind = entry_point_kind(script_name)
+    except SyntaxError as e:
+        return [f"синтаксическая ошибка в {script_name}: строка {e.lineno}: {e.msg}"]
+    if need_entry_point and kind is None:
+        return [f"в {script_name} нет функции main()"]
+    return []
+
+def check_config(config_path=SCHEDULE_CONFIG):
+    """Проверяет расписание: разбор файла, наличие скриптов и зависимостей. Возвращает число проблем"""
+    from scheduler_core import load_jobs
+
+    try:
+        jobs = load_jobs(config_path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Не удалось прочитать {config_path}: {e}")
+        return 1
+
+    problems = 0
+    names = {job.script_name for job in jobs}
+    now = datetime.now().astimezone()
+    for job in jobs:
+        mode = (job.options.get('mode') or os.getenv('SCHEDULER_JOB_MODE', 'inprocess')).lower()
+        issues = check_script(job.script_name, need_entry_point=mode == 'inprocess' and not job.options.get('sql_config'))
+        issues += [f"зависимость {dependency} отсутствует в расписании" for dependency in job.after if dependency not in names]
+        next_run = job.next_run(now)
+        fallback = job.next_fallback(now)
+        if next_run:
+            when = next_run.strftime('%d.%m.%Y %H:%M:%S')
+        elif fallback:
+            when = f"после зависимостей, не позже {fallback.strftime('%d.%m.%Y %H:%M:%S')}"
+        else:
+            when = "после зависимостей"
+        print(f"{'OK ' if not issues else 'ERR'} {job.script_name}: {job.describe()}; ближайший запуск: {when}")
+        for issue in issues:
+            print(f"    {issue}")
+        problems += len(issues)
+    print(f"Публикаций в расписании: {len(jobs)}, проблем: {problems}")
+    return problems
+
+def dry_run(script_name):
+    """Проверяет публикатор и окружение без подключения к базе и Telegram. Возвращает число проблем"""
+    from dotenv import load_dotenv
+    from telegram_delivery import parse_chat_ids
+
+    load_dotenv()
+    issues = check_script(script_name)
+    required = () if os.path.basename(script_name) in REPORT_ONLY_SCRIPTS else REQUIRED_ENV_VARS
+    missing = [name for name in required if not os.getenv(name)]
+    issues += [f"не задана переменная окружения {name}" for name in missing]
+
+    print(f"Публикатор: {script_name}")
+    print(f"Каналы: {len(parse_chat_ids(os.getenv('TELEGRAM_CHANNEL_ID')))}")
+    print("База данных: " + ", ".join(f"{name}={'задан' if os.getenv(name) else 'по умолчанию'}" for name in DB_ENV_VARS))
+    for issue in issues:
+        print(f"  {issue}")
+    print("Проверка пройдена, публикация не отправлялась" if not issues else f"Проблем: {len(issues)}")
+    return len(issues)
+
+def run(script_name, from_snapshot=None):
+    """Импортирует публикатор и выполняет его main() (from_snapshot - см. report_snapshot.py)"""
+    import inspect
+    import importlib
+    from dotenv import load_dotenv
+    from load_env import configure_logging
+
+    configure_logging()
+    load_dotenv()
+    module = importlib.import_module(os.path.splitext(os.path.basename(script_name))[0])
+    entry_point = getattr(module, 'main', None)
+    if not callable(entry_point):
+        logger.error(f"В {script_name} нет функции main()")
+        return 1
+    kwargs = {}
+    if from_snapshot:
+        if 'from_snapshot' not in inspect.signature(entry_point).parameters:
+            logger.error(f"{script_name} не поддерживает --from-snapshot")
+            return 1
+        kwargs['from_snapshot'] = from_snapshot
+    if inspect.iscoroutinefunction(entry_point):
+        from telegram_delivery import run_standalone
+        result = run_standalone(entry_point(**kwargs))
+    else:
+        result = entry_point(**kwargs)
+    return 1 if result is False else 0
+
+def main(argv=None):
+    from report_snapshot import add_snapshot_argument
+
+    parser = argparse.ArgumentParser(description="Запуск публикаций в Telegram",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="публикаторы: " + ", ".join(f"{name} ({script})" for name, script in PUBLISHERS.items()))
+    parser.add_argument('publisher', nargs='?', help="короткое имя публикатора или имя скрипта")
+    parser.add_argument('--dry-run', action='store_true', help="проверить публикатор и окружение, ничего не отправляя")
+    parser.add_argument('--check-config', action='store_true', help="проверить расписание публикаций")
+    parser.add_argument('--config', default=SCHEDULE_CONFIG, help=f"файл расписания (по умолчанию {SCHEDULE_CONFIG})")
+    parser.add_argument('--list', action='store_true', help="показать доступные публикаторы")
+    add_snapshot_argument(parser)
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, script in PUBLISHERS.items():
+            print(f"{name:<15}{script}")
+        return 0
+    if args.check_config:
+        return 1 if check_config(args.config) else 0
+    if not args.publisher:
+        parser.print_usage()
+        return 2
+
+    script_name = resolve_script(args.publisher)
+    if args.dry_run:
+        return 1 if dry_run(script_name) else 0
+    return run(script_name, args.from_snapshot)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Отбор топ-N объявлений в каждой локации.
+"""
+
+import pandas as pd
+from psycopg2 import sql
+from database import read_prepared, statement_name
+
+def top_n_per_location(df, n=3, rank_by='price', ascending=True, group_col='location'):
+    """
+    Возвращает до n лучших строк для каждой локации за один проход:
+    одна сортировка по (локация, ключ ранжирования, id) и groupby().head(n)
+    вместо фильтрации и сортировки отдельного среза на каждую локацию.
+    Строки без локации отбрасываются. Результат упорядочен по локации, затем по ключу
+    (пропуски ключа в конце при любом направлении), затем по id - так же, как в
+    TOP_N_PER_LOCATION_SQL.
+    """
+    locations = df[group_col]
+    df = df[locations.notna() & (locations != '')]
+    if df.empty:
+        return df
+
+    # id разрешает равенство ключей; mergesort устойчив, поэтому без колонки id
+    # при равных значениях ключа сохраняется исходный порядок строк
+    keys = [group_col, rank_by] + (['id'] if 'id' in df.columns and rank_by != 'id' else [])
+    ordered = df.sort_values(keys, ascending=[True, ascending] + [True] * (len(keys) - 2), kind='mergesort')
+    return ordered.groupby(group_col, sort=False).head(n)
+
+def stream_top_n_per_location(batches, n=3, rank_by='price', ascending=True, group_col='location'):
+    """
+    Отбирает до n лучших строк в каждой локации из последовательности пачек DataFrame.
+    После каждой пачки сохраняются только текущие лидеры локаций, поэтому память
+    ограничена размером пачки и числом локаций * n, а не размером всей выборки.
+    Результат совпадает с top_n_per_location для объединения всех пачек.
+    """
+    top = None
+    for batch in batches:
+        # Лидеры идут перед новой пачкой, поэтому при равных ключах сохраняется исходный порядок строк
+        combined = batch if top is None else pd.concat([top, batch], ignore_index=True)
+        top = top_n_per_location(combined, n=n, rank_by=rank_by, ascending=ascending, group_col=group_col)
+    return top if top is not None else pd.DataFrame()
+
+# Ранжирование на стороне PostgreSQL: в клиент передаются только публикуемые строки.
+# Порядок совпадает с top_n_per_location: локации сравниваются побайтно (COLLATE "C",
+# как строки в pandas), пропуски ключа идут последними, равенство разрешается по id
+TOP_N_PER_LOCATION_SQL = """
+SELECT id, title, price, rooms, baths, area, location, property_url, updated_at
+FROM (
+    SELECT
+        id, title, price, rooms, baths, area, location, property_url, updated_at,
+        ROW_NUMBER() OVER (PARTITION BY location ORDER BY {rank_by} {direction} NULLS LAST, id) AS rn
+    FROM bayut_properties
+    WHERE area <= %(max_area)s
+    AND location IS NOT NULL AND location <> ''
+) ranked
+WHERE rn <= %(n)s
+ORDER BY location COLLATE "C", {rank_by} {direction} NULLS LAST, id
+"""
+
+def fetch_top_n_per_location(conn, n=3, rank_by='price', ascending=True, max_area=40):
+    """Выполняет отбор top-N квартир каждой локации в SQL и возвращает только отобранные строки"""
+    query = sql.SQL(TOP_N_PER_LOCATION_SQL).format(
+        rank_by=sql.Identifier(rank_by),
+        direction=sql.SQL('ASC' if ascending else 'DESC'),
+    )
+    name = statement_name('top_n_per_location', rank_by, 'asc' if ascending else 'desc')
+    return read_prepared(conn, name, query.as_string(conn), {'max_area': max_area, 'n': n})
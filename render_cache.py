@@ -0,0 +1,186 @@
+"""
+Кэш отрисовки отчетов по отпечатку отобранных объявлений.
+
+Отпечаток строки - хэш всех полей, которые выводятся в блоке объявления (id, название,
+цены, изменение цены, площадь, комнаты, ссылка), и дат обновления; отпечаток раздела
+локации - хэш отпечатков ее строк вместе с версией шаблона (report_format.TEMPLATE_VERSION). Отрисовываются только разделы локаций, у которых
+отпечаток изменился, остальные берутся из кэша предыдущего запуска. Отпечаток всего
+отчета сравнивается с последним опубликованным, и публикатор может пропустить или
+сократить публикацию, если данные не изменились (REPORT_UNCHANGED_MODE):
+publish - публиковать как обычно, skip - не публиковать, short - короткое сообщение.
+
+Кэш хранится в CACHE_DIR/<имя отчета>.json: разделы последней отрисовки,
+отпечаток и файл последнего отчета, а также отпечаток последней публикации.
+"""
+
+import os
+import json
+import tempfile
+import hashlib
+import logging
+from datetime import datetime
+import pandas as pd
+from report_format import TEMPLATE_VERSION, render_location_blocks
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv('RENDER_CACHE_DIR', os.path.join('cache', 'render'))
+
+UNCHANGED_MODES = ('publish', 'skip', 'short')
+UNCHANGED_MODE = os.getenv('REPORT_UNCHANGED_MODE', 'publish').lower()
+
+# Поля, изменение которых меняет текст объявления в отчете: все, что выводят шаблоны
+# report_format, а также даты обновления (раздел считается новым при обновлении объявления)
+FINGERPRINT_COLUMNS = (
+    'id', 'title', 'price', 'prev_price', 'pct_change', 'area', 'rooms', 'property_url',
+    'updated_at', 'current_updated_at', 'prev_updated_at',
+)
+
+def row_hashes(df, group_col='location'):
+    """Хэши строк по полям FINGERPRINT_COLUMNS (uint64), вычисляются векторно"""
+    columns = [group_col] + [column for column in FINGERPRINT_COLUMNS if column in df.columns]
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+def _digest(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+class ReportCache:
+    """Разделы последнего отчета и отпечатки последней отрисовки и публикации"""
+
+    def __init__(self, name, cache_dir=CACHE_DIR, render_key=''):
+        self.name = name
+        self.path = os.path.join(cache_dir, f"{name}.json")
+        # Все, что кроме данных влияет на текст: версия шаблона и режим очистки текста
+        self.render_key = f"{TEMPLATE_VERSION}:{render_key}"
+        self.state = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать кэш отчета {self.path}: {e}")
+            return {}
+
+    def _write(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Уникальное имя временного файла: кэш могут писать несколько потоков планировщика
+        fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix=os.path.basename(self.path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def render(self, df, render_rows, header, group_col='location'):
+        """
+        Возвращает (текст отчета, отпечаток). Строки df должны быть сгруппированы по локации.
+        render_rows(df, group_col) возвращает текстовые блоки объявлений
+        (report_format.format_cheapest_rows, format_price_change_rows).
+        """
+        cached = self.state.get('sections', {}) if self.state.get('render_key') == self.render_key else {}
+        hashes = row_hashes(df, group_col)
+
+        section_keys = []
+        stale = []
+        for location, positions in df.groupby(group_col, sort=False, dropna=False).indices.items():
+            key = _digest(self.render_key, location, hashes[positions].tobytes())
+            section_keys.append(key)
+            if key not in cached:
+                stale.append((key, positions))
+
+        sections = {key: cached[key] for key in section_keys if key in cached}
+        if stale:
+            # Все устаревшие разделы отрисовываются одним векторным вызовом
+            changed = df.iloc[[position for _, positions in stale for position in positions]]
+            blocks = render_rows(changed, group_col=group_col)
+            start = 0
+            for key, positions in stale:
+                end = start + len(positions)
+                sections[key] = "\n".join(render_location_blocks(changed.iloc[start:end], blocks[start:end], group_col))
+                start = end
+        logger.info(f"Отчет {self.name}: разделов {len(section_keys)}, отрисовано заново {len(stale)}")
+
+        fingerprint = _digest(self.render_key, header, *section_keys)
+        self.state.update({
+            'render_key': self.render_key,
+            'sections': {key: sections[key] for key in section_keys},
+            'fingerprint': fingerprint,
+        })
+        self._write()
+        return "\n".join([header] + [sections[key] for key in section_keys]), fingerprint
+
+    def last_report_file(self, fingerprint):
+        """Файл отчета с тем же отпечатком, если он сохранен и еще существует"""
+        saved = self.state.get('report')
+        if saved and saved.get('fingerprint') == fingerprint and os.path.exists(saved.get('file', '')):
+            return saved['file']
+        return None
+
+    def remember_report_file(self, fingerprint, path):
+        self.state['report'] = {'fingerprint': fingerprint, 'file': path}
+        self._write()
+
+    def unchanged_since_publication(self):
+        """Совпадает ли последняя отрисовка с последней опубликованной версией"""
+        published = self.state.get('published')
+        return bool(published) and published.get('fingerprint') == self.state.get('fingerprint')
+
+    def published_at(self):
+        return (self.state.get('published') or {}).get('at')
+
+    def mark_published(self):
+        """Отмечает последнюю отрисовку опубликованной"""
+        self.state['published'] = {'fingerprint': self.state.get('fingerprint'), 'at': datetime.now().isoformat()}
+        self._write()
+
+def save_report(cache, analysis, fingerprint, reports_dir, prefix):
+    """
+    Сохраняет текст отчета в reports_dir/<prefix>_<дата>.txt, если отчета с тем же
+    отпечатком еще нет на диске. Возвращает путь к файлу отчета.
+    """
+    existing = cache.last_report_file(fingerprint)
+    if existing:
+        print(f"Данные не изменились, отчет совпадает с {existing}")
+        return existing
+    output_file = os.path.join(reports_dir, f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(analysis)
+    cache.remember_report_file(fingerprint, output_file)
+    print(f"Результаты сохранены в файл: {output_file}")
+    return output_file
+
+def unchanged_report_mode():
+    """Режим публикации неизменившегося отчета из REPORT_UNCHANGED_MODE"""
+    if UNCHANGED_MODE not in UNCHANGED_MODES:
+        logger.warning(f"Неизвестный REPORT_UNCHANGED_MODE={UNCHANGED_MODE}, используется publish")
+        return 'publish'
+    return UNCHANGED_MODE
+
+def text_to_publish(cache, analysis):
+    """
+    Текст для публикации с учетом REPORT_UNCHANGED_MODE: сам отчет, если данные изменились
+    с последней публикации, иначе короткое сообщение или None (публикация пропускается)
+    """
+    if not cache.unchanged_since_publication():
+        return analysis
+    mode = unchanged_report_mode()
+    published_at = cache.published_at() or ''
+    if mode == 'skip':
+        logger.info(f"Отчет {cache.name} не изменился с публикации {published_at}, публикация пропущена")
+        return None
+    if mode == 'short':
+        logger.info(f"Отчет {cache.name} не изменился с публикации {published_at}, публикуется короткое сообщение")
+        when = datetime.fromisoformat(published_at).strftime('%d.%m.%Y') if published_at else 'прошлой'
+        return f"С публикации от {when} данные по отобранным объявлениям не изменились."
+    return analysis
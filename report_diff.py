@@ -0,0 +1,197 @@
+"""
+Режим публикации "что изменилось с прошлого поста".
+
+Для каждого публикатора сохраняется снимок последней опубликованной подборки,
+проиндексированный по локациям: отпечаток раздела (render_cache.row_hashes) и строки
+по id, а также общий отпечаток подборки. Если общие отпечатки совпадают, подборки
+не сравниваются вовсе; иначе изменившиеся локации находятся разностью множеств пар
+(локация, отпечаток), и построчно сравниваются только они, поэтому работа сравнения
+пропорциональна числу изменившихся строк, а не размеру подборки.
+Публикуется только разница: новые объявления, выбывшие из подборки и изменения цен.
+
+Снимок подборки сохраняется при каждом запуске (и без REPORT_DIFF_MODE, чтобы при
+включении режима уже было с чем сравнивать): сначала как ожидающий (pending),
+а опубликованным (commit) он становится только после успешной отправки в Telegram.
+Время отправки записывается в снимок при commit и выводится как дата прошлого поста.
+"""
+
+import os
+import json
+import tempfile
+import hashlib
+import logging
+from datetime import datetime
+from render_cache import row_hashes
+from report_format import LOCATION_SEPARATOR, format_money
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv('REPORT_DIFF_DIR', os.path.join('cache', 'published'))
+
+DIFF_MODE = os.getenv('REPORT_DIFF_MODE', '0').lower() in ('1', 'true', 'yes')
+
+# Поля строки, которые нужны для текста разницы
+ROW_FIELDS = ('title', 'price', 'property_url')
+
+def index_selection(df, group_col='location'):
+    """
+    Индексирует подборку: {локация: {'hash': отпечаток раздела, 'rows': {id: поля}}}.
+    Строки df должны быть сгруппированы по локации.
+    """
+    hashes = row_hashes(df, group_col)
+    columns = {field: df[field].tolist() for field in ROW_FIELDS if field in df.columns}
+    ids = df['id'].tolist()
+    index = {}
+    for location, positions in df.groupby(group_col, sort=False, dropna=False).indices.items():
+        index[str(location)] = {
+            'hash': hashlib.sha1(hashes[positions].tobytes()).hexdigest(),
+            'rows': {
+                str(ids[position]): {field: _plain(values[position]) for field, values in columns.items()}
+                for position in positions.tolist()
+            },
+        }
+    return index
+
+def selection_fingerprint(selection):
+    """Общий отпечаток проиндексированной подборки: не зависит от порядка локаций"""
+    pairs = sorted((location, section['hash']) for location, section in selection.items())
+    return hashlib.sha1(json.dumps(pairs, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def _plain(value):
+    """Значение, пригодное для JSON (numpy и Decimal приводятся к float, прочее - к строке)"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+def diff_selections(previous, current):
+    """
+    Разница двух проиндексированных подборок: {локация: {'new': [...], 'dropped': [...], 'moved': [...]}}.
+    Локации с совпадающим отпечатком не просматриваются.
+    """
+    previous_hashes = {location: section['hash'] for location, section in previous.items()}
+    current_hashes = {location: section['hash'] for location, section in current.items()}
+    changes = {}
+    # Локации, которых нет в прошлой подборке или у которых изменился отпечаток;
+    # в отчет они попадают в порядке новой подборки
+    changed = {location for location, _ in current_hashes.items() - previous_hashes.items()}
+    for location in [location for location in current_hashes if location in changed]:
+        old = previous.get(location)
+        old_rows = old['rows'] if old else {}
+        rows = current[location]['rows']
+        entry = {
+            'new': [rows[key] for key in rows if key not in old_rows],
+            'dropped': [old_rows[key] for key in old_rows if key not in rows],
+            'moved': [
+                (old_rows[key], rows[key]) for key in rows
+                if key in old_rows and old_rows[key].get('price') != rows[key].get('price')
+            ],
+        }
+        if any(entry.values()):
+            changes[location] = entry
+    for location in previous_hashes.keys() - current_hashes.keys():
+        changes[location] = {'new': [], 'dropped': list(previous[location]['rows'].values()), 'moved': []}
+    return changes
+
+def _money(value):
+    try:
+        return format_money(float(value))
+    except (TypeError, ValueError):
+        return str(value)
+
+def format_changes(changes):
+    """Текст разницы по локациям"""
+    lines = []
+    for location, entry in changes.items():
+        lines.append(f"Локация: {location}")
+        lines.append(LOCATION_SEPARATOR)
+        for row in entry['new']:
+            lines.append(f"🆕 {row.get('title')}\n   Цена: {_money(row.get('price'))} AED\n   Ссылка: {row.get('property_url')}")
+        for old, row in entry['moved']:
+            old_price, price = old.get('price'), row.get('price')
+            change = ""
+            if isinstance(old_price, (int, float)) and isinstance(price, (int, float)) and old_price:
+                change = f" ({(price - old_price) / old_price * 100:+.2f}%)"
+            lines.append(f"💱 {row.get('title')}\n   Цена: {_money(old_price)} -> {_money(price)} AED{change}\n"
+                         f"   Ссылка: {row.get('property_url')}")
+        for row in entry['dropped']:
+            lines.append(f"❌ Выбыло из подборки: {row.get('title')}")
+        lines.append("")
+    return "\n".join(lines)
+
+class PublishedSelection:
+    """Снимок последней опубликованной подборки публикатора и ожидающий снимок новой"""
+
+    def __init__(self, name, snapshot_dir=SNAPSHOT_DIR):
+        self.name = name
+        self.path = os.path.join(snapshot_dir, f"{name}.json")
+        self.pending_path = os.path.join(snapshot_dir, f"{name}.pending.json")
+        self.current = None
+        self.fingerprint = None
+
+    def _read(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать снимок подборки {path}: {e}")
+            return None
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def stage(self, df, group_col='location'):
+        """Сохраняет новую подборку как ожидающую публикации"""
+        self.current = index_selection(df, group_col)
+        self.fingerprint = selection_fingerprint(self.current)
+        self._write(self.pending_path, {
+            'created_at': datetime.now().isoformat(),
+            'fingerprint': self.fingerprint,
+            'locations': self.current,
+        })
+
+    def changes_report(self, title):
+        """
+        Текст разницы между подготовленной (stage) и опубликованной подборками.
+        Возвращает None, если опубликованного снимка еще нет (нужно опубликовать полный отчет).
+        """
+        published = self._read(self.path)
+        if published is None:
+            logger.info(f"Снимка опубликованной подборки {self.name} нет, публикуется полный отчет")
+            return None
+
+        if published.get('fingerprint') == self.fingerprint:
+            changes = {}
+        else:
+            changes = diff_selections(published['locations'], self.current)
+        counts = {kind: sum(len(entry[kind]) for entry in changes.values()) for kind in ('new', 'moved', 'dropped')}
+        logger.info(f"Изменения подборки {self.name}: локаций {len(changes)}, {counts}")
+        # Снимки, опубликованные до появления published_at, датируются временем подготовки
+        since = datetime.fromisoformat(published.get('published_at') or published['created_at']).strftime('%d.%m.%Y')
+        if not changes:
+            return f"{title}\nС публикации от {since} подборка не изменилась."
+        return (f"{title}\nИзменения с публикации от {since}: новых {counts['new']}, "
+                f"изменений цены {counts['moved']}, выбыло {counts['dropped']}\n\n" + format_changes(changes))
+
+    def commit(self):
+        """Делает ожидающий снимок опубликованным (после успешной отправки) и записывает время публикации"""
+        pending = self._read(self.pending_path)
+        if pending is None:
+            return
+        pending['published_at'] = datetime.now().isoformat()
+        self._write(self.path, pending)
+        os.remove(self.pending_path)
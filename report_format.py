@@ -0,0 +1,128 @@
+"""
+Форматирование отобранных объявлений в текст отчета.
+
+Колонки приводятся к строкам один раз и векторно, после чего значения
+подставляются в заранее подготовленные шаблоны через zip по спискам колонок -
+без DataFrame.iterrows() и без pd.isna()/float() на каждое поле.
+"""
+
+import numpy as np
+import pandas as pd
+
+LOCATION_SEPARATOR = "------------------------------"
+
+# Версия шаблонов: входит в ключ кэша отрисовки (render_cache.py),
+# увеличивайте ее при любом изменении текста шаблонов и форматирования
+TEMPLATE_VERSION = 1
+
+# Шаблоны блока одного объявления. Завершающий перевод строки дает пустую строку
+# между объявлениями после "\n".join(...)
+CHEAPEST_TEMPLATE = (
+    "{0}. {1}\n"
+    "   ID: {2}\n"
+    "   Цена: {3} AED\n"
+    "   Площадь: {4} кв.м.\n"
+    "   Спальни: {5}\n"
+    "   Ссылка: {6}\n"
+).format
+
+PRICE_CHANGE_TEMPLATE = (
+    "{0}. {1}\n"
+    "   ID: {2}\n"
+    "   Текущая цена: {3} AED\n"
+    "   Предыдущая цена: {4} AED\n"
+    "   Изменение: {5}{6}\n"
+    "   Площадь: {7} кв.м.\n"
+    "   Спальни: {8}\n"
+    "   Ссылка: {9}\n"
+).format
+
+format_money = '{:,.2f}'.format
+format_area = '{:.2f}'.format
+
+def _numeric(series):
+    """Приводит колонку к float, пропуски и нечисловые значения заменяются нулем"""
+    return pd.to_numeric(series, errors='coerce').fillna(0).astype(float)
+
+def _formatted(series, fmt):
+    return list(map(fmt, _numeric(series).tolist()))
+
+def _integers(series):
+    return _numeric(series).astype(int).tolist()
+
+def _dates(series):
+    """Форматирует даты как дд.мм.гггг; значения, не являющиеся датами, выводятся как есть"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime('%d.%m.%Y')
+    return series.map(lambda value: value.strftime('%d.%m.%Y') if hasattr(value, 'strftime') else str(value))
+
+def _positions(df, group_col):
+    """Порядковые номера объявлений внутри локации, начиная с 1"""
+    return (df.groupby(group_col, sort=False).cumcount() + 1).tolist()
+
+def format_cheapest_rows(df, group_col='location'):
+    """Возвращает текстовые блоки объявлений для отчета о самых дешевых квартирах"""
+    return list(map(
+        CHEAPEST_TEMPLATE,
+        _positions(df, group_col),
+        df['title'].tolist(),
+        df['id'].tolist(),
+        _formatted(df['price'], format_money),
+        _formatted(df['area'], format_area),
+        _integers(df['rooms']),
+        df['property_url'].tolist(),
+    ))
+
+def format_price_change_rows(df, group_col='location'):
+    """Возвращает текстовые блоки объявлений для отчета об изменениях цен"""
+    pct_change = _numeric(df['pct_change']).to_numpy()
+    rising = pct_change > 0
+    symbols = np.where(rising, "📈 +", "📉 ")
+    changes = [f"{symbol}{value:.2f}%" for symbol, value in zip(symbols.tolist(), pct_change.tolist())]
+
+    # Информация о датах изменения цены выводится, только если известны обе даты
+    date_info = [""] * len(df)
+    if 'current_updated_at' in df.columns and 'prev_updated_at' in df.columns:
+        known = (df['current_updated_at'].notna() & df['prev_updated_at'].notna()).to_numpy()
+        if known.any():
+            current_dates = _dates(df['current_updated_at'][known]).tolist()
+            prev_dates = _dates(df['prev_updated_at'][known]).tolist()
+            formatted = [
+                f"\n   Последнее обновление: {current}\n   Предыдущее обновление: {prev}"
+                for current, prev in zip(current_dates, prev_dates)
+            ]
+            for position, text in zip(np.flatnonzero(known).tolist(), formatted):
+                date_info[position] = text
+
+    return list(map(
+        PRICE_CHANGE_TEMPLATE,
+        _positions(df, group_col),
+        df['title'].tolist(),
+        df['id'].tolist(),
+        _formatted(df['price'], format_money),
+        _formatted(df['prev_price'], format_money),
+        changes,
+        date_info,
+        _formatted(df['area'], format_area),
+        _integers(df['rooms']),
+        df['property_url'].tolist(),
+    ))
+
+def render_location_blocks(df, blocks, group_col='location'):
+    """
+    Собирает строки отчета: заголовок локации, разделитель и блоки ее объявлений.
+    Строки df должны быть сгруппированы по локации (как после top_n_per_location).
+    """
+    lines = []
+    previous = None
+    for location, block in zip(df[group_col].tolist(), blocks):
+        if location != previous:
+            if previous is not None:
+                lines.append("")
+            lines.append(f"Локация: {location}")
+            lines.append(LOCATION_SEPARATOR)
+            previous = location
+        lines.append(block)
+    if previous is not None:
+        lines.append("")
+    return lines
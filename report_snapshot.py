@@ -0,0 +1,121 @@
+"""
+Снимки данных, по которым строились отчеты.
+
+При каждом запуске публикатор сохраняет выгруженные из базы данные рядом с текстом
+отчета: reports/<префикс отчета>_<дата>.arrow. Файлы пишутся в формате Arrow IPC
+(Feather v2) без сжатия, поэтому таблица Arrow открывается через memory map: страницы
+файла подгружаются операционной системой по мере обращения, без чтения в отдельный
+буфер и без разбора. Преобразование в DataFrame копирует данные в память pandas
+(строки становятся объектами Python) - публикаторы работают с DataFrame, а снимок
+содержит только выгруженные для отчета колонки, поэтому копируется столько же,
+сколько при выгрузке из базы.
+
+Для каждого отчета хранятся последние REPORT_SNAPSHOTS_KEEP снимков (по умолчанию 30),
+более старые удаляются после сохранения нового.
+
+С флагом --from-snapshot публикаторы и format_apartments_report() строят отчет
+по сохраненному снимку и не подключаются к базе данных: это позволяет заново
+отрисовать отчет, сравнить шаблоны или повторить публикацию без нагрузки на базу.
+
+    python telegram_publisher.py --from-snapshot                    # последний снимок публикатора
+    python publish.py medium --from-snapshot reports/medium_apartments_20250614_090000.arrow
+"""
+
+import os
+import glob
+import tempfile
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+REPORTS_DIR = "reports"
+SNAPSHOT_EXTENSION = ".arrow"
+
+# Значение --from-snapshot без пути: последний снимок публикатора
+LATEST = "latest"
+
+SAVE_SNAPSHOTS = os.getenv('SAVE_REPORT_SNAPSHOTS', '1').lower() in ('1', 'true', 'yes')
+
+# Сколько последних снимков каждого отчета хранить (0 - не удалять)
+SNAPSHOTS_KEEP = int(os.getenv('REPORT_SNAPSHOTS_KEEP', '30'))
+
+def save_report_snapshot(df, prefix, reports_dir=REPORTS_DIR):
+    """
+    Атомарно сохраняет данные отчета в reports_dir/<prefix>_<дата>.arrow.
+    Возвращает путь к файлу или None, если сохранение отключено (SAVE_REPORT_SNAPSHOTS=0).
+    """
+    if not SAVE_SNAPSHOTS:
+        return None
+    os.makedirs(reports_dir, exist_ok=True)
+    path = os.path.join(reports_dir, f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{SNAPSHOT_EXTENSION}")
+    fd, tmp_path = tempfile.mkstemp(dir=reports_dir, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        # Без сжатия: сжатые буферы нельзя читать через memory map
+        df.reset_index(drop=True).to_feather(tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+    except Exception as e:
+        # Снимок нужен только для повторной отрисовки, его ошибка не должна прерывать отчет
+        logger.warning(f"Не удалось сохранить снимок данных отчета {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    logger.info(f"Данные отчета сохранены в {path} ({len(df)} строк)")
+    prune_report_snapshots(prefix, reports_dir)
+    return path
+
+def _report_snapshots(prefix, reports_dir):
+    """Снимки с префиксом prefix от старых к новым (дата в имени файла сортируется как строка)"""
+    return sorted(glob.glob(os.path.join(glob.escape(reports_dir), f"{glob.escape(prefix)}_*{SNAPSHOT_EXTENSION}")))
+
+def prune_report_snapshots(prefix, reports_dir=REPORTS_DIR, keep=SNAPSHOTS_KEEP):
+    """Удаляет снимки prefix сверх keep последних. Возвращает число удаленных файлов"""
+    if keep <= 0:
+        return 0
+    removed = 0
+    for path in _report_snapshots(prefix, reports_dir)[:-keep]:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Не удалось удалить старый снимок данных отчета {path}: {e}")
+    if removed:
+        logger.info(f"Удалено старых снимков данных {prefix}: {removed}")
+    return removed
+
+def latest_report_snapshot(prefix, reports_dir=REPORTS_DIR):
+    """Путь к последнему снимку с префиксом prefix или None"""
+    paths = _report_snapshots(prefix, reports_dir)
+    return paths[-1] if paths else None
+
+def resolve_report_snapshot(source, prefix, reports_dir=REPORTS_DIR):
+    """Путь к снимку по значению --from-snapshot: путь к файлу или 'latest'"""
+    if source in (True, LATEST):
+        path = latest_report_snapshot(prefix, reports_dir)
+        if path is None:
+            raise FileNotFoundError(f"В {reports_dir} нет снимков данных {prefix}_*{SNAPSHOT_EXTENSION}")
+        return path
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"Снимок данных {source} не найден")
+    return source
+
+def read_report_snapshot(source, prefix, reports_dir=REPORTS_DIR):
+    """
+    Открывает снимок данных отчета через memory map и возвращает DataFrame.
+    Таблица Arrow ссылается на отображенный файл, а to_pandas() копирует ее в память pandas.
+    """
+    import pyarrow.feather as feather
+
+    path = resolve_report_snapshot(source, prefix, reports_dir)
+    df = feather.read_table(path, memory_map=True).to_pandas()
+    logger.info(f"Данные отчета прочитаны из снимка {path} ({len(df)} строк)")
+    print(f"Используется снимок данных {path}, база данных не используется")
+    return df
+
+def add_snapshot_argument(parser):
+    """Добавляет в argparse флаг --from-snapshot [ФАЙЛ]"""
+    parser.add_argument('--from-snapshot', nargs='?', const=LATEST, metavar='ФАЙЛ',
+                        help=f"построить отчет по сохраненному снимку данных ({REPORTS_DIR}/*{SNAPSHOT_EXTENSION}) "
+                             "без подключения к базе; без указания файла берется последний снимок")
+    return parser
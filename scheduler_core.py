@@ -0,0 +1,347 @@
+"""
+Ядро планировщика публикаций: куча сроков выполнения вместо опроса каждые 10 секунд.
+
+Для каждой публикации из schedule_config.json вычисляется ближайший момент запуска,
+моменты хранятся в куче, а поток спит ровно до ближайшего из них. Поддерживаются
+время с секундами ("09:00:30"), часовые пояса (поле "timezone" у публикации или
+на верхнем уровне конфигурации) и перезагрузка конфигурации без перезапуска:
+по сигналу SIGHUP сразу или при изменении файла, которое проверяется не чаще
+раза в watch_interval секунд.
+
+Задачи выполняются в ограниченном пуле потоков, поэтому долгая задача не задерживает
+остальные. Публикация может зависеть от других задач (поле "after"): она запускается,
+как только все зависимости успешно завершились в тот же день. Если у такой публикации
+задано и время, она запускается не раньше этого времени. Время "fallback_time" - запасной
+запуск: если к нему зависимости в этот день так и не завершились успешно (загрузка данных
+упала или не запускалась), публикация выполняется по уже имеющимся данным.
+"""
+
+import os
+import json
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone, time as dt_time
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+DAYS = {
+    "понедельник": 0,
+    "вторник": 1,
+    "среда": 2,
+    "четверг": 3,
+    "пятница": 4,
+    "суббота": 5,
+    "воскресенье": 6,
+}
+EVERY_DAY = "ежедневно"
+DAY_LABELS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+def parse_time(value):
+    """Разбирает время в формате ЧЧ:ММ или ЧЧ:ММ:СС"""
+    parts = [int(part) for part in str(value).split(":")]
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Неверный формат времени: '{value}'")
+    return dt_time(*parts)
+
+class ScheduledJob:
+    """Публикация из конфигурации: скрипт, дни недели, время и часовой пояс запуска"""
+
+    def __init__(self, script_name, weekdays, at, tz=None, options=None, after=(), fallback=None):
+        self.script_name = script_name
+        self.weekdays = frozenset(weekdays)
+        self.at = at
+        self.tz = tz
+        self.options = options or {}
+        self.after = tuple(after)
+        self.fallback = fallback
+
+    def local_date(self, moment):
+        """Дата момента moment в часовом поясе задачи"""
+        return moment.astimezone(self.tz).date()
+
+    def _next_moment(self, at, after):
+        if at is None:
+            return None
+        local_after = after.astimezone(self.tz)
+        for offset in range(8):
+            day = local_after.date() + timedelta(days=offset)
+            if day.weekday() not in self.weekdays:
+                continue
+            candidate = datetime.combine(day, at)
+            candidate = candidate.replace(tzinfo=self.tz) if self.tz else candidate.astimezone()
+            if candidate > after:
+                return candidate
+        return None
+
+    def next_run(self, after):
+        """Ближайший момент запуска строго позже after (aware datetime); None - задача без времени"""
+        return self._next_moment(self.at, after)
+
+    def next_fallback(self, after):
+        """Ближайший момент запасного запуска строго позже after; None - запасного запуска нет"""
+        return self._next_moment(self.fallback, after)
+
+    def describe(self):
+        days = "Ежедневно" if len(self.weekdays) == 7 else ", ".join(DAY_LABELS[day] for day in sorted(self.weekdays))
+        zone = f" ({self.tz.key})" if self.tz else ""
+        description = days
+        if self.at is not None:
+            description += f" в {self.at.isoformat()}{zone}"
+        if self.after:
+            description += f" после успешного завершения {', '.join(self.after)}"
+        if self.fallback is not None:
+            description += f", не позже {self.fallback.isoformat()}{zone}"
+        return description
+
+def load_jobs(config_path):
+    """Читает конфигурацию и возвращает список ScheduledJob. Ошибки чтения файла пробрасываются"""
+    with open(config_path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    default_tz = data.get("timezone")
+    jobs = []
+    for pub in data.get("publications", []):
+        script = pub["script_name"]
+        after = pub.get("after", [])
+        if isinstance(after, str):
+            after = [after]
+        # Задача с зависимостями без указанных дней ждет их каждый день
+        days = pub.get("days", [EVERY_DAY] if after else [])
+        if not days:
+            logger.warning(f"Для скрипта '{script}' не указаны дни для запуска.")
+            continue
+
+        weekdays = set()
+        for day_entry in days:
+            day_normalized = str(day_entry).lower()
+            if day_normalized == EVERY_DAY:
+                weekdays.update(range(7))
+            elif day_normalized in DAYS:
+                weekdays.add(DAYS[day_normalized])
+            else:
+                logger.warning(f"Неизвестный день недели или формат: '{day_entry}' для скрипта {script}")
+        if not weekdays:
+            continue
+
+        try:
+            if "time" in pub:
+                at = parse_time(pub["time"])
+            elif after:
+                at = None
+            else:
+                raise ValueError("не указано время запуска")
+            fallback = parse_time(pub["fallback_time"]) if "fallback_time" in pub else None
+            if fallback is not None and not after:
+                logger.warning(f"У '{script}' задано fallback_time без зависимостей (after), поле не используется")
+                fallback = None
+            tz_name = pub.get("timezone", default_tz)
+            tz = ZoneInfo(tz_name) if tz_name else None
+        except Exception as e:
+            logger.error(f"Пропускаем публикацию '{script}': {e}")
+            continue
+
+        options = {key: value for key, value in pub.items()
+                   if key not in ("script_name", "days", "time", "timezone", "after", "fallback_time")}
+        jobs.append(ScheduledJob(script, weekdays, at, tz, options, after, fallback))
+    return jobs
+
+class EventScheduler:
+    """
+    Запускает задачи в моменты из кучи сроков и по завершении их зависимостей.
+    Куча, состояние зависимостей и запуск задач меняются только в потоке run_forever,
+    рабочие потоки лишь сообщают о завершении задач.
+    run_callback(job) выполняется в пуле и возвращает False (или бросает исключение) при ошибке.
+    """
+
+    def __init__(self, config_path, run_callback, watch_interval=60, on_reload=None, max_workers=4):
+        self.config_path = config_path
+        self.run_callback = run_callback
+        self.watch_interval = watch_interval
+        self.on_reload = on_reload
+        self.max_workers = max_workers
+        self._jobs = []
+        self._heap = []
+        self._counter = 0
+        self._config_mtime = None
+        self._wakeup = threading.Event()
+        self._reload_requested = False
+        self._stopped = False
+        self._executor = None
+        self._running = set()
+        # Завершенные задачи из рабочих потоков: [(задача, успех, момент завершения)]
+        self._completions = []
+        self._completions_lock = threading.Lock()
+        # Момент последнего успешного завершения скрипта
+        self._succeeded_at = {}
+        # Задачи, время которых наступило раньше, чем завершились зависимости: {скрипт: дата}
+        self._waiting = {}
+        # Дата последнего запуска задачи с зависимостями, чтобы не запускать ее дважды за день
+        self._triggered_on = {}
+
+    def _push(self, job, after, fallback=False):
+        due = job.next_fallback(after) if fallback else job.next_run(after)
+        if due is not None:
+            self._counter += 1
+            heapq.heappush(self._heap, (due.astimezone(timezone.utc), self._counter, job, fallback))
+
+    def _config_changed(self):
+        try:
+            return os.stat(self.config_path).st_mtime != self._config_mtime
+        except OSError:
+            return False
+
+    def reload(self):
+        """Перечитывает конфигурацию и пересчитывает кучу; при ошибке сохраняет прежнее расписание"""
+        try:
+            mtime = os.stat(self.config_path).st_mtime
+            jobs = load_jobs(self.config_path)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить расписание из {self.config_path}: {e}")
+            return False
+
+        now = datetime.now(timezone.utc)
+        self._config_mtime = mtime
+        self._jobs = jobs
+        self._heap = []
+        for job in jobs:
+            self._push(job, now)
+            self._push(job, now, fallback=True)
+        known = {job.script_name for job in jobs}
+        for job in jobs:
+            for dependency in job.after:
+                if dependency not in known:
+                    logger.warning(f"Задача '{job.script_name}' зависит от '{dependency}', которой нет в расписании")
+        if self.on_reload:
+            self.on_reload(jobs)
+        logger.info(f"Загружено расписание: {len(jobs)} публикаций из {self.config_path}")
+        return True
+
+    def request_reload(self):
+        """Запрашивает перезагрузку конфигурации (безопасно вызывать из обработчика сигнала)"""
+        self._reload_requested = True
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+
+    def _dependencies_met(self, job, now):
+        today = job.local_date(now)
+        return all(
+            dependency in self._succeeded_at and job.local_date(self._succeeded_at[dependency]) == today
+            for dependency in job.after
+        )
+
+    def _submit(self, job):
+        if job.script_name in self._running:
+            logger.warning(f"Задача {job.script_name} еще выполняется, новый запуск пропущен")
+            return
+        self._running.add(job.script_name)
+        future = self._executor.submit(self.run_callback, job)
+        future.add_done_callback(lambda f: self._completed(job, f))
+
+    def _completed(self, job, future):
+        # Вызывается в рабочем потоке: только передаем результат в поток планировщика
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Ошибка при выполнении {job.script_name}: {error}")
+        success = error is None and future.result() is not False
+        with self._completions_lock:
+            self._completions.append((job, success, datetime.now(timezone.utc)))
+        self._wakeup.set()
+
+    def _dispatch(self, job, now):
+        """Запускает задачу, время которой наступило, или откладывает ее до завершения зависимостей"""
+        if job.after and self._triggered_on.get(job.script_name) == job.local_date(now):
+            # Сегодня задача уже запускалась (например, запасным запуском)
+            return
+        if job.after and not self._dependencies_met(job, now):
+            self._waiting[job.script_name] = job.local_date(now)
+            logger.info(f"Задача {job.script_name} ждет успешного завершения {', '.join(job.after)}")
+            return
+        if job.after:
+            self._triggered_on[job.script_name] = job.local_date(now)
+        self._submit(job)
+
+    def _dispatch_fallback(self, job, now):
+        """Запасной запуск: выполняет задачу, если сегодня она еще не запускалась по зависимостям"""
+        today = job.local_date(now)
+        if self._triggered_on.get(job.script_name) == today:
+            return
+        logger.warning(f"Зависимости {job.script_name} ({', '.join(job.after)}) не завершились успешно "
+                       f"к {job.fallback.isoformat()}, запуск по имеющимся данным")
+        self._waiting.pop(job.script_name, None)
+        self._triggered_on[job.script_name] = today
+        self._submit(job)
+
+    def _process_completions(self):
+        with self._completions_lock:
+            completions, self._completions = self._completions, []
+        for finished, success, finished_at in completions:
+            self._running.discard(finished.script_name)
+            if not success:
+                dependents = [job.script_name for job in self._jobs if finished.script_name in job.after]
+                if dependents:
+                    logger.warning(f"{finished.script_name} завершилась с ошибкой, "
+                                   f"зависимые задачи ({', '.join(dependents)}) не запускаются")
+                continue
+            self._succeeded_at[finished.script_name] = finished_at
+            for job in self._jobs:
+                if finished.script_name not in job.after:
+                    continue
+                today = job.local_date(finished_at)
+                if today.weekday() not in job.weekdays or not self._dependencies_met(job, finished_at):
+                    continue
+                if job.at is not None:
+                    # Задача со временем запускается здесь, только если ее время уже наступило
+                    if self._waiting.get(job.script_name) != today:
+                        continue
+                    del self._waiting[job.script_name]
+                elif self._triggered_on.get(job.script_name) == today:
+                    continue
+                self._triggered_on[job.script_name] = today
+                logger.info(f"Зависимости {job.script_name} выполнены, запуск")
+                self._submit(job)
+
+    def run_forever(self):
+        self.reload()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scheduler-job")
+        try:
+            self._loop()
+        finally:
+            # Дожидаемся выполняющихся задач, чтобы они не оборвались на середине публикации
+            self._executor.shutdown(wait=True)
+
+    def _loop(self):
+        while not self._stopped:
+            if self._reload_requested or self._config_changed():
+                self._reload_requested = False
+                self.reload()
+            self._process_completions()
+
+            now = datetime.now(timezone.utc)
+            if self._heap and self._heap[0][0] <= now:
+                due, _, job, fallback = heapq.heappop(self._heap)
+                lateness = (now - due).total_seconds()
+                if lateness > 1:
+                    logger.warning(f"Задача {job.script_name} запускается с опозданием на {lateness:.1f} с")
+                if fallback:
+                    self._dispatch_fallback(job, now)
+                else:
+                    self._dispatch(job, now)
+                # Следующий запуск считается от планового момента, а не от окончания задачи
+                self._push(job, max(due, now), fallback)
+                continue
+
+            delay = (self._heap[0][0] - now).total_seconds() if self._heap else None
+            if self._heap:
+                next_job = self._heap[0][2]
+                logger.info(f"Следующая задача: {next_job.script_name} в "
+                            f"{self._heap[0][0].astimezone(next_job.tz).isoformat(timespec='seconds')}")
+            if self.watch_interval:
+                delay = self.watch_interval if delay is None else min(delay, self.watch_interval)
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
@@ -0,0 +1,320 @@
+"""
+Доставка сообщений в Telegram с учетом ограничений Bot API.
+
+Telegram допускает около 30 сообщений в секунду суммарно, не больше одного
+сообщения в секунду в один чат и не больше 20 сообщений в минуту в группу или канал.
+Вместо фиксированной паузы в 1 секунду после каждого чанка ожидание выполняется
+только тогда, когда этого требует лимит, а ответ 429 с retry_after приостанавливает
+отправку в соответствующий чат ровно на указанное время. Сообщения в разные чаты
+отправляются параллельно, в пределах одного чата порядок чанков сохраняется.
+Все чанки проходят через outbox (telegram_outbox.py), что позволяет повторять
+неудачные отправки и досылать публикацию после сбоя без дублей.
+aiohttp и SSL-контекст загружаются при первой отправке, а не при импорте модуля.
+"""
+
+import ssl
+import json
+import random
+import asyncio
+import logging
+from functools import lru_cache
+from telegram_outbox import TelegramOutbox, PENDING, SENDING, SENT, FAILED
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_MESSAGES_PER_SECOND = 30
+CHAT_MESSAGES_PER_SECOND = 1
+GROUP_MESSAGES_PER_MINUTE = 20
+MAX_RATE_LIMIT_RETRIES = 3
+
+# Повторы при временных ошибках (сеть, 5xx): задержка случайна в [0, min(MAX, BASE * 2^попытка)]
+MAX_SEND_ATTEMPTS = 5
+BACKOFF_BASE_DELAY = 1.0
+BACKOFF_MAX_DELAY = 60.0
+
+# Параметры пула соединений с api.telegram.org
+CONNECTION_POOL_SIZE = 10
+DNS_CACHE_TTL = 600
+KEEPALIVE_TIMEOUT = 60
+REQUEST_TIMEOUT = 60
+
+@lru_cache(maxsize=None)
+def get_ssl_context():
+    """
+    Исторически публикаторы отправляют запросы без проверки сертификата.
+    Контекст общий, чтобы все они использовали одно и то же соединение
+    """
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+class TokenBucket:
+    """Ограничитель скорости "маркерная корзина": rate маркеров в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Сколько секунд нужно подождать до появления свободного маркера"""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds, now):
+        """Запрещает отправку на seconds секунд (например, по retry_after из ответа 429)"""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+async def acquire(*buckets):
+    """Ждет, пока маркер появится во всех корзинах сразу, и забирает их"""
+    loop = asyncio.get_running_loop()
+    while True:
+        now = loop.time()
+        wait = max(bucket.delay(now) for bucket in buckets)
+        if wait <= 0:
+            # Между проверкой и списанием нет await, поэтому списание атомарно для event loop
+            for bucket in buckets:
+                bucket.consume(now)
+            return
+        await asyncio.sleep(wait)
+
+def is_group_chat(chat_id):
+    """Каналы (@name) и группы (отрицательный id) имеют отдельный лимит сообщений в минуту"""
+    chat_id = str(chat_id)
+    return chat_id.startswith('@') or chat_id.startswith('-')
+
+def parse_chat_ids(value):
+    """Разбирает TELEGRAM_CHANNEL_ID: один или несколько чатов через запятую"""
+    if not value:
+        return []
+    return [chat_id.strip() for chat_id in str(value).split(',') if chat_id.strip()]
+
+def _retry_after(error_text, headers):
+    """Извлекает retry_after (в секундах) из ответа 429"""
+    try:
+        return float(json.loads(error_text)['parameters']['retry_after'])
+    except (ValueError, KeyError, TypeError):
+        pass
+    try:
+        return float(headers.get('Retry-After', 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+class TelegramDelivery:
+    """Отправка чанков отчета в один или несколько чатов с соблюдением лимитов Telegram"""
+
+    def __init__(self, bot_token, global_rate=GLOBAL_MESSAGES_PER_SECOND,
+                 chat_rate=CHAT_MESSAGES_PER_SECOND, group_per_minute=GROUP_MESSAGES_PER_MINUTE):
+        self.api_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        self.chat_rate = chat_rate
+        self.group_per_minute = group_per_minute
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self._chat_buckets = {}
+
+    def _buckets_for(self, chat_id):
+        if chat_id not in self._chat_buckets:
+            buckets = [TokenBucket(self.chat_rate)]
+            if is_group_chat(chat_id):
+                buckets.append(TokenBucket(self.group_per_minute / 60, capacity=self.group_per_minute))
+            self._chat_buckets[chat_id] = buckets
+        return self._chat_buckets[chat_id]
+
+    async def post(self, session, chat_id, text):
+        """Отправляет одно сообщение. Возвращает (успех, HTTP-статус, текст ошибки)"""
+        chat_buckets = self._buckets_for(chat_id)
+        loop = asyncio.get_running_loop()
+        status, error_text = None, None
+        for _ in range(MAX_RATE_LIMIT_RETRIES + 1):
+            await acquire(self.global_bucket, *chat_buckets)
+            async with session.post(self.api_url, json={"chat_id": chat_id, "text": text}) as response:
+                status = response.status
+                if status == 200:
+                    return True, status, None
+                error_text = await response.text()
+                if status != 429:
+                    return False, status, error_text
+                retry_after = _retry_after(error_text, response.headers)
+
+            logger.warning(f"Telegram ограничил частоту отправки в {chat_id}, повтор через {retry_after} с")
+            now = loop.time()
+            for bucket in chat_buckets:
+                bucket.block(retry_after, now)
+        return False, status, error_text
+
+    async def _send_entry(self, session, outbox, publication_id, chat_id, seq, total, text):
+        """
+        Отправляет один чанк из outbox с повторами и экспоненциальной задержкой со случайным разбросом.
+        Возвращает True - доставлен, False - отклонен Telegram окончательно, None - остался в очереди.
+        """
+        import aiohttp
+
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            outbox.mark(publication_id, chat_id, seq, SENDING)
+            try:
+                ok, status, error_text = await self.post(session, chat_id, text)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                ok, status, error_text = False, None, f"{type(e).__name__}: {e}"
+
+            if ok:
+                outbox.mark(publication_id, chat_id, seq, SENT)
+                logger.info(f"Часть {seq+1}/{total} успешно отправлена в {chat_id} ({len(text)} символов)")
+                return True
+
+            logger.error(f"Ошибка при отправке части {seq+1}/{total} в {chat_id}: {error_text}")
+
+            # Ошибки 4xx (кроме 429) повторять бессмысленно: пробуем сокращенную версию, как и раньше
+            if status is not None and 400 <= status < 500 and status != 429:
+                if len(text) > 1000:
+                    shortened = text[:950] + "... (сообщение сокращено)"
+                    logger.info("Пытаемся отправить сокращенную версию чанка")
+                    ok, _, short_error = await self.post(session, chat_id, shortened)
+                    if ok:
+                        outbox.mark(publication_id, chat_id, seq, SENT, error=f"отправлена сокращенная версия: {error_text}")
+                        logger.info("Сокращенная версия чанка успешно отправлена")
+                        return True
+                    logger.error(f"Не удалось отправить даже сокращенную версию: {short_error}")
+                outbox.mark(publication_id, chat_id, seq, FAILED, error=error_text)
+                return False
+
+            outbox.mark(publication_id, chat_id, seq, PENDING, error=error_text)
+            if attempt + 1 < MAX_SEND_ATTEMPTS:
+                delay = random.uniform(0, min(BACKOFF_MAX_DELAY, BACKOFF_BASE_DELAY * 2 ** attempt))
+                logger.info(f"Повторная отправка части {seq+1}/{total} в {chat_id} через {delay:.1f} с")
+                await asyncio.sleep(delay)
+        return None
+
+    async def send_pending(self, session, outbox, publication_id, chat_id):
+        """
+        Последовательно отправляет неотправленные чанки публикации в один чат.
+        Если чанк не удалось доставить из-за временной ошибки, отправка в этот чат
+        останавливается, чтобы не нарушить порядок частей: остаток будет отправлен
+        при следующем запуске. Возвращает True, если в чате не осталось неотправленных частей.
+        """
+        total = outbox.total(publication_id, chat_id)
+        for seq, text in outbox.unsent(publication_id, chat_id):
+            try:
+                result = await self._send_entry(session, outbox, publication_id, chat_id, seq, total, text)
+            except Exception as e:
+                outbox.mark(publication_id, chat_id, seq, PENDING, error=str(e))
+                logger.error(f"Ошибка при отправке части {seq+1}/{total} в {chat_id}: {e}")
+                result = None
+            if result is None:
+                logger.error(f"Отправка в {chat_id} приостановлена на части {seq+1}/{total}, "
+                             f"остаток публикации {publication_id} будет отправлен при следующем запуске")
+                return False
+        logger.info(f"Публикация {publication_id} в {chat_id} завершена")
+        return True
+
+class TelegramClient:
+    """
+    Долгоживущий клиент Bot API: пул соединений с keep-alive и кэшем DNS.
+    Один клиент на токен и event loop используется всеми публикаторами процесса,
+    поэтому повторные публикации не платят за DNS, TCP и TLS заново,
+    а лимиты Telegram учитываются общими для всех отправок бота.
+    """
+
+    def __init__(self, bot_token, ssl=None, outbox=None):
+        self.delivery = TelegramDelivery(bot_token)
+        self.ssl = ssl
+        self._outbox = outbox
+        self._session = None
+
+    @property
+    def outbox(self):
+        if self._outbox is None:
+            self._outbox = TelegramOutbox()
+        return self._outbox
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(
+                ssl=self.ssl,
+                limit=CONNECTION_POOL_SIZE,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            )
+        return self._session
+
+    async def _send_publication(self, session, publication_id):
+        """Отправляет публикацию из outbox во все ее чаты параллельно. True - все части доставлены"""
+        results = await asyncio.gather(*(
+            self.delivery.send_pending(session, self.outbox, publication_id, chat_id)
+            for chat_id in self.outbox.chat_ids(publication_id)
+        ))
+        return all(results)
+
+    async def deliver(self, chat_ids, chunks, publisher='default'):
+        """
+        Ставит чанки в outbox и отправляет их во все чаты параллельно.
+        Незавершенная публикация того же публикатора сначала досылается, и только после
+        этого в очередь ставится новая. True возвращается, только если доставлена новая публикация.
+        """
+        session = self.session
+        while (previous := self.outbox.unfinished_publication(publisher)) is not None:
+            if not await self._send_publication(session, previous):
+                logger.error(f"Публикация {previous} не дослана до конца, новая публикация {publisher} не отправлена")
+                return False
+        publication_id = self.outbox.create_publication(publisher, chat_ids, chunks)
+        return await self._send_publication(session, publication_id)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self._outbox is not None:
+            self._outbox.close()
+            self._outbox = None
+
+# Клиенты привязаны к event loop, в котором созданы их сессии
+_clients = {}
+
+def get_telegram_client(bot_token, ssl=None):
+    """Возвращает общий клиент для токена в текущем event loop, создавая его при первом обращении"""
+    loop = asyncio.get_running_loop()
+    # Клиенты закрытых циклов (например, после asyncio.run) больше не пригодны
+    for key in [key for key in _clients if key[0].is_closed()]:
+        del _clients[key]
+    key = (loop, bot_token, id(ssl))
+    if key not in _clients:
+        _clients[key] = TelegramClient(bot_token, ssl=ssl)
+    return _clients[key]
+
+async def close_telegram_clients():
+    """Закрывает соединения всех клиентов текущего event loop"""
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _clients if key[0] is loop]:
+        await _clients.pop(key).close()
+
+def run_standalone(coroutine):
+    """
+    Выполняет main() публикатора, запущенного отдельным скриптом, в собственном event loop
+    и закрывает его клиентов по завершении. В процессе планировщика клиенты общие
+    для всех задач и закрываются только при его остановке (InProcessRunner.close).
+    """
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await close_telegram_clients()
+    return asyncio.run(run())
@@ -0,0 +1,137 @@
+"""
+Надежная очередь исходящих сообщений (outbox) для публикаций в Telegram.
+
+Каждый чанк публикации записывается в локальную базу SQLite с порядковым номером
+и статусом до отправки. Если запуск упал или был прерван, следующий запуск того же
+публикатора продолжает с первого неотправленного чанка, не публикуя повторно уже
+отправленные части. Текст проблемных чанков и последняя ошибка хранятся в той же
+базе, поэтому отдельные файлы error_chunk_*.txt больше не создаются.
+"""
+
+import os
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PATH = os.getenv('TELEGRAM_OUTBOX_PATH', os.path.join('outbox', 'telegram_outbox.sqlite3'))
+
+# Незавершенная публикация старше этого срока не возобновляется, а считается брошенной
+RESUME_WINDOW_HOURS = float(os.getenv('TELEGRAM_RESUME_WINDOW_HOURS', '12'))
+
+# Статусы чанка: pending - ждет отправки, sending - запрос отправлен, ответ не получен,
+# sent - доставлен, failed - отклонен Telegram без возможности повтора,
+# abandoned - публикация не была завершена в пределах окна возобновления
+PENDING, SENDING, SENT, FAILED, ABANDONED = 'pending', 'sending', 'sent', 'failed', 'abandoned'
+UNSENT_STATUSES = (PENDING, SENDING)
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS outbox (
+    publication_id TEXT NOT NULL,
+    publisher TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (publication_id, chat_id, seq)
+);
+CREATE INDEX IF NOT EXISTS outbox_publisher_status_idx ON outbox (publisher, status);
+"""
+
+class TelegramOutbox:
+    """Хранилище чанков публикаций со статусами доставки"""
+
+    def __init__(self, path=OUTBOX_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # Каждое изменение статуса фиксируется сразу, чтобы пережить аварийное завершение процесса
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.executescript(SCHEMA_SQL)
+
+    def unfinished_publication(self, publisher):
+        """
+        Идентификатор незавершенной публикации публикатора в пределах окна возобновления или None.
+        Более старые незавершенные публикации помечаются брошенными.
+        """
+        now = datetime.now()
+        self._abandon_stale(publisher, now)
+
+        row = self.conn.execute(
+            "SELECT publication_id, COUNT(*) FROM outbox WHERE publisher = ? AND status IN (?, ?) "
+            "GROUP BY publication_id ORDER BY MIN(created_at) DESC LIMIT 1",
+            (publisher, *UNSENT_STATUSES),
+        ).fetchone()
+        if row is None:
+            return None
+        publication_id, remaining = row
+        logger.warning(f"Возобновляем незавершенную публикацию {publication_id}: осталось отправить {remaining} частей")
+        return publication_id
+
+    def create_publication(self, publisher, chat_ids, chunks):
+        """Ставит чанки новой публикации в очередь и возвращает ее идентификатор"""
+        now = datetime.now()
+        publication_id = f"{publisher}_{now.strftime('%Y%m%d_%H%M%S_%f')}"
+        timestamp = now.isoformat()
+        self.conn.executemany(
+            "INSERT INTO outbox (publication_id, publisher, chat_id, seq, text, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (publication_id, publisher, str(chat_id), seq, text, PENDING, timestamp, timestamp)
+                for chat_id in chat_ids
+                for seq, text in enumerate(chunks)
+            ],
+        )
+        return publication_id
+
+    def _abandon_stale(self, publisher, now):
+        threshold = (now - timedelta(hours=RESUME_WINDOW_HOURS)).isoformat()
+        cursor = self.conn.execute(
+            "UPDATE outbox SET status = ?, updated_at = ? "
+            "WHERE publisher = ? AND status IN (?, ?) AND created_at < ?",
+            (ABANDONED, now.isoformat(), publisher, *UNSENT_STATUSES, threshold),
+        )
+        if cursor.rowcount:
+            logger.warning(f"Пропущено {cursor.rowcount} неотправленных частей публикаций старше {RESUME_WINDOW_HOURS} ч")
+
+    def chat_ids(self, publication_id):
+        rows = self.conn.execute(
+            "SELECT DISTINCT chat_id FROM outbox WHERE publication_id = ? ORDER BY chat_id", (publication_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def unsent(self, publication_id, chat_id):
+        """Неотправленные чанки чата в порядке номеров: [(seq, text), ...]"""
+        rows = self.conn.execute(
+            "SELECT seq, text, status FROM outbox WHERE publication_id = ? AND chat_id = ? AND status IN (?, ?) "
+            "ORDER BY seq",
+            (publication_id, str(chat_id), *UNSENT_STATUSES),
+        ).fetchall()
+        for seq, _, status in rows:
+            if status == SENDING:
+                # Запрос ушел, но ответ не был получен - Telegram мог успеть опубликовать сообщение
+                logger.warning(f"Часть {seq + 1} для {chat_id} могла быть отправлена до сбоя, отправляем повторно")
+        return [(seq, text) for seq, text, _ in rows]
+
+    def total(self, publication_id, chat_id):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM outbox WHERE publication_id = ? AND chat_id = ?", (publication_id, str(chat_id))
+        ).fetchone()[0]
+
+    def mark(self, publication_id, chat_id, seq, status, error=None):
+        """Обновляет статус чанка; при переходе в sending увеличивает счетчик попыток"""
+        self.conn.execute(
+            "UPDATE outbox SET status = ?, last_error = COALESCE(?, last_error), updated_at = ?, "
+            "attempts = attempts + CASE WHEN ? = ? THEN 1 ELSE 0 END "
+            "WHERE publication_id = ? AND chat_id = ? AND seq = ?",
+            (status, error, datetime.now().isoformat(), status, SENDING, publication_id, str(chat_id), seq),
+        )
+
+    def close(self):
+        self.conn.close()
@@ -5,101 +5,18 @@
 import os
 import logging
 import asyncio
-import ssl
-import re
-import html
 from datetime import datetime
-from dotenv import load_dotenv
-import aiohttp
-from find_cheapest_apartments import find_cheapest_apartments
-
-# Загрузка переменных окружения
-load_dotenv()
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from telegram_delivery import get_telegram_client, parse_chat_ids, get_ssl_context
+from telegram_text import (
+    split_text_into_chunks, utf16_length, truncate_utf16, sanitize_text,
+    TELEGRAM_MAX_MESSAGE_LENGTH, SANITIZE_PER_FIELD,
 )
-logger = logging.getLogger(__name__)
-
-# Создаем SSL-контекст
-ssl_context = ssl.create_default_context()
-ssl_context.check_hostname = False
-ssl_context.verify_mode = ssl.CERT_NONE
+from find_cheapest_apartments import find_cheapest_apartments, REPORT_NAME
 
-# Параметры подключения к базе данных из .env
-DB_PARAMS = {
-    'dbname': os.getenv('DB_NAME', 'postgres'),
-    'user': os.getenv('DB_USER', 'Admin'),
-    'password': os.getenv('DB_PASSWORD', 'Enclude79'),
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'port': os.getenv('DB_PORT', '5432')
-}
+logger = logging.getLogger(__name__)
 
-def clean_html_and_sanitize(text):
-    """
-    Очищает текст от HTML-тегов и специальных символов, 
-    которые могут вызывать проблемы в Telegram.
-    """
-    # Декодируем HTML-сущности (например, &quot; -> ")
-    text = html.unescape(text)
-    
-    # Удаляем все HTML-теги (например, <b>текст</b> -> текст)
-    text = re.sub(r'<[^>]+>', '', text)
-    
-    # Заменяем специальные символы, которые могут вызывать проблемы
-    text = text.replace('&', '&amp;')
-    text = text.replace('<', '&lt;')
-    text = text.replace('>', '&gt;')
-    
-    # Удаляем невидимые управляющие символы
-    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F]', '', text)
-    
-    return text
-
-def split_text_into_chunks(text, max_length=3000):
-    """
-    Разбивает текст на чанки, стараясь делать разрывы на переносах строк
-    и не разрывать слова.
-    """
-    chunks = []
-    current_chunk = ""
-    
-    paragraphs = text.split('\n')
-    
-    for paragraph in paragraphs:
-        # Если параграф слишком большой, разбиваем его на предложения
-        if len(paragraph) > max_length:
-            sentences = re.split(r'(?<=[.!?])\s+', paragraph)
-            for sentence in sentences:
-                # Если предложение слишком большое, разбиваем его на части
-                if len(sentence) > max_length:
-                    words = sentence.split(' ')
-                    for word in words:
-                        if len(current_chunk) + len(word) + 1 > max_length:
-                            chunks.append(current_chunk.strip())
-                            current_chunk = word + " "
-                        else:
-                            current_chunk += word + " "
-                # Иначе добавляем предложение целиком
-                elif len(current_chunk) + len(sentence) + 1 > max_length:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = sentence + " "
-                else:
-                    current_chunk += sentence + " "
-        # Если параграф помещается целиком
-        elif len(current_chunk) + len(paragraph) + 1 > max_length:
-            chunks.append(current_chunk.strip())
-            current_chunk = paragraph + "\n"
-        else:
-            current_chunk += paragraph + "\n"
-    
-    # Добавляем последний чанк, если он не пустой
-    if current_chunk.strip():
-        chunks.append(current_chunk.strip())
-    
-    return chunks
+# Имя публикатора в outbox: по нему незавершенная публикация досылается при следующем запуске
+PUBLISHER_NAME = os.path.splitext(os.path.basename(__file__))[0]
 
 class TelegramPublisher:
     """Класс для публикации результатов анализа в Telegram"""
@@ -108,7 +25,7 @@ class TelegramPublisher:
         """Инициализация класса"""
         self.bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
         self.chat_id = os.getenv('TELEGRAM_CHANNEL_ID')
-        self.api_url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
+        self.chat_ids = parse_chat_ids(self.chat_id)
         # Отладочный вывод
         print(f"TELEGRAM_BOT_TOKEN: {self.bot_token}")
         print(f"TELEGRAM_CHANNEL_ID: {self.chat_id}")
@@ -116,86 +33,49 @@ class TelegramPublisher:
     async def send_message(self, text):
         """Отправляет сообщение в Telegram, разбивая на части"""
         # Очищаем текст от HTML-тегов и специальных символов
-        text = clean_html_and_sanitize(text)
+        # (при SANITIZE_PER_FIELD поля объявлений уже очищены при сборке отчета)
+        if not SANITIZE_PER_FIELD:
+            text = sanitize_text(text)
         
         # Используем улучшенный алгоритм разбиения текста
         chunks = split_text_into_chunks(text, max_length=3000)
         
+        # Добавляем заголовок к первому чанку и подпись к последнему
+        prepared = []
+        for i, chunk in enumerate(chunks):
+            # Для первого чанка добавляем заголовок
+            if i == 0:
+                chunk = f"📊 Анализ квартир до 40 кв.м. - {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n" + chunk
+
+            # Для последнего чанка добавляем хэштеги
+            if i == len(chunks) - 1:
+                chunk = chunk + "\n\n#недвижимость #анализ #инвестиции"
+
+            # Проверка длины каждого чанка перед отправкой (Telegram считает длину в UTF-16)
+            chunk_length = utf16_length(chunk)
+            if chunk_length > TELEGRAM_MAX_MESSAGE_LENGTH:
+                logger.warning(f"Чанк {i+1} слишком длинный ({chunk_length} символов UTF-16), обрезаем до {TELEGRAM_MAX_MESSAGE_LENGTH}")
+                chunk = truncate_utf16(chunk, TELEGRAM_MAX_MESSAGE_LENGTH - 3) + "..."
+            
+            prepared.append(chunk)
+        
         try:
-            connector = aiohttp.TCPConnector(ssl=ssl_context)
-            async with aiohttp.ClientSession(connector=connector) as session:
-                # Отправляем каждый чанк
-                for i, chunk in enumerate(chunks):
-                    # Для первого чанка добавляем заголовок
-                    if i == 0:
-                        chunk = f"📊 Анализ квартир до 40 кв.м. - {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n" + chunk
-                    
-                    # Для последнего чанка добавляем хэштеги
-                    if i == len(chunks) - 1:
-                        chunk = chunk + "\n\n#недвижимость #анализ #инвестиции"
-                    
-                    # Проверка длины каждого чанка перед отправкой
-                    if len(chunk) > 4000:
-                        logger.warning(f"Чанк {i+1} слишком длинный ({len(chunk)} символов), обрезаем до 4000 символов")
-                        chunk = chunk[:3997] + "..."
-                    
-                    try:
-                        async with session.post(
-                            self.api_url,
-                            json={
-                                "chat_id": self.chat_id,
-                                "text": chunk
-                            }
-                        ) as response:
-                            if response.status == 200:
-                                logger.info(f"Часть {i+1}/{len(chunks)} успешно отправлена в Telegram ({len(chunk)} символов)")
-                            else:
-                                error_text = await response.text()
-                                logger.error(f"Ошибка при отправке части {i+1}/{len(chunks)}: {error_text}")
-                                
-                                # Сохраняем проблемный чанк в файл для диагностики
-                                error_file = f"error_chunk_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{i}.txt"
-                                with open(error_file, 'w', encoding='utf-8') as f:
-                                    f.write(chunk)
-                                logger.info(f"Проблемный чанк сохранен в файл: {error_file}")
-                                
-                                # Пытаемся отправить сокращенную версию
-                                if len(chunk) > 1000:
-                                    shortened = chunk[:950] + "... (сообщение сокращено)"
-                                    logger.info("Пытаемся отправить сокращенную версию чанка")
-                                    async with session.post(
-                                        self.api_url,
-                                        json={
-                                            "chat_id": self.chat_id,
-                                            "text": shortened
-                                        }
-                                    ) as retry_response:
-                                        if retry_response.status == 200:
-                                            logger.info("Сокращенная версия чанка успешно отправлена")
-                                        else:
-                                            logger.error(f"Не удалось отправить даже сокращенную версию: {await retry_response.text()}")
-                                            # Продолжаем с следующим чанком, не останавливаемся
-                        
-                        # Небольшая пауза между отправками
-                        await asyncio.sleep(1)
-                        
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке части {i+1}/{len(chunks)}: {e}")
-                        # Продолжаем с следующим чанком, не останавливаемся
-                
-                logger.info(f"Успешно отправлено {len(chunks)} частей сообщения")
-                return True
-                
+            # Отправка через общий клиент с пулом соединений, с учетом лимитов Telegram,
+            # в несколько каналов - параллельно
+            client = get_telegram_client(self.bot_token, ssl=get_ssl_context())
+            return await client.deliver(self.chat_ids, prepared, publisher=PUBLISHER_NAME)
         except Exception as e:
             logger.error(f"Ошибка при отправке сообщения в Telegram: {e}")
             return False
 
-    async def publish_analysis(self):
-        """Публикует результаты анализа в Telegram"""
+    async def publish_analysis(self, from_snapshot=None):
+        """Публикует результаты анализа в Telegram (from_snapshot - по сохраненному снимку данных)"""
         try:
             # Получаем анализ
             logger.info("Получение анализа квартир...")
-            analysis = find_cheapest_apartments()
+            # Запросы к базе и pandas выполняются в отдельном потоке, чтобы не блокировать event loop
+            # (важно, когда планировщик запускает несколько публикаторов в одном процессе)
+            analysis = await asyncio.to_thread(find_cheapest_apartments, from_snapshot=from_snapshot)
             
             if not analysis:
                 logger.error("Не удалось получить анализ")
@@ -205,11 +85,20 @@ class TelegramPublisher:
             logger.info(f"Первые 100 символов анализа: {analysis[:100]}")
             logger.info(f"Общая длина анализа: {len(analysis)} символов")
             
+            # Если отобранные объявления не изменились с последней публикации,
+            # публикация пропускается или сокращается (REPORT_UNCHANGED_MODE)
+            from render_cache import ReportCache, text_to_publish
+            cache = ReportCache(REPORT_NAME)
+            analysis = text_to_publish(cache, analysis)
+            if analysis is None:
+                return True
+            
             # Отправляем сообщение
             logger.info("Отправка анализа в Telegram...")
             success = await self.send_message(analysis)
             
             if success:
+                cache.mark_published()
                 logger.info("Анализ успешно опубликован в Telegram")
             else:
                 logger.error("Ошибка при публикации анализа в Telegram")
@@ -220,15 +109,33 @@ class TelegramPublisher:
             logger.error(f"Ошибка при публикации анализа: {e}")
             return False
 
-async def main():
-    """Основная функция"""
+async def main(from_snapshot=None):
+    """
+    Основная функция (from_snapshot - построить отчет по сохраненному снимку данных, см. report_snapshot.py).
+    Возвращает True, если публикация отправлена (или пропущена как неизменившаяся)
+    """
+    from dotenv import load_dotenv
+
+    # Загрузка переменных окружения
+    load_dotenv()
     logger.info("Запуск скрипта публикации анализа в Telegram")
     publisher = TelegramPublisher()
-    success = await publisher.publish_analysis()
+    # Соединения с Telegram не закрываются: в процессе планировщика они общие для всех задач
+    success = await publisher.publish_analysis(from_snapshot=from_snapshot)
     if success:
         print("Анализ успешно опубликован в Telegram")
     else:
         print("Ошибка при публикации анализа в Telegram")
+    return success
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    import sys
+    import argparse
+    from load_env import configure_logging
+    from report_snapshot import add_snapshot_argument
+    from telegram_delivery import run_standalone
+
+    parser = add_snapshot_argument(argparse.ArgumentParser(description="Публикация самых дешевых квартир до 40 кв.м. в Telegram"))
+    args = parser.parse_args()
+    configure_logging()
+    sys.exit(0 if run_standalone(main(from_snapshot=args.from_snapshot)) else 1)
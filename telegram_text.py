@@ -0,0 +1,140 @@
+"""
+Подготовка текста отчетов к отправке в Telegram.
+
+Telegram ограничивает сообщение 4096 символами, причем считает их в кодовых
+единицах UTF-16: эмодзи вроде 📊 занимает две единицы, а не одну.
+
+Очистка текста (sanitize_text) - HTML-сущности декодируются, теги удаляются
+одним скомпилированным выражением, а экранирование &, <, > и удаление
+управляющих символов выполняются за один проход по готовой таблице замен.
+С SANITIZE_PER_FIELD=1 публикаторы очищают только поля объявлений
+(sanitize_fields) до сборки отчета, а не весь текст перед отправкой.
+"""
+
+import os
+import re
+import html
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+# Разделители в порядке уменьшения "крупности": пустая строка между блоками
+# объявлений, перевод строки, пробелы между словами
+_BLOCK_SEPARATOR = re.compile(r'\n\s*\n')
+_LINE_SEPARATOR = re.compile(r'\n')
+_WORD_SEPARATOR = re.compile(r'\s+')
+_SEPARATORS = (_BLOCK_SEPARATOR, _LINE_SEPARATOR, _WORD_SEPARATOR)
+
+_LEADING_SPACE = re.compile(r'\s*')
+
+_HTML_TAG = re.compile(r'<[^>]+>')
+
+# Таблица замен: экранирование специальных символов и удаление невидимых
+# управляющих символов. Применяется одним выражением по классу символов:
+# str.translate с многосимвольными заменами на кириллическом тексте в разы медленнее
+_SANITIZE_TABLE = {
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    **{chr(code): '' for code in (*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), *range(0x7F, 0xA0))},
+}
+_SANITIZE_CHARS = re.compile('[' + ''.join(map(re.escape, _SANITIZE_TABLE)) + ']')
+
+def _sanitize_char(match):
+    return _SANITIZE_TABLE[match.group()]
+
+# Поля объявлений, в которых может оказаться разметка из API
+SANITIZED_FIELDS = ('title', 'location', 'neighbourhood', 'city', 'property_url')
+
+SANITIZE_PER_FIELD = os.getenv('SANITIZE_PER_FIELD', '0').lower() in ('1', 'true', 'yes')
+
+def utf16_length(text):
+    """Длина текста в кодовых единицах UTF-16 - так ее считает Telegram"""
+    return len(text.encode('utf-16-le')) // 2
+
+def truncate_utf16(text, max_units):
+    """Обрезает текст до max_units кодовых единиц UTF-16, не разрывая суррогатные пары"""
+    if utf16_length(text) <= max_units:
+        return text
+    return text.encode('utf-16-le')[:2 * max_units].decode('utf-16-le', errors='ignore')
+
+def _hard_cut(text, start, end, max_length):
+    """Режет фрагмент без разделителей на куски не длиннее max_length единиц UTF-16"""
+    pos = start
+    while pos < end:
+        piece = truncate_utf16(text[pos:min(pos + max_length, end)], max_length) or text[pos]
+        yield pos, pos + len(piece), utf16_length(piece)
+        pos += len(piece)
+
+def _atoms(text, start, end, max_length, level=0):
+    """
+    Разбивает text[start:end] на неделимые фрагменты (начало, конец, длина в UTF-16).
+    Фрагмент делится более мелким разделителем, только если сам не помещается в max_length,
+    поэтому блок объявления разрывается лишь тогда, когда он один длиннее сообщения.
+    """
+    pos = start
+    for match in _SEPARATORS[level].finditer(text, start, end):
+        yield from _atom(text, pos, match.start(), max_length, level)
+        pos = match.end()
+    yield from _atom(text, pos, end, max_length, level)
+
+def _atom(text, start, end, max_length, level):
+    if start >= end:
+        return
+    units = utf16_length(text[start:end])
+    if units <= max_length:
+        yield start, end, units
+    elif level + 1 < len(_SEPARATORS):
+        yield from _atoms(text, start, end, max_length, level + 1)
+    else:
+        yield from _hard_cut(text, start, end, max_length)
+
+def split_text_into_chunks(text, max_length=3000):
+    """
+    Разбивает текст на чанки не длиннее max_length кодовых единиц UTF-16.
+    Разрывы делаются между блоками объявлений (по пустым строкам), а если блок
+    не помещается целиком - по строкам, затем по словам. Работает за линейное время:
+    чанки собираются по смещениям в исходном тексте без конкатенации строк.
+    """
+    start = _LEADING_SPACE.match(text).end()
+    end = len(text.rstrip())
+
+    chunks = []
+    chunk_start = chunk_end = None
+    chunk_units = 0
+    for atom_start, atom_end, units in _atoms(text, start, end, max_length):
+        if chunk_start is None:
+            chunk_start, chunk_end, chunk_units = atom_start, atom_end, units
+            continue
+        # Разделитель между фрагментами состоит из пробельных символов,
+        # поэтому его длина в UTF-16 равна числу символов
+        added = (atom_start - chunk_end) + units
+        if chunk_units + added > max_length:
+            chunks.append(text[chunk_start:chunk_end])
+            chunk_start, chunk_end, chunk_units = atom_start, atom_end, units
+        else:
+            chunk_end = atom_end
+            chunk_units += added
+
+    if chunk_start is not None:
+        chunks.append(text[chunk_start:chunk_end])
+    return chunks
+
+def sanitize_text(text):
+    """
+    Очищает текст от HTML-тегов и специальных символов,
+    которые могут вызывать проблемы в Telegram.
+    """
+    # Декодируем HTML-сущности (например, &quot; -> "), затем удаляем теги
+    # (например, <b>текст</b> -> текст)
+    text = _HTML_TAG.sub('', html.unescape(text))
+    return _SANITIZE_CHARS.sub(_sanitize_char, text)
+
+def sanitize_fields(df, columns=SANITIZED_FIELDS):
+    """Возвращает копию df, в которой очищены текстовые поля объявлений из columns"""
+    present = [column for column in columns if column in df.columns]
+    if not present:
+        return df
+    return df.assign(**{
+        column: df[column].map(lambda value: sanitize_text(value) if isinstance(value, str) else value)
+        for column in present
+    })